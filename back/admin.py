@@ -1,6 +1,6 @@
 from typing import Any
 
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.http.request import HttpRequest
 
 from .models import Server, Tool, TypeChoice
@@ -26,9 +26,10 @@ class ToolAdmin(admin.ModelAdmin):
     search_fields = ('name',)
     search_help_text = '按功能搜索'
     ordering = ['id']
+    actions = ['analysis']
     fieldsets = [
         ('详细数据', {"fields": ['name', 'type', 'cmd']}),
-        ('时间记录', {"classes": ['collapse'], "fields": readonly_fields})
+        ('时间记录', {"classes": ['collapse'], "fields": ['create_time', 'update_time']})
     ]
 
     def abbr(self, tool: Tool) -> str:
@@ -41,6 +42,20 @@ class ToolAdmin(admin.ModelAdmin):
             return str(e)
     abbr.short_description = '运行参数需求'
 
+    def analysis(self, request: HttpRequest, queryset) -> None:
+        '''
+        后台操作：在模拟agent上以默认参数试运行选中的代码，提示请求次数和循环内的逐次请求
+        '''
+        for tool in queryset:
+            try:
+                report = tool.analyze()
+            except Exception as e:
+                self.message_user(request, f'{tool.name}: {e}', messages.ERROR)
+                continue
+            level = messages.WARNING if report.error or report.loops() else messages.INFO
+            self.message_user(request, f'{tool.name}: {report}', level)
+    analysis.short_description = '分析请求开销'
+
     def __str__(self):
         return '测试功能'
 
@@ -5,3 +5,36 @@ class BackConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'back'
     verbose_name = '后台测试'
+
+    def ready(self) -> None:
+        '''
+        配置agent连接池，`settings.AGENT_POOL`可选项：`maxsize`, `idle`, `prewarm`
+
+        `prewarm`启用时，在收到第一个请求后于后台线程预热，应用初始化期间不访问数据库；
+        也可以通过`python manage.py prewarm`手动预热
+        '''
+        from django.conf import settings
+        from django.core.signals import request_started
+
+        from pyava.agent import POOL
+
+        options = getattr(settings, 'AGENT_POOL', {})
+        POOL.configure(maxsize=options.get('maxsize'), idle=options.get('idle'))
+        if options.get('prewarm'):
+            request_started.connect(self._prewarm_once, dispatch_uid='back.prewarm')
+
+    def _prewarm_once(self, **kwargs) -> None:
+        import threading
+
+        from django.core.signals import request_started
+
+        if request_started.disconnect(dispatch_uid='back.prewarm'):
+            threading.Thread(target=self.prewarm, daemon=True).start()
+
+    def prewarm(self) -> None:
+        '''预热所有服务器的agent连接池'''
+        from pyava.agent import POOL
+
+        from .models import Server
+
+        POOL.prewarm(*(server.agent_url for server in Server.objects.all()))
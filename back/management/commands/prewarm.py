@@ -0,0 +1,9 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = '预热所有服务器的agent连接池'
+
+    def handle(self, *args, **options) -> None:
+        apps.get_app_config('back').prewarm()
@@ -5,6 +5,8 @@ from django.db import models
 from django.db.models import signals
 from django.forms import ValidationError
 
+from pyava.agent import TimingLabel, fanout
+from pyava.analyze import Report, analyze
 from pyava.parse import parseargs
 
 from .json import Jsonify
@@ -68,6 +70,45 @@ class Tool(models.Model, Jsonify):
         '''
         return parseargs(self.code)
 
+    def kwargs(self, raw_args: Dict[str, Any]) -> Dict[str, Any]:
+        '''按代码参数声明筛选执行参数'''
+        kwargs = {}
+        for arg in self.args():
+            name = arg['name']
+            if name in raw_args:
+                kwargs[name] = raw_args[name]
+            elif 'default' not in arg:
+                raise ValueError(f'缺少参数<{name}>')
+        return kwargs
+
+    def fanout(self, kwargs: Dict[str, Any] = None, *, servers: List['Server'] = None, workers: int = None) -> List[Dict[str, Any]]:
+        '''在多个服务器（默认所有服务器）上以参数`kwargs`并发执行代码
+
+        返回每个服务器的执行结果、异常信息和耗时
+        '''
+        if servers is None:
+            servers = list(Server.objects.all())
+        if workers is None:
+            workers = getattr(settings, 'AGENT_FANOUT_WORKERS', 8)
+        code = self.code
+
+        def labeled(*args, **kwargs):
+            with TimingLabel(self.name):
+                return code(*args, **kwargs)
+
+        results = fanout(labeled, (server.agent_url for server in servers), kwargs=kwargs, workers=workers)
+        for server, result in zip(servers, results):
+            del result['url']
+            result['sid'] = server.sid
+            result['name'] = server.name
+        return results
+
+    def analyze(self, kwargs: Dict[str, Any] = None, *, size: int = None) -> Report:
+        '''以参数`kwargs`在模拟agent上试运行代码，分析请求次数、字节数和循环内的逐次请求，参考`pyava.analyze.analyze`'''
+        if size is None:
+            size = getattr(settings, 'AGENT_ANALYZE_SIZE', 10)
+        return analyze(self.code, kwargs=kwargs, size=size)
+
     def clean(self) -> None:
         try:
             self.code
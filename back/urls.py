@@ -19,6 +19,12 @@ urlpatterns = [
     path("code/hints", views.hints, name="hints"),
     # 指定code读/写
     path('code/<int:id>', views.CodeView.as_view(), name='code'),
+    # 指定code多服务器并发执行
+    path('code/<int:id>/fanout', views.fanout, name='fanout'),
+    # agent调用耗时统计
+    path('code/timings', views.timings, name='timings'),
     # 调试草稿
     path('code/debug', views.debug, name='debug'),
+    # 调试草稿的请求开销分析
+    path('code/analyze', views.analyze, name='analyze'),
 ]
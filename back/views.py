@@ -4,7 +4,7 @@ from django.views import View
 from django.views.decorators.http import require_POST, require_safe
 
 from back.models import Server, Tool, TypeChoice
-from pyava.agent import HttpAgent
+from pyava.agent import TIMINGS, HttpAgent, TimingLabel
 
 from .json import Error, Json, json_request, json_response
 
@@ -60,21 +60,37 @@ class CodeView(View):
         if not (server := Server.objects.filter(pk=sid).first()):
             return Error('服务器不存在')
 
-        raw_args = raw_params.get('args', {})
-        args = tool.args()
-        kwargs = {}
-        for arg in args:
-            name = arg['name']
-            if name in raw_args:
-                kwargs[name] = raw_args[name]
-            elif 'default' not in arg:
-                return Error(f'缺少参数<{name}>')
-            else:
-                pass
-        with HttpAgent(server.agent_url):
+        kwargs = tool.kwargs(raw_params.get('args', {}))
+        with HttpAgent(server.agent_url), TimingLabel(tool.name):
             return Json(tool.code(**kwargs))
 
 
+@require_safe
+@json_response
+def timings(request: WSGIRequest):
+    '''进程内各指令代码、各服务器的agent调用耗时统计，可以按`tool`和`server`筛选'''
+    return Json(TIMINGS.stats(request.GET.get('tool'), request.GET.get('server')))
+
+
+@require_POST
+@json_request
+def fanout(raw_params: dict, id: int):
+    '''在多个服务器上并发执行指令代码
+
+    `sids`为空时在所有服务器上执行
+    '''
+    tool = Tool.objects.filter(pk=id).first()
+    if tool is None:
+        return Error("指令代码不存在")
+    servers = Server.objects.all()
+    if sids := raw_params.get('sids'):
+        servers = servers.filter(pk__in=sids)
+    if not (servers := list(servers)):
+        return Error('服务器不存在')
+    kwargs = tool.kwargs(raw_params.get('args', {}))
+    return Json(tool.fanout(kwargs, servers=servers))
+
+
 @require_POST
 @json_request
 def debug(draft: dict):
@@ -100,14 +116,16 @@ def debug(draft: dict):
         agent = DebugAgent(True)
     with agent:
         tool = Tool(cmd=raw_code)
-        args = tool.args()
-        kwargs = {}
-        for arg in args:
-            name = arg['name']
-            if name in raw_args:
-                kwargs[name] = raw_args[name]
-            elif 'default' not in arg:
-                return Error(f'缺少参数<{name}>')
-            else:
-                pass
+        kwargs = tool.kwargs(raw_args)
         return Json(tool.code(**kwargs))
+
+
+@require_POST
+@json_request
+def analyze(draft: dict):
+    '''在模拟agent上试运行调试草稿，返回请求开销分析'''
+    if 'code' not in draft:
+        return Error("未识别的格式")
+    tool = Tool(cmd=draft["code"])
+    kwargs = tool.kwargs(draft.get('args', {}))
+    return Json(tool.analyze(kwargs, size=draft.get('size')).json())
@@ -0,0 +1,191 @@
+'''
+性能基准
+
+```
+python benchmark.py [名称 ...]
+```
+'''
+import json
+import sys
+import time
+import tracemalloc
+
+from pyava import *
+from pyava import wire
+from pyava.chains import Jsonify, Writer, transmute
+
+
+def measure(func, repeat: int = 3) -> float:
+    '''多次执行取最短耗时（秒）'''
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def long_chain(n: int):
+    '''循环构造的长调用链'''
+    node = Class('java.lang.StringBuilder').getDeclaredConstructor().newInstance()
+    for i in range(n):
+        node = node.append(i)
+    return node
+
+
+def wide_scope(n: int):
+    '''大量共享节点的作用域'''
+    scope = Scope()
+    builder = Class('java.lang.StringBuilder').getDeclaredConstructor().newInstance()
+    for i in range(n):
+        scope(builder.append(Integer(i)))
+    scope(builder.toString(), mark=True)
+    return scope.chains
+
+
+def bench_flatten():
+    '''调用链展开与序列化随节点数线性增长'''
+    print(f'{"nodes":>8} {"chain(ms)":>10} {"scope(ms)":>10} {"us/node":>8}')
+    for n in (1_000, 10_000, 100_000):
+        chain, scope = long_chain(n), wide_scope(n)
+        tc = measure(lambda: Jsonify.dumps(chain))
+        ts = measure(lambda: Jsonify.dumps(scope))
+        print(f'{n:>8} {tc * 1e3:>10.1f} {ts * 1e3:>10.1f} {tc / n * 1e6:>8.2f}')
+
+
+def player_query(pid):
+    return Class('org.GameServer.manager.PlayerManager').getInstance().getPlayer(Long(pid)).getAttributes().get('level')
+
+
+def bench_prepared():
+    '''预编译调用链与每次重建序列化的对比'''
+    n = 10_000
+    prepared = player_query(Placeholder('pid')).prepare()
+    tr = measure(lambda: [Jsonify.dumps(player_query(i)) for i in range(n)])
+    tp = measure(lambda: [prepared.bind(pid=i) for i in range(n)])
+    print(f'rebuild  {tr / n * 1e6:>8.2f} us/call')
+    print(f'prepared {tp / n * 1e6:>8.2f} us/call  x{tr / tp:.1f}')
+
+
+def bench_wire():
+    '''二进制格式与JSON格式的编解码耗时和体积对比'''
+    chains = wide_scope(10_000)
+    result = {'code': 200, 'data': [{'id': i, 'name': f'player{i}', 'level': i % 100, 'online': i % 2 == 0} for i in range(100_000)]}
+    text, data = Jsonify.dumps(chains), Jsonify.packb(chains)
+    rtext, rdata = json.dumps(result, separators=(',', ':')), wire.packb(result)
+    print(f'{"":<12} {"json":>10} {"binary":>10}')
+    print(f'{"chain(ms)":<12} {measure(lambda: Jsonify.dumps(chains)) * 1e3:>10.1f} {measure(lambda: Jsonify.packb(chains)) * 1e3:>10.1f}')
+    print(f'{"chain(KB)":<12} {len(text.encode()) / 1024:>10.1f} {len(data) / 1024:>10.1f}')
+    print(f'{"decode(ms)":<12} {measure(lambda: json.loads(rtext)) * 1e3:>10.1f} {measure(lambda: wire.unpackb(rdata)) * 1e3:>10.1f}')
+    print(f'{"result(KB)":<12} {len(rtext.encode()) / 1024:>10.1f} {len(rdata) / 1024:>10.1f}')
+    print(f'msgpack: {"c" if wire.msgpack else "python"}')
+
+
+def bench_writer():
+    '''直接写入与`JSONEncoder.default`钩子的序列化对比（不含标记扫描），输出必须逐字节一致'''
+    print(f'{"":<8} {"nodes":>8} {"mark(ms)":>9} {"encoder(ms)":>12} {"writer(ms)":>11} {"speedup":>8}')
+    cases = (
+        ('chain', long_chain),
+        ('scope', wide_scope),
+        ('query', lambda n: [player_query(i) for i in range(n // 5)]),
+    )
+    for name, build in cases:
+        for n in (10_000, 100_000):
+            chains = build(n)
+            tm = measure(lambda: transmute(chains, {}))
+
+            def encoder():
+                json.dumps(transmute(chains, markers := {}), cls=Jsonify, separators=(',', ':'), markers=markers)
+
+            def writer():
+                Writer(markers := {}).dumps(transmute(chains, markers))
+
+            assert Jsonify.dumps(chains) == json.dumps(transmute(chains, markers := {}), cls=Jsonify, separators=(',', ':'), markers=markers)
+            te, tw = measure(encoder) - tm, measure(writer) - tm
+            print(f'{name:<8} {n:>8} {tm * 1e3:>9.1f} {te * 1e3:>12.1f} {tw * 1e3:>11.1f} {te / tw:>7.2f}x')
+
+
+def bench_symbols():
+    '''符号表对调用链体积的压缩'''
+    scope = Scope()
+    for i in range(10_000):
+        scope(player_query(i))
+    chains = scope.chains
+    for name, dump in (('json', Jsonify.dumps), ('binary', Jsonify.packb)):
+        plain, table = dump(chains), dump(chains, True)
+        size = len(plain.encode() if isinstance(plain, str) else plain)
+        print(f'{name:<8} {size / 1024:>8.1f} KB -> {len(table.encode() if isinstance(table, str) else table) / 1024:>8.1f} KB')
+
+
+def allocated(func) -> tuple[int, int, object]:
+    '''执行并统计存活的内存增量和峰值（字节）'''
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        ret = func()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return current - base, peak - base, ret
+
+
+def literal_list(n: int):
+    '''大量字面量参数节点的作用域'''
+    scope = Scope()
+    scope(Class('java.util.Arrays').asList(*(Integer(i) for i in range(n))))
+    return scope.chains
+
+
+def bench_memory():
+    '''调用链节点的内存占用：构建后存活的字节数，以及序列化过程的峰值'''
+    n = 200_000
+    cases = (
+        ('chain', n + 3, lambda: long_chain(n)),
+        ('literals', 2 * n, lambda: literal_list(n)),
+    )
+    print(f'{"":<10} {"nodes":>8} {"build(B/node)":>14} {"dumps peak(B/node)":>19}')
+    for name, nodes, build in cases:
+        size, _, chains = allocated(build)
+        _, peak, _ = allocated(lambda: Jsonify.dumps(chains))
+        print(f'{name:<10} {nodes:>8} {size / nodes:>14.1f} {peak / nodes:>19.1f}')
+
+
+def bench_timing():
+    '''本地agent往返的分阶段耗时，以及计时本身的开销'''
+    from pyava.agent import TIMINGS, Timing
+    from pyava.local import LocalAgent
+
+    n = 2_000
+    TIMINGS.clear()
+    with LocalAgent():
+        for _ in range(n):
+            Class('java.util.Arrays').asList(*range(100)).size().unwrap()
+    stats, = TIMINGS.stats()
+    print(f'{"phase":<10} {"p50(us)":>8} {"p99(us)":>8} {"sum(ms)":>8}')
+    for phase, histogram in (*stats['phases'].items(), ('total', stats['total'])):
+        print(f'{phase:<10} {histogram["p50"] * 1e6:>8.0f} {histogram["p99"] * 1e6:>8.0f} {histogram["sum"] * 1e3:>8.1f}')
+
+    def timed():
+        Timing.serialized(0.0, 0.0)
+        Timing.dispatch('bench', '{}').finish({'code': 200})
+
+    with LocalAgent():
+        print(f'overhead {measure(lambda: [timed() for _ in range(n)]) / n * 1e6:.2f} us/call')
+    TIMINGS.clear()
+
+
+BENCHMARKS = {
+    'flatten': bench_flatten,
+    'prepared': bench_prepared,
+    'wire': bench_wire,
+    'symbols': bench_symbols,
+    'writer': bench_writer,
+    'memory': bench_memory,
+    'timing': bench_timing,
+}
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHMARKS:
+        print(f'[{name}]')
+        BENCHMARKS[name]()
@@ -90,6 +90,14 @@ CACHES = {
     }
 }
 
+# Agent Connection Pool
+
+AGENT_POOL = {
+    'maxsize': 10,      # 单个服务器保持的最大连接数
+    'idle': 300,        # 空闲连接池回收时间（秒）
+    'prewarm': False,   # 收到第一个请求后预热所有服务器的连接池
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -3,7 +3,8 @@ from .tools import *
 from .parse import Param, MapColumns, TableColumn
 
 __all__ = (
-    'Entry', 'Accessor', 'Local', 'Class', 'Enum', 'Scope', 'Iter', 'Empty', 'IfElse',
+    'Entry', 'Accessor', 'Local', 'Class', 'Enum', 'Scope', 'Iter', 'Projection', 'Empty', 'IfElse', 'Batch',
+    'Placeholder', 'Prepared', 'Handle',
     'Long', 'Integer', 'System', 'Objects',
     'Param', 'TableColumn', 'MapColumns'
 )
@@ -1,33 +1,63 @@
-from typing import Any, Dict, Self
+import asyncio
+import bisect
+import codecs
+import contextvars
+import copy
+import gzip
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generator, Iterable, List, Self, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING as _urllib3_encodings
 
+from . import wire
 
-class AgentThreadLocalAccessor:
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class AgentContextAccessor:
     '''
-    本地线程共享访问器
+    上下文共享访问器
+
+    基于`contextvars`，线程之间以及同一事件循环内的不同`asyncio.Task`之间互相隔离。
+    嵌套使用时按栈恢复：内层退出后重新使用外层的agent
     '''
 
-    __slots__ = 'local'
+    __slots__ = ('var', 'tokens')
 
     def __init__(self) -> None:
-        import threading
-        self.local = threading.local()
+        self.var = contextvars.ContextVar('agent', default=None)
+        self.tokens = contextvars.ContextVar('agent_tokens', default=())
 
     def __set__(self, obj, val) -> None:
         if not isinstance(val, Agent):
             raise TypeError(
                 f'agent required type <{type(obj).__name__}>, <{type(val).__name__}> found')
-        self.local.agent = val
+        self.tokens.set((*self.tokens.get(), self.var.set(val)))
 
     def __get__(self, obj, clz) -> 'Agent':
-        if hasattr(self.local, 'agent'):
-            return self.local.agent
-        return None
+        return self.var.get()
 
     def __delete__(self, obj) -> None:
-        if hasattr(self.local, 'agent'):
-            del self.local.agent
+        if not (tokens := self.tokens.get()):
+            return self.var.set(None)
+        self.tokens.set(tokens[:-1])
+        try:
+            self.var.reset(tokens[-1])
+        except ValueError:
+            # 进入和退出不在同一个上下文内，无法恢复外层
+            self.var.set(None)
 
 
 class AgentModuleAccessor:
@@ -64,15 +94,301 @@ class AgentError(BaseException):
     pass
 
 
+class ResponseCache:
+    '''agent响应缓存
+
+    以服务器和调用链序列化数据的摘要为键，按TTL过期、LRU淘汰，只缓存成功的结果。
+    一般用于只读的反射查询，通过`node.cached(ttl=...)`启用
+    '''
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Tuple[str, str], Tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(server: str, data: str | bytes) -> Tuple[str, str]:
+        if isinstance(data, str):
+            data = data.encode()
+        return server, hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    def get(self, key: Tuple[str, str]) -> Tuple[bool, Any]:
+        '''查询缓存，返回`(是否命中, 缓存值)`'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, copy.deepcopy(entry[1])
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key: Tuple[str, str], val: Any, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, copy.deepcopy(val))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+CACHE = ResponseCache()
+'''进程内共享的默认响应缓存'''
+
+
+class TimingLabel:
+    '''调用耗时统计的工具标签，模式内的agent调用按`tool`分组统计
+    ```
+    with TimingLabel('玩家查询'):
+        code()
+    ```
+    '''
+
+    _CURRENT = contextvars.ContextVar('timing_label', default=None)
+
+    __slots__ = ('tool', '_token')
+
+    def __init__(self, tool: str) -> None:
+        self.tool = tool
+        self._token = None
+
+    @classmethod
+    def current(cls) -> str | None:
+        '''当前上下文内生效的工具标签'''
+        return cls._CURRENT.get()
+
+    def __enter__(self) -> Self:
+        self._token = TimingLabel._CURRENT.set(self.tool)
+        return self
+
+    def __exit__(self, *args) -> None:
+        TimingLabel._CURRENT.reset(self._token)
+
+
+class Timing:
+    '''单次agent调用的分阶段耗时（秒，单调时钟）和数据大小（字节）
+
+    阶段依次为`PHASES`：`build`展开调用链并标记共享节点（不含代码中构造调用链的时间），`serialize`写入传输格式，
+    `network`为agent往返（非HTTP的agent为整个执行过程），`decode`解析响应。
+    序列化的耗时先暂存在当前上下文（`serialized`），由随后发出的请求计入；
+    请求发出时开始计时（`dispatch`），调用结束后提交到`TIMINGS`，未发出的序列化（例如命中缓存）不计入
+    '''
+
+    PHASES = ('build', 'serialize', 'network', 'decode')
+
+    _CURRENT = contextvars.ContextVar('timing', default=None)
+    _PENDING = contextvars.ContextVar('timing_pending', default=None)
+
+    __slots__ = ('tool', 'server', 'phases', 'request', 'response', 'code', 'start', 'total', '_last')
+
+    def __init__(self) -> None:
+        self.tool = TimingLabel.current()
+        self.server: str = None
+        self.phases: Dict[str, float] = {}
+        self.request = 0
+        self.response = 0
+        self.code: int = None
+        self.start = self._last = time.monotonic()
+        self.total = 0.0
+
+    @classmethod
+    def current(cls) -> 'Timing':
+        '''当前上下文内计时中的调用'''
+        return cls._CURRENT.get()
+
+    @classmethod
+    def serialized(cls, build: float, serialize: float) -> None:
+        '''暂存一次序列化的`build`、`serialize`耗时，多次序列化累加，由随后发出的请求计入；没有agent时不发出请求，不暂存'''
+        if Agent._SHARED is None:
+            return
+        if (phases := cls._PENDING.get()) is None:
+            cls._PENDING.set(phases := {'build': 0.0, 'serialize': 0.0})
+        phases['build'] += build
+        phases['serialize'] += serialize
+
+    @classmethod
+    def dispatch(cls, server: str, data: str | bytes) -> 'Timing':
+        '''请求发出前调用，开始当前上下文内一次调用的计时，必须以`finish`结束
+
+        暂存的序列化耗时计入本次调用，序列化与请求之间的间隔不计入任何阶段
+        '''
+        timing = cls()
+        timing.server = server
+        timing.request = len(data.encode()) if isinstance(data, str) else len(data)
+        if (phases := cls._PENDING.get()) is not None:
+            cls._PENDING.set(None)
+            timing.phases.update(phases)
+            timing.start -= sum(phases.values())
+        cls._CURRENT.set(timing)
+        return timing
+
+    @classmethod
+    def discard(cls) -> None:
+        '''放弃当前上下文内暂存的序列化耗时，用于序列化后不发出请求的调用'''
+        cls._PENDING.set(None)
+
+    def lap(self, phase: str) -> None:
+        '''上一个阶段结束（或者计时开始）至今的耗时计入`phase`'''
+        now = time.monotonic()
+        self.phases[phase] = self.phases.get(phase, 0) + now - self._last
+        self._last = now
+
+    def finish(self, ret: Dict[str, Any] = None) -> None:
+        '''调用结束，剩余耗时计入`network`，提交到`TIMINGS`'''
+        self.lap('network')
+        self.total = self._last - self.start
+        self.code = ret.get('code') if isinstance(ret, dict) else None
+        Timing._CURRENT.set(None)
+        TIMINGS.record(self)
+
+    def json(self) -> Dict[str, Any]:
+        return {
+            'tool': self.tool, 'server': self.server, 'code': self.code, 'total': self.total,
+            'phases': self.phases, 'request': self.request, 'response': self.response,
+        }
+
+
+class Histogram:
+    '''耗时直方图，按`BOUNDS`（秒）的上界分桶计数
+
+    桶从1微秒开始，覆盖进程内agent和序列化阶段的亚毫秒耗时
+    '''
+
+    BOUNDS = (0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025,
+              0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+    __slots__ = ('counts', 'count', 'sum', 'min', 'max')
+
+    def __init__(self) -> None:
+        self.counts = [0] * len(self.BOUNDS)
+        self.count = 0
+        self.sum = 0.0
+        self.min = 0.0
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.min = min(self.min, value) if self.count else value
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        '''分位数的估计值，在所在桶内线性插值，并限制在最小值和最大值之间'''
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen, lower = 0, 0.0
+        for bound, count in zip(self.BOUNDS, self.counts):
+            if count and seen + count >= rank:
+                lower, upper = max(lower, self.min), min(bound, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.max
+
+    def json(self) -> Dict[str, Any]:
+        return {
+            'count': self.count, 'sum': self.sum, 'min': self.min, 'max': self.max,
+            'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99),
+            'buckets': {str(bound): count for bound, count in zip(self.BOUNDS, self.counts) if count},
+        }
+
+
+class Timings:
+    '''进程内的agent调用耗时统计
+
+    按`(工具, 服务器)`分组，保存总耗时和各阶段耗时的`Histogram`，以及请求、响应的累计字节数。
+    `hook`注册的回调在每次调用结束后收到`Timing`，用于把耗时发送到外部的监控系统，回调的异常不影响调用
+    '''
+
+    def __init__(self) -> None:
+        self.hooks: List[Callable[[Timing], None]] = []
+        self._groups: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def hook(self, func: Callable[[Timing], None]) -> Callable[[Timing], None]:
+        '''注册回调，可以作为装饰器使用'''
+        self.hooks.append(func)
+        return func
+
+    def unhook(self, func: Callable[[Timing], None]) -> None:
+        self.hooks.remove(func)
+
+    def record(self, timing: Timing) -> None:
+        with self._lock:
+            if (group := self._groups.get(key := (timing.tool, timing.server))) is None:
+                group = self._groups[key] = {'errors': 0, 'request': 0, 'response': 0, 'total': Histogram(), 'phases': {}}
+            group['errors'] += timing.code != 200
+            group['request'] += timing.request
+            group['response'] += timing.response
+            group['total'].add(timing.total)
+            phases = group['phases']
+            for phase, elapsed in timing.phases.items():
+                if (histogram := phases.get(phase)) is None:
+                    histogram = phases[phase] = Histogram()
+                histogram.add(elapsed)
+        for hook in tuple(self.hooks):
+            try:
+                hook(timing)
+            except Exception:
+                logging.getLogger(__name__).exception('timing hook %r failed', hook)
+
+    def stats(self, tool: str = None, server: str = None) -> List[Dict[str, Any]]:
+        '''各分组的统计，可以按工具或者服务器筛选'''
+        with self._lock:
+            return [{
+                'tool': key[0], 'server': key[1], 'errors': group['errors'],
+                'request': group['request'], 'response': group['response'], 'total': group['total'].json(),
+                'phases': {phase: histogram.json() for phase, histogram in group['phases'].items()},
+            } for key, group in self._groups.items() if tool in (None, key[0]) and server in (None, key[1])]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._groups.clear()
+
+
+TIMINGS = Timings()
+'''进程内共享的调用耗时统计'''
+
+
 class Agent:
 
-    _SHARED: Self = AgentThreadLocalAccessor()
+    _SHARED: Self = AgentContextAccessor()
     '''用于从共享环境中访问特定的agent
     '''
 
+    limit: int = None
+    '''单次请求调用链的最大字节数，超过时作用域拆分为多段会话请求（`pyava.chains.chunked`），`None`表示不限制。
+    拆分需要agent实现会话协议（`stateful`），否则仍然整体发送'''
+
     @staticmethod
-    def unwrap(data) -> Any:
-        '''执行目标方法，并解包返回数据'''
+    def unwrap(data, ttl: float = None) -> Any:
+        '''执行目标方法，并解包返回数据
+
+        `ttl`不为空时，优先从`CACHE`中读取相同服务器、相同调用链的结果
+        '''
+        if ttl is not None and (agent := Agent._SHARED) is not None:
+            hit, val = CACHE.get(key := CACHE.key(agent.server, data))
+            if hit:
+                Timing.discard()
+            else:
+                CACHE.put(key, val := Agent.unwrap(data), ttl)
+            return val
         ret = Agent.invoke(data)
         if ret.get('code') == 200:
             return ret.get('data')
@@ -83,13 +399,114 @@ class Agent:
         '''执行目标方法，返回可能附带额外信息的结果'''
         agent = cls._SHARED
         if agent is not None:
-            return agent.debug(data)
+            timing, ret = Timing.dispatch(agent.label, data), None
+            try:
+                return (ret := agent.debug(data))
+            finally:
+                timing.finish(ret)
+        else:
+            return {'No Agent': data}
+
+    @staticmethod
+    async def aunwrap(data, ttl: float = None) -> Any:
+        '''异步执行目标方法，并解包返回数据，`ttl`参考`unwrap`'''
+        if ttl is not None and (agent := Agent._SHARED) is not None:
+            hit, val = CACHE.get(key := CACHE.key(agent.server, data))
+            if hit:
+                Timing.discard()
+            else:
+                CACHE.put(key, val := await Agent.aunwrap(data), ttl)
+            return val
+        ret = await Agent.ainvoke(data)
+        if ret.get('code') == 200:
+            return ret.get('data')
+        raise AgentError(ret)
+
+    @classmethod
+    async def ainvoke(cls, data):
+        '''异步执行目标方法，返回可能附带额外信息的结果'''
+        agent = cls._SHARED
+        if agent is not None:
+            timing, ret = Timing.dispatch(agent.label, data), None
+            try:
+                return (ret := await agent.adebug(data))
+            finally:
+                timing.finish(ret)
         else:
             return {'No Agent': data}
 
+    @staticmethod
+    def batch():
+        '''批量合并模式，模式内的`unwrap`合并为单次请求，参考`pyava.chains.Batch`'''
+        from .chains import Batch
+        return Batch()
+
+    @classmethod
+    def unwrap_iter(cls, data) -> Generator[Any, None, None]:
+        '''流式执行目标方法，逐个生成返回的列表元素（或字典键值对）'''
+        agent = cls._SHARED
+        if agent is None:
+            raise AgentError({'No Agent': data})
+        # 流式结果按需读取，不计入耗时统计
+        Timing.discard()
+        return agent.stream(data)
+
+    @property
+    def server(self) -> str:
+        '''agent所代表的服务器标识，用于区分缓存'''
+        return f'{self.__class__.__qualname__}@{id(self):x}'
+
+    @property
+    def label(self) -> str:
+        '''耗时统计（`TIMINGS`）中agent所属的服务器分组，进程内的agent按类型分组'''
+        return self.__class__.__qualname__
+
+    @property
+    def binary(self) -> bool:
+        '''是否使用二进制传输格式'''
+        return False
+
+    @property
+    def symbols(self) -> bool:
+        '''是否使用类名和方法名的符号表压缩调用链'''
+        return False
+
+    @property
+    def stateful(self) -> bool:
+        '''agent是否实现了会话协议，在请求之间保存`pin`句柄和分段请求的引用'''
+        return False
+
+    @property
+    def session(self) -> str:
+        '''agent会话标识，用于在agent上保存跨请求的引用（`pin`句柄、分段请求的`$n`）'''
+        if (sid := getattr(self, '_session', None)) is None:
+            sid = self._session = uuid.uuid4().hex
+        return sid
+
+    @property
+    def handles(self) -> Dict[str, float]:
+        '''会话内未过期的句柄名称及其过期时间'''
+        if (handles := getattr(self, '_handles', None)) is None:
+            handles = self._handles = {}
+        now = time.monotonic()
+        for name in [name for name, expires in handles.items() if expires <= now]:
+            del handles[name]
+        return handles
+
     def debug(self, data) -> dict[str, Any]:
         pass
 
+    def stream(self, data) -> Generator[Any, None, None]:
+        '''流式执行，默认整体执行后再拆分结果'''
+        ret = self.debug(data)
+        if ret.get('code') != 200:
+            raise AgentError(ret)
+        yield from iteritems(ret.get('data'))
+
+    async def adebug(self, data) -> dict[str, Any]:
+        '''异步执行，默认在线程池内调用同步的`debug`，不阻塞事件循环'''
+        return await asyncio.to_thread(self.debug, data)
+
     def __enter__(self) -> Self:
         '''动态自定义模块环境依赖
         '''
@@ -101,23 +518,492 @@ class Agent:
         '''
         del self._SHARED
 
+    async def __aenter__(self) -> Self:
+        '''当前异步任务上下文内使用该agent
+        '''
+        return self.__enter__()
+
+    async def __aexit__(self, *args, **kvargs) -> None:
+        self.__exit__(*args, **kvargs)
+
     def __str__(self) -> str:
         return f'{self.__class__.__name__}({self.__dict__})'
 
 
+ENCODERS: Dict[str, Callable[[bytes], bytes]] = {'gzip': gzip.compress}
+'''请求体压缩编码，按优先级倒序'''
+if zstandard is not None:
+    # zstd的压缩器实例不是线程安全的，每次压缩单独创建
+    ENCODERS['zstd'] = lambda body: zstandard.ZstdCompressor().compress(body)
+
+ACCEPT_ENCODING = ', '.join(encoding for encoding in ('zstd', 'br', 'gzip', 'deflate')
+                            if encoding in {token.strip() for token in _urllib3_encodings.split(',')})
+'''响应体可接受的压缩编码：`urllib3`能够自动解压的编码，优先`zstd`'''
+
+SYMBOLS_HEADER = 'X-Pyava-Symbols'
+'''agent声明支持符号表的响应头，值为`1`时启用'''
+
+SESSIONS_HEADER = 'X-Pyava-Sessions'
+'''agent声明支持会话协议（`pin`句柄和分段请求，参考`pyava.chains.chunked`）的响应头，值为`1`时启用'''
+
+
+class HttpPool:
+    '''HTTP连接池
+
+    按agent地址维护共享的`requests.Session`，同一进程内的请求复用keep-alive连接，
+    空闲超时的连接池会在下次访问时被回收，`acquire`借出（请求进行中）的连接池不会被回收
+    '''
+
+    def __init__(self, *, maxsize: int = 10, idle: float = 300) -> None:
+        '''初始化连接池
+
+        参数
+        ---
+        `maxsize: int`
+            单个agent地址保持的最大连接数
+        `idle: float`
+            连接池空闲回收时间（秒），`0`表示不回收
+        ---
+        '''
+        self.maxsize = maxsize
+        self.idle = idle
+        self._sessions: Dict[str, requests.Session] = {}
+        self._actives: Dict[str, float] = {}
+        self._leases: Dict[str, int] = {}
+        self._encodings: Dict[str, str] = {}
+        self._binaries: Dict[str, bool] = {}
+        self._symbols: Dict[str, bool] = {}
+        self._stateful: Dict[str, bool] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, *, maxsize: int = None, idle: float = None) -> None:
+        '''调整连接池配置，已存在的连接池会被关闭重建'''
+        if maxsize is not None:
+            self.maxsize = maxsize
+        if idle is not None:
+            self.idle = idle
+        self.close()
+
+    def session(self, url: str) -> requests.Session:
+        '''获取agent地址对应的共享会话'''
+        with self._lock:
+            return self._session(url)
+
+    def acquire(self, url: str) -> requests.Session:
+        '''借出agent地址对应的共享会话，使用结束后必须`release`，借出期间不会被回收'''
+        with self._lock:
+            session = self._session(url)
+            self._leases[url] = self._leases.get(url, 0) + 1
+        return session
+
+    def _session(self, url: str) -> requests.Session:
+        now = time.monotonic()
+        self._evict(now)
+        if (session := self._sessions.get(url)) is None:
+            session = self._sessions[url] = self._open()
+        self._actives[url] = now
+        return session
+
+    def release(self, url: str) -> None:
+        '''归还`acquire`借出的会话，空闲时间从归还时开始计算'''
+        with self._lock:
+            if (count := self._leases.get(url, 0) - 1) > 0:
+                self._leases[url] = count
+            else:
+                self._leases.pop(url, None)
+            if url in self._sessions:
+                self._actives[url] = time.monotonic()
+
+    def encoding(self, url: str) -> str | None:
+        '''agent地址支持的请求体压缩编码'''
+        return self._encodings.get(url)
+
+    def binary(self, url: str) -> bool:
+        '''agent地址是否支持二进制传输格式'''
+        return self._binaries.get(url, False)
+
+    def symbols(self, url: str) -> bool:
+        '''agent地址是否支持符号表'''
+        return self._symbols.get(url, False)
+
+    def stateful(self, url: str) -> bool:
+        '''agent地址是否支持会话协议'''
+        return self._stateful.get(url, False)
+
+    def advertise(self, url: str, headers: Dict[str, str]) -> None:
+        '''记录agent通过响应头声明的能力
+
+        `Accept-Encoding`为支持的请求体压缩编码；响应的`Content-Type`为二进制格式时，表示支持二进制传输；
+        `SYMBOLS_HEADER`表示支持符号表，`SESSIONS_HEADER`表示支持会话协议
+        '''
+        accepts = headers.get('Accept-Encoding') or ''
+        tokens = {token.split(';')[0].strip().lower() for token in accepts.split(',')}
+        self._encodings[url] = next((encoding for encoding in reversed(ENCODERS) if encoding in tokens), None)
+        if (content_type := headers.get('Content-Type')) is not None:
+            self._binaries[url] = content_type.startswith(wire.CONTENT_TYPE)
+        self._symbols[url] = headers.get(SYMBOLS_HEADER) == '1'
+        self._stateful[url] = headers.get(SESSIONS_HEADER) == '1'
+
+    def _open(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.maxsize)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _evict(self, now: float) -> None:
+        if not self.idle:
+            return
+        for url, active in tuple(self._actives.items()):
+            if now - active > self.idle and url not in self._leases:
+                del self._actives[url]
+                self._sessions.pop(url).close()
+
+    def evict(self) -> None:
+        '''主动回收空闲超时的连接池'''
+        with self._lock:
+            self._evict(time.monotonic())
+
+    def prewarm(self, *urls: str, timeout: float = 3) -> None:
+        '''预热连接池
+
+        提前为每个agent地址建立会话和连接，并记录响应头声明的能力（参考`advertise`），
+        第一次请求不必再协商；连接失败不影响后续使用
+        '''
+        headers = {'Accept': f'{wire.CONTENT_TYPE}, application/json;q=0.9', 'Accept-Encoding': ACCEPT_ENCODING}
+        for url in urls:
+            try:
+                r = self.session(url).head(url, headers=headers, timeout=timeout)
+            except requests.RequestException:
+                continue
+            if r.ok:
+                self.advertise(url, r.headers)
+
+    def close(self) -> None:
+        '''关闭所有连接池'''
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._actives.clear()
+            self._encodings.clear()
+            self._binaries.clear()
+            self._symbols.clear()
+            self._stateful.clear()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+POOL = HttpPool()
+'''进程内共享的默认HTTP连接池'''
+
+
 class HttpAgent(Agent):
     '''HTTP请求执行代理
 
-    默认post请求
+    默认post请求，通过`HttpPool`复用连接。
+    响应体按`ACCEPT_ENCODING`协商压缩；请求体超过`compress`字节，且agent已声明支持时压缩发送。
+    `binary`启用，且可以使用`msgpack`的C实现（`wire.NATIVE`）时，通过`Accept`协商二进制传输格式，
+    agent以二进制格式响应后，后续请求也改用二进制格式发送；否则始终使用JSON格式。
+    agent响应声明`SYMBOLS_HEADER`后，后续请求的调用链使用符号表压缩类名和方法名；
+    声明`SESSIONS_HEADER`后，超过`limit`的作用域拆分为多段会话请求。
+    异步执行使用调用链的`ainvoke`/`aunwrap`：请求在线程池内通过共享连接池执行（`adebug`），不阻塞事件循环，
+    配合`async with`使用时，同一事件循环内的多个任务可以分别访问不同的服务器
     '''
 
-    def __init__(self, url, /, *, timeout: int = 60) -> None:
+    def __init__(self, url, /, *, timeout: int = 60, pool: HttpPool = None, compress: int = 4096, binary: bool = False,
+                 limit: int = None) -> None:
         self.url = url
         self.timeout = timeout
+        self.pool = pool if pool is not None else POOL
+        self.compress = compress
+        self.negotiate = binary and wire.NATIVE
+        self.limit = limit
+
+    @property
+    def server(self) -> str:
+        # 子类可能不调用`__init__`（例如只返回调用链的调试agent），此时没有url
+        return getattr(self, 'url', None) or super().server
+
+    @property
+    def label(self) -> str:
+        return getattr(self, 'url', None) or super().label
+
+    @property
+    def binary(self) -> bool:
+        return getattr(self, 'negotiate', False) and self.pool.binary(self.url)
+
+    @property
+    def symbols(self) -> bool:
+        return (url := getattr(self, 'url', None)) is not None and self.pool.symbols(url)
+
+    @property
+    def stateful(self) -> bool:
+        return (url := getattr(self, 'url', None)) is not None and self.pool.stateful(url)
+
+    def _post(self, data: str | bytes, accept: str = None, compress: bool = True, **kwargs) -> requests.Response:
+        if isinstance(data, bytes):
+            body = data
+            headers = {'Content-Type': wire.CONTENT_TYPE}
+        else:
+            body = json.dumps({'json': data}, separators=(',', ':')).encode()
+            headers = {'Content-Type': 'application/json'}
+        headers['Accept-Encoding'] = ACCEPT_ENCODING
+        if accept is None:
+            accept = f'{wire.CONTENT_TYPE}, application/json;q=0.9' if self.negotiate else 'application/json'
+        headers['Accept'] = accept
+        if compress and self.compress and len(body) >= self.compress and (encoding := self.pool.encoding(self.url)):
+            body = ENCODERS[encoding](body)
+            headers['Content-Encoding'] = encoding
+        session = self.pool.acquire(self.url)
+        try:
+            r = session.post(self.url, data=body, headers=headers, timeout=self.timeout, **kwargs)
+        finally:
+            self.pool.release(self.url)
+        if r.status_code == 415 and 'Content-Encoding' in headers:
+            # agent不支持该压缩编码，按响应头重新协商后不压缩重新发送
+            self.pool.advertise(self.url, {**r.headers, 'Content-Type': headers['Content-Type']})
+            r.close()
+            return self._post(data, accept, compress=False, **kwargs)
+        if r.status_code == 415 and isinstance(data, bytes):
+            # agent不支持二进制格式，回退JSON格式重新发送
+            self.pool.advertise(self.url, {**r.headers, 'Content-Type': 'application/json'})
+            r.close()
+            return self._post(json.dumps(wire.unpackb(data), separators=(',', ':')), accept, **kwargs)
+        self.pool.advertise(self.url, r.headers)
+        return r
 
     def debug(self, data) -> Dict[str, Any]:
-        r = requests.post(self.url, json={'json': data}, timeout=self.timeout)
+        r = self._post(data)
+        if (timing := Timing.current()) is not None:
+            timing.lap('network')
+            timing.response = len(r.content)
         try:
-            return r.json()
+            if r.headers.get('Content-Type', '').startswith(wire.CONTENT_TYPE):
+                ret = wire.unpackb(r.content)
+            else:
+                ret = r.json()
         except:
-            return {'code': 404, 'message': r.text}
+            ret = {'code': 404, 'message': r.text}
+        if timing is not None:
+            timing.lap('decode')
+        return ret
+
+    def stream(self, data) -> Generator[Any, None, None]:
+        '''流式请求，边接收边解析响应，不缓存完整的响应体'''
+        # 读取响应体期间保持借出，连接池不会被回收
+        self.pool.acquire(self.url)
+        try:
+            with self._post(data, accept='application/json', stream=True) as r:
+                try:
+                    ret = yield from iterdecode(codecs.iterdecode(r.iter_content(STREAM_CHUNK_SIZE), 'utf-8'))
+                except ValueError as e:
+                    raise AgentError({'code': 404, 'message': str(e)})
+        finally:
+            self.pool.release(self.url)
+        if ret.get('code') != 200:
+            raise AgentError(ret)
+        if 'data' in ret:
+            yield from iteritems(ret['data'])
+
+
+STREAM_CHUNK_SIZE = 65536
+'''流式读取的分块大小'''
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_DECODER = json.JSONDecoder()
+_SCALAR_END = re.compile(r'[^0-9A-Za-z.+-]')
+_STRUCTURE = re.compile(r'[][{}"]')
+_STRING_END = re.compile(r'["\\]')
+
+
+def iteritems(data) -> Generator[Any, None, None]:
+    '''拆分结果数据，列表生成元素，字典生成键值对'''
+    if isinstance(data, list):
+        yield from data
+    elif isinstance(data, dict):
+        yield from data.items()
+    elif data is not None:
+        yield data
+
+
+class _Reader:
+    '''分块文本的增量读取器，只保留尚未解析的部分
+
+    读取值时记录已扫描的位置、嵌套层数和字符串状态，新数据到达后从上次的位置继续扫描，
+    确认值完整后才调用一次`raw_decode`
+    '''
+
+    __slots__ = ('chunks', 'buf', 'pos', 'eof', 'scan', 'depth', 'string')
+
+    def __init__(self, chunks: Iterable[str]) -> None:
+        self.chunks = iter(chunks)
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.scan = 0
+        self.depth = 0
+        self.string = False
+
+    def more(self) -> bool:
+        if self.pos:
+            self.buf = self.buf[self.pos:]
+            self.scan -= self.pos
+            self.pos = 0
+        for chunk in self.chunks:
+            if chunk:
+                self.buf += chunk
+                return True
+        self.eof = True
+        return False
+
+    def peek(self) -> str:
+        '''跳过空白，返回下一个字符，结束时返回空字符'''
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.more():
+                return ''
+
+    def expect(self, char: str) -> None:
+        if (found := self.peek()) != char:
+            raise ValueError(f'expecting {char!r}, {found!r} found')
+        self.pos += 1
+
+    def end(self) -> int:
+        '''从上次扫描的位置继续查找当前值的结束位置，数据不足时返回-1'''
+        buf, i = self.buf, self.scan
+        if self.depth == 0 and not self.string and buf[self.pos] not in '[{"':
+            # 数字等非闭合的值，需要确认后续字符不再属于当前值才算完整
+            match = _SCALAR_END.search(buf, i)
+            self.scan = match.start() if match else len(buf)
+            return self.scan if match else -1
+        while True:
+            if self.string:
+                match = _STRING_END.search(buf, i)
+                if match is None:
+                    self.scan = len(buf)
+                    return -1
+                i = match.end()
+                if match.group() == '\\':
+                    if i == len(buf):
+                        # 转义符在分块末尾，下次从转义符重新扫描
+                        self.scan = i - 1
+                        return -1
+                    i += 1
+                    continue
+                self.string = False
+            else:
+                match = _STRUCTURE.search(buf, i)
+                if match is None:
+                    self.scan = len(buf)
+                    return -1
+                i = match.end()
+                char = match.group()
+                if char == '"':
+                    self.string = True
+                elif char in '[{':
+                    self.depth += 1
+                else:
+                    self.depth -= 1
+            if self.depth == 0 and not self.string:
+                self.scan = i
+                return i
+
+    def value(self) -> Any:
+        '''解析一个完整的JSON值，数据不足时继续读取'''
+        if not self.peek():
+            raise json.JSONDecodeError('Expecting value', self.buf, self.pos)
+        self.scan, self.depth, self.string = self.pos, 0, False
+        while self.end() < 0:
+            if not self.more():
+                break
+        val, self.pos = _DECODER.raw_decode(self.buf, self.pos)
+        return val
+
+
+def iterdecode(chunks: Iterable[str]) -> Generator[Any, None, Dict[str, Any]]:
+    '''增量解析agent响应
+
+    `code`为200且位于`data`之前时，逐个生成`data`内的列表元素（或字典键值对），内存占用与单个元素相当；
+    其余情况完整解析`data`。生成器的返回值为响应的其余字段（以及未流式生成的`data`）
+    '''
+    reader = _Reader(chunks)
+    reader.expect('{')
+    ret = {}
+    if reader.peek() == '}':
+        return ret
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key == 'data' and ret.get('code') == 200 and (opening := reader.peek()) in ('[', '{'):
+            reader.pos += 1
+            close = ']' if opening == '[' else '}'
+            if reader.peek() == close:
+                reader.pos += 1
+            else:
+                while True:
+                    if opening == '[':
+                        yield reader.value()
+                    else:
+                        item = reader.value()
+                        reader.expect(':')
+                        yield item, reader.value()
+                    if reader.peek() == close:
+                        reader.pos += 1
+                        break
+                    reader.expect(',')
+        else:
+            ret[key] = reader.value()
+        if reader.peek() == '}':
+            return ret
+        reader.expect(',')
+
+
+def fanout(code: Callable, urls: Iterable[str], /, args: Iterable[Any] = (), kwargs: Dict[str, Any] = None, *,
+           workers: int = 8, timeout: int = 60) -> List[Dict[str, Any]]:
+    '''在多个agent上并发执行同一段代码
+
+    代码的参数通过`args`和`kwargs`整体传入，与`workers`、`timeout`等选项互不冲突
+
+    参数
+    ---
+    `code: Callable`
+        执行的代码，在每个agent的上下文内以`code(*args, **kwargs)`调用
+    `urls: Iterable[str]`
+        目标agent地址
+    `args: Iterable[Any]`
+        代码的位置参数
+    `kwargs: Dict[str, Any]`
+        代码的关键字参数
+    `workers: int`
+        最大并发数
+    `timeout: int`
+        每个agent请求的超时时间（秒）
+    ---
+    返回值
+        与`urls`顺序一致的执行结果：`{'url', 'code', 'data' | 'message', 'elapsed'}`
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+
+    args, kwargs = tuple(args), kwargs or {}
+
+    def run(url: str) -> Dict[str, Any]:
+        start = time.monotonic()
+        try:
+            with HttpAgent(url, timeout=timeout):
+                ret = {'url': url, 'code': 200, 'data': code(*args, **kwargs)}
+        except AgentError as ae:
+            ret = {'url': url, 'code': 500, 'message': ae.args[0] if ae.args else str(ae)}
+        except Exception as e:
+            ret = {'url': url, 'code': 500, 'message': str(e)}
+        ret['elapsed'] = time.monotonic() - start
+        return ret
+
+    urls = list(urls)
+    if not urls:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(urls)))) as executor:
+        return list(executor.map(run, urls))
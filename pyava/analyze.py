@@ -0,0 +1,252 @@
+'''
+往返开销分析
+
+在计数的模拟agent上试运行代码，不连接服务器。每次请求返回按方法名推断类型的模拟结果，
+统计请求次数、每次请求的字节数和调用链深度，并按代码位置找出循环内逐次`unwrap`的N+1请求；
+附带会话信息的请求（`pin`句柄、`Iter.pages`的游标和分页、分段请求）不视为N+1请求
+'''
+import json
+import os
+import re
+import sys
+import time
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from .agent import Agent
+
+_PACKAGE = os.path.dirname(os.path.abspath(__file__))
+
+
+class FakeRow(dict):
+    '''模拟的对象结果，读取任意字段都得到`0`'''
+
+    def __missing__(self, key):
+        return 0
+
+
+FAKES: List[Tuple[re.Pattern, Callable[[int, list], Any]]] = [
+    (re.compile(r'^asList$'), lambda size, args: [FakeRow() for _ in args]),
+    (re.compile(r'^(is|has|contains|equals|add|remove|put)'), lambda size, args: True),
+    (re.compile(r'^(toString|getName|name|valueOf)$'), lambda size, args: 'fake'),
+    (re.compile(r'^(size|count|length|\w*(Count|Size|Num))$'), lambda size, args: size),
+    (re.compile(r'^(\w*(s|List|Set|Map|Array|Fields|Values))$'), lambda size, args: [FakeRow() for _ in range(size)]),
+]
+'''按调用链最后一个方法名推断模拟结果的规则，`(方法名正则, (size, args) -> 结果)`，按顺序匹配'''
+
+
+class Request:
+    '''单次agent请求的记录'''
+
+    __slots__ = ('index', 'size', 'nodes', 'depth', 'method', 'site', 'session')
+
+    def __init__(self, index: int, size: int, nodes: int, depth: int, method: str, site: str,
+                 session: bool = False) -> None:
+        self.index = index
+        self.size = size
+        self.nodes = nodes
+        self.depth = depth
+        self.method = method
+        self.site = site
+        self.session = session
+
+    def json(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Report:
+    '''试运行的分析结果'''
+
+    def __init__(self, requests: List[Request], threshold: int, rtt: float, bandwidth: float) -> None:
+        self.requests = requests
+        self.threshold = threshold
+        self.rtt = rtt
+        self.bandwidth = bandwidth
+        self.error: str = None
+        self.elapsed: float = 0
+
+    @property
+    def total(self) -> int:
+        '''所有请求的字节数'''
+        return sum(request.size for request in self.requests)
+
+    @property
+    def deepest(self) -> Request:
+        '''调用链嵌套最深的请求'''
+        return max(self.requests, key=lambda request: (request.depth, request.nodes), default=None)
+
+    @property
+    def cost(self) -> float:
+        '''按往返延迟和带宽估算的请求耗时（秒），不含agent执行时间'''
+        return len(self.requests) * self.rtt + self.total / self.bandwidth
+
+    def loops(self) -> List[Dict[str, Any]]:
+        '''同一代码位置发出至少`threshold`次请求的位置，一般是循环内逐次`unwrap`
+
+        附带会话信息的请求不计入：分页遍历逐页请求、分段请求逐段发送，都是有意的多次往返
+        '''
+        sites: Dict[str, List[Request]] = {}
+        for request in self.requests:
+            if not request.session:
+                sites.setdefault(request.site, []).append(request)
+        return sorted(({'site': site, 'count': len(requests), 'bytes': sum(request.size for request in requests)}
+                       for site, requests in sites.items() if len(requests) >= self.threshold),
+                      key=lambda loop: -loop['count'])
+
+    def json(self) -> Dict[str, Any]:
+        deepest = self.deepest
+        return {
+            'requests': len(self.requests),
+            'bytes': self.total,
+            'cost': self.cost,
+            'deepest': deepest and deepest.json(),
+            'loops': self.loops(),
+            'error': self.error,
+            'elapsed': self.elapsed,
+            'detail': [request.json() for request in self.requests],
+        }
+
+    def __str__(self) -> str:
+        lines = [f'{len(self.requests)} requests, {self.total} bytes, ~{self.cost * 1e3:.0f}ms']
+        if (deepest := self.deepest) is not None:
+            lines.append(f'deepest: #{deepest.index} depth={deepest.depth} nodes={deepest.nodes} at {deepest.site}')
+        lines.extend(f'N+1: {loop["count"]} requests at {loop["site"]}' for loop in self.loops())
+        if self.error:
+            lines.append(f'error: {self.error}')
+        return '\n'.join(lines)
+
+
+def measure(chains: Any, depth: int = 1) -> Tuple[int, int, str]:
+    '''统计调用链数据的节点数、最大嵌套深度和最后一个方法名'''
+    nodes, deepest, method = 0, depth, None
+    for node in chains:
+        if not isinstance(node, dict):
+            continue
+        nodes += 1
+        if 'method' in node:
+            method = node['method']
+        for arg in (*node.get('args', ()), node.get('ref')):
+            for nested in _nested(arg):
+                n, d, _ = measure(nested, depth + 1)
+                nodes += n
+                deepest = max(deepest, d)
+    return nodes, deepest, method
+
+
+def _nested(value: Any):
+    if isinstance(value, list):
+        yield value
+    elif isinstance(value, dict):
+        if isinstance(chains := value.get('chains'), list):
+            yield chains
+        elif 'type' in value or 'method' in value:
+            yield [value]
+        else:
+            for branch in ('if', 'true', 'false'):
+                yield from _nested(value.get(branch))
+
+
+def caller() -> str:
+    '''发出请求的代码位置：调用栈上第一个不在`pyava`包内的帧'''
+    frame = sys._getframe(1)
+    while frame is not None and os.path.dirname(os.path.abspath(frame.f_code.co_filename)) == _PACKAGE:
+        frame = frame.f_back
+    if frame is None:
+        return '<unknown>'
+    return f'{frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}'
+
+
+class AnalyzeAgent(Agent):
+    '''计数的模拟agent
+
+    记录每次请求并返回模拟结果：`fakes`中指定的方法名优先，其次按`FAKES`规则推断，都不匹配时返回`FakeRow`
+    '''
+
+    def __init__(self, size: int = 10, fakes: Dict[str, Any] = None) -> None:
+        '''初始化模拟agent
+
+        参数
+        ---
+        `size: int`
+            模拟的列表结果长度和数量结果
+        `fakes: Dict[str, Any]`
+            方法名到模拟结果的映射
+        ---
+        '''
+        self.size = size
+        self.fakes = fakes or {}
+        self.requests: List[Request] = []
+
+    @property
+    def label(self) -> str:
+        # 所有试运行共用一个耗时统计分组
+        return 'analyze'
+
+    @property
+    def stateful(self) -> bool:
+        # `pin`请求返回空结果，其余会话请求与普通请求一样返回模拟结果
+        return True
+
+    def fake(self, method: str, args: list) -> Any:
+        '''按方法名生成模拟结果'''
+        if method in self.fakes:
+            return self.fakes[method]
+        for pattern, fake in FAKES:
+            if method and pattern.search(method):
+                return fake(self.size, args)
+        return FakeRow()
+
+    def debug(self, data) -> dict[str, Any]:
+        payload = json.loads(data)
+        if (chains := payload.get('chains')) is None:
+            # 单个节点的请求数据就是节点本身
+            chains = [payload]
+        nodes, depth, method = measure(chains)
+        args = next((node.get('args', []) for node in reversed(chains) if isinstance(node, dict) and 'method' in node), [])
+        session = payload.get('session')
+        self.requests.append(Request(len(self.requests), len(data.encode() if isinstance(data, str) else data),
+                                     nodes, depth, method, caller(), session is not None))
+        if session is not None and 'pin' in session:
+            return {'code': 200, 'data': None}
+        return {'code': 200, 'data': self.fake(method, args)}
+
+
+def analyze(code: Callable, /, args: Iterable[Any] = (), kwargs: Dict[str, Any] = None, *, size: int = 10,
+            fakes: Dict[str, Any] = None, threshold: int = 3, rtt: float = 0.02, bandwidth: float = 1e6) -> Report:
+    '''在模拟agent上试运行代码并分析请求开销
+
+    代码的参数通过`args`和`kwargs`整体传入，与分析选项互不冲突。
+    代码因模拟结果抛出的异常记录在`Report.error`中，已发出的请求仍然计入统计
+    ```
+    print(analyze(code, kwargs={'pid': 1}))
+    ```
+
+    参数
+    ---
+    `code: Callable`
+        试运行的代码，以`code(*args, **kwargs)`调用
+    `args: Iterable[Any]`
+        代码的位置参数
+    `kwargs: Dict[str, Any]`
+        代码的关键字参数
+    `size: int`
+        模拟的列表结果长度，参考`AnalyzeAgent`
+    `fakes: Dict[str, Any]`
+        方法名到模拟结果的映射
+    `threshold: int`
+        同一代码位置请求次数达到该值时视为N+1请求
+    `rtt: float`
+        估算耗时使用的单次往返延迟（秒）
+    `bandwidth: float`
+        估算耗时使用的带宽（字节/秒）
+    ---
+    '''
+    agent = AnalyzeAgent(size, fakes)
+    report = Report(agent.requests, threshold, rtt, bandwidth)
+    start = time.perf_counter()
+    with agent:
+        try:
+            code(*args, **(kwargs or {}))
+        except Exception as e:
+            report.error = f'{type(e).__name__}: {e}'
+    report.elapsed = time.perf_counter() - start
+    return report
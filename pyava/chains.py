@@ -1,13 +1,26 @@
+import contextvars
+import copy
+import itertools
 import json
-from typing import Any, Callable, Dict, Generator, List, Self, Tuple, override
+import operator
+import re
+import time
+import uuid
+from json.encoder import encode_basestring_ascii as _quote
+from typing import Any, Callable, Dict, Generator, Iterable, Iterator, List, Self, Tuple, override
 
-from .agent import Agent, AgentError
+from . import wire
+from .agent import CACHE, Agent, AgentError, Timing
 
 __all__ = (
-    'Entry', 'Accessor', 'Local', 'Class', 'Enum', 'Scope', 'Iter', 'Empty', 'IfElse'
+    'Entry', 'Accessor', 'Local', 'Class', 'Enum', 'Scope', 'Iter', 'Projection', 'Empty', 'IfElse', 'Batch',
+    'Placeholder', 'Prepared', 'Handle'
 )
 
 
+_pin_ids = itertools.count(1)
+
+
 def namespace[R: Callable[...]](func: R) -> R:
     from functools import wraps
 
@@ -21,6 +34,8 @@ def namespace[R: Callable[...]](func: R) -> R:
 
 class Jsonable:
 
+    __slots__ = ()
+
     def __json__(self, markers=None) -> Dict[str, Any]:
         '''当前节点转化为JSON可序列化数据'''
         return {}
@@ -34,26 +49,61 @@ class ChainMixin:
 
     __slots__ = ()
 
+    _attrs: frozenset = frozenset()
+    '''节点自身的属性名称（所有基类`__slots__`的合集），其余属性名称均视为远程对象的字段'''
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        cls._attrs = frozenset(name for c in cls.__mro__ for name in c.__dict__.get('__slots__', ()))
+
     @override
     def __getattr__(self, name: str):
-        if name in self.__slots__:
+        if name in self._attrs:
             return super().__getattr__(name)
         return Accessor(self, name=name)
 
     @override
     def __setattr__(self, name: str, val: Any):
-        if name in self.__slots__:
+        if name in self._attrs:
             return super().__setattr__(name, val)
         if isinstance(val, Scope):  # 域内调用合并
             val(self.getClass().getDeclaredField(name).set(self, val._pop()))
+        elif (batch := FieldBatch.current(self)) is not None:
+            batch.write(name, val, depth=1)
         else:
             self.getClass().getDeclaredField(name).set(self, val).unwrap()
 
+    def __copy__(self) -> Self:
+        '''浅复制节点自身的属性，未赋值的属性保持未赋值'''
+        clone = object.__new__(self.__class__)
+        for name in self._attrs:
+            try:
+                object.__setattr__(clone, name, object.__getattribute__(self, name))
+            except AttributeError:
+                pass
+        return clone
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> Self:
+        '''复制节点的结构（前置节点、参数和分支），其余属性共享；前置节点迭代复制，链路长度不受递归深度限制'''
+        front = None
+        for node in flatten(self):
+            if (clone := memo.get(id(node))) is None:
+                clone = memo[id(node)] = node.__copy__()
+                clone._front = front
+                if isinstance(node, Accessor) and node._args:
+                    clone._args = copy.deepcopy(node._args, memo)
+                elif isinstance(node, Entry) and isinstance(node._ref, Scannable):
+                    clone._ref = copy.deepcopy(node._ref, memo)
+            front = clone
+        return front
+
     def __getitem__(self, key: str):
         invoker, field = self.field_search(key)
         return field.get(invoker)
 
     def __setitem__(self, key: str, value: Any):
+        if (batch := FieldBatch.current(self)) is not None:
+            return batch.write(key, value)
         invoker, field = self.field_search(key)
         field.set(invoker, value).unwrap()
 
@@ -68,32 +118,101 @@ class ChainMixin:
         pass
 
     @namespace
-    def field_search(self, name: str):
-        if self.is_class():
-            return None, self.getDeclaredField(name)
-        clz = self.getClass()
-        while True:
-            if self.is_object_class():
-                raise AttributeError(f'{name}属性不存在')
-            field = clz.getDeclaredField(name)
-            if field.is_ok():
-                return self, field
-            clz = clz.getSuperclass()
+    def field_search(self, name: str, depth: int = 32):
+        '''沿继承链查找字段，返回`(调用对象, 字段节点)`
+
+        查找过程编译为单个调用链，与字段访问合并在一次请求内执行，不论字段在第几层父类。
+        对象本身是`Class`时从该类开始查找（静态字段）；最多向上查找`depth`层，找不到时agent抛出`NullPointerException`
+        '''
+        each = flatten(self)[0] is Iter.Each
+        walk, field = search_fields(class_of(self), name, depth, front=self, each=each)
+        return self, Class('java.util.Objects', front=walk).requireNonNull(field, f'{name}属性不存在')
+
+    @namespace
+    def batch(self, depth: int = 32) -> 'FieldBatch':
+        '''字段批量写入模式，参考`FieldBatch`'''
+        return FieldBatch(self, depth=depth)
 
     @namespace
     def invoke(self) -> Dict[str, Any]:
         self._try_freeze()
-        return Agent.invoke(Jsonify.dumps(self))
+        return Agent.invoke(serialize(self))
 
     @namespace
     def unwrap(self) -> Any:
         self._try_freeze()
-        return Agent.unwrap(Jsonify.dumps(self))
+        if (batch := Batch.current()) is not None:
+            return batch.defer(self)
+        return Agent.unwrap(serialize(self), ttl=self._ttl)
+
+    @namespace
+    def unwrap_iter(self) -> Generator[Any, None, None]:
+        '''流式获取结果，逐个生成列表元素（或字典键值对）'''
+        self._try_freeze()
+        return Agent.unwrap_iter(serialize(self))
+
+    def _fetch(self) -> Any:
+        '''立即执行并解包，不受批量模式影响'''
+        self._try_freeze()
+        return Agent.unwrap(serialize(self))
+
+    @namespace
+    async def ainvoke(self) -> Dict[str, Any]:
+        self._try_freeze()
+        return await Agent.ainvoke(serialize(self))
+
+    @namespace
+    async def aunwrap(self) -> Any:
+        self._try_freeze()
+        return await Agent.aunwrap(serialize(self), ttl=self._ttl)
+
+    @namespace
+    def pin(self, ttl: float = 300) -> 'Handle':
+        '''执行并在agent会话内保留结果对象，返回可以在后续请求中引用的句柄
+
+        句柄在`ttl`秒后过期，或者通过`release`主动释放；agent限制单个会话持有的句柄数量。
+        持有句柄期间，该agent的请求都会附带会话信息；agent不支持会话协议（`Agent.stateful`）时抛出`AgentError`
+        ```
+        manager = Class('...PlayerManager').getInstance().pin()
+        manager.getPlayer(Long(1001)).getLevel().unwrap()
+        manager.release()
+        ```
+        '''
+        self._try_freeze()
+        if (agent := Agent._SHARED) is None:
+            raise AgentError({'No Agent': 'pin'})
+        if not agent.stateful:
+            raise AgentError({'Stateless Agent': 'pin', 'agent': agent.label})
+        name = f'$pin_{next(_pin_ids)}'
+        Agent.unwrap(serialize(self, {'pin': {'name': name, 'ttl': ttl}}))
+        agent.handles[name] = time.monotonic() + ttl
+        return Handle(name, agent)
+
+    @namespace
+    def cached(self, ttl: float = 60) -> Self:
+        '''标记`unwrap`结果可以缓存`ttl`秒，仅适用于无副作用的只读查询
+
+        对`unwrap`、`aunwrap`、批量模式和`prepare`生效，流式的`unwrap_iter`不使用缓存
+        '''
+        self._ttl = ttl
+        return self
+
+    @namespace
+    def impure(self) -> Self:
+        '''标记节点有副作用，结构化合并时不会与其他节点合并'''
+        self._impure = True
+        return self
+
+    @namespace
+    def prepare(self, **defaults) -> 'Prepared':
+        '''预编译调用链，参考`Prepared`'''
+        self._try_freeze()
+        return Prepared(self, **defaults).cached(self._ttl)
 
     @namespace
     def is_ok(self) -> bool:
         try:
-            self.unwrap()
+            self._fetch()
             return True
         except AgentError:
             return False
@@ -106,20 +225,22 @@ class ChainMixin:
 
     @namespace
     def is_object_class(self) -> bool:
-        return Class('java.lang.Object').equals(self).unwrap() is True
+        return Class('java.lang.Object').equals(self)._fetch() is True
 
     @namespace
     def is_class(self) -> bool:
-        return Class('java.lang.Class').isAssignableFrom(self.getClass()).unwrap() is True
+        return Class('java.lang.Class').isAssignableFrom(self.getClass())._fetch() is True
 
 
 class ChainNode(ChainMixin, Jsonable):
 
-    __slots__ = ('_local', '_front')
+    __slots__ = ('_local', '_front', '_ttl', '_impure')
 
     def __init__(self) -> None:
         self._local: None | str = None
         self._front: None | ChainNode = None
+        self._ttl: None | float = None
+        self._impure = False
 
     @override
     def __json__(self, markers=None) -> Dict:
@@ -135,6 +256,8 @@ type Chains = ChainNode | List[ChainNode] | Tuple[ChainNode, ...]
 
 class Scannable(Jsonable):
 
+    __slots__ = ()
+
     def scan(self) -> Generator[ChainNode, None, None]:
         '''
         用于扫描特色分支中的Node节点
@@ -144,9 +267,12 @@ class Scannable(Jsonable):
 
 class Scope(Scannable):
 
+    __slots__ = ('_chains', '_marked', '_ttl')
+
     def __init__(self) -> None:
         self._chains: List[ChainNode | Any] = []
         self._marked = None
+        self._ttl: None | float = None
 
     def mark(self, node: ChainNode = None):
         '''标记当前节点（默认最后一个节点的返回值）需要返回值
@@ -183,10 +309,50 @@ class Scope(Scannable):
             chains.append(self.result)
         return chains
 
+    def cached(self, ttl: float = 60) -> Self:
+        '''标记`unwrap`结果可以缓存`ttl`秒，参考`ChainMixin.cached`
+
+        缓存的作用域不能拆分为多段请求，超过agent的`limit`时抛出异常
+        '''
+        self._ttl = ttl
+        return self
+
+    def _chunked(self) -> List[str | bytes]:
+        chunks = chunked(self.chains)
+        if self._ttl is not None and len(chunks) > 1:
+            raise ValueError('cached scope exceeds the agent limit and cannot be split into chunks')
+        return chunks
+
     def unwrap(self) -> Any:
         '''获取作用域调用链的结果值
+
+        超过agent的`limit`时拆分为多段请求顺序执行，参考`chunked`
         '''
-        return Agent.unwrap(Jsonify.dumps(self.chains))
+        *heads, last = self._chunked()
+        for data in heads:
+            Agent.unwrap(data)
+        return Agent.unwrap(last, ttl=self._ttl)
+
+    def unwrap_iter(self) -> Generator[Any, None, None]:
+        '''流式获取作用域调用链的结果，逐个生成列表元素（或字典键值对）
+        '''
+        *heads, last = chunked(self.chains)
+        for data in heads:
+            Agent.unwrap(data)
+        return Agent.unwrap_iter(last)
+
+    def prepare(self, **defaults) -> 'Prepared':
+        '''预编译作用域调用链，参考`Prepared`
+        '''
+        return Prepared(self.chains, **defaults).cached(self._ttl)
+
+    async def aunwrap(self) -> Any:
+        '''异步获取作用域调用链的结果值
+        '''
+        *heads, last = self._chunked()
+        for data in heads:
+            await Agent.aunwrap(data)
+        return await Agent.aunwrap(last, ttl=self._ttl)
 
     def __call__(self, node: ChainNode | Any, mark: bool = False) -> Self:
         '''标记作用域
@@ -198,6 +364,15 @@ class Scope(Scannable):
             self.mark()
         return self
 
+    def optimize(self, pure: Callable[[str], bool] = None) -> Self:
+        '''结构化合并作用域内相同的无副作用调用链，参考`Merger`
+        '''
+        merger = Merger(pure)
+        self._chains = [merger.visit(node) if isinstance(node, ChainNode) else node for node in self._chains]
+        if self._marked:
+            self._marked = [merger.visit(node) for node in self._marked]
+        return self
+
     def _pop(self):
         '''退回最后包裹的值
 
@@ -236,7 +411,7 @@ class Entry(ChainNode, Scannable):
     启动入口，如`Class`, `Local`等
     '''
 
-    __slots__ = ('_ref', '_type') + ChainNode.__slots__
+    __slots__ = ('_ref', '_type')
 
     def __init__(self, type: str, ref: str | Scannable, local: str = None, front: ChainNode = None):
         '''初始化入口对象
@@ -253,6 +428,8 @@ class Entry(ChainNode, Scannable):
         self._type = type
         self._local = local
         self._front = front
+        self._ttl = None
+        self._impure = False
 
     @override
     def __json__(self, markers=None) -> Dict:
@@ -273,7 +450,7 @@ class Entry(ChainNode, Scannable):
 
 class Accessor(ChainNode, Scannable):
 
-    __slots__ = ('_name', '_args') + ChainNode.__slots__
+    __slots__ = ('_name', '_args')
 
     def __init__(self, front: ChainNode, name: str):
         front and front._try_freeze()
@@ -281,10 +458,14 @@ class Accessor(ChainNode, Scannable):
         self._args = None
         self._local = None
         self._front = front
+        self._ttl = None
+        self._impure = False
 
     def __call__(self, /, *args: Any, local=None) -> Self:
         if self._args is not None:
             raise RuntimeError(f'duplicated call with {self._name}')
+        # 批量模式的延迟结果作为参数时替换为原节点或者结果值，参考`Deferred`
+        args = tuple(arg._arg() if isinstance(arg, Deferred) else arg for arg in args)
         for arg in args:
             if isinstance(arg, ChainNode):
                 arg._try_freeze()
@@ -328,19 +509,262 @@ class Empty(ChainNode):
     '''空根节点，用于无根链节点
     '''
 
+    __slots__ = ()
+
     @override
     def __getattr__(self, name: str) -> Accessor:
-        if name in self.__slots__:
+        if name in self._attrs:
             return super().__getattr__(name)
         return Accessor(None, name=name)
 
 
+PURE_METHODS = re.compile(r'(get(?!And|OrCreate|OrPut)|is|has|valueOf|forName|equals|hashCode|toString|compareTo|size|length|contains|name|ordinal)(?![a-z])')
+'''默认视为无副作用的方法名'''
+
+
+class Merger:
+    '''结构化公共子表达式合并
+
+    按结构（入口、方法名、参数和前置节点）哈希调用链节点，结构相同且无副作用的节点合并为首次出现的节点，
+    序列化时由`Jsonify`的重复标记转化为`$n`引用，只执行一次。
+
+    无副作用的判定：`class`入口，以及方法名符合`pure`的调用，且前置节点和参数节点也都无副作用；
+    显式`impure()`、指定了`local`的节点，以及`iter`/`if`等分支入口不参与合并，分支内部也不会展开合并。
+
+    有副作用的调用会使之前的合并候选失效：调用对象和参数节点可以被哈希时，失效所有依赖它们的候选
+    （例如`map.put(k, v)`之后的`map.get(k)`不再与之前的合并），否则以及经过分支入口时失效全部候选。
+    合并在节点的副本上进行，不修改原有节点；同一个`Merger`内共享的节点（包括分支内部的引用）复制后仍然共享
+    '''
+
+    def __init__(self, pure: Callable[[str], bool] = None) -> None:
+        self.pure = pure or (lambda name: PURE_METHODS.match(name) is not None)
+        self._keys: Dict[int, Tuple | None] = {}
+        self._nodes: Dict[Tuple, ChainNode] = {}
+        self._merged: Dict[int, ChainNode] = {}
+        self._memo: Dict[int, Any] = {}
+
+    def visit(self, node: ChainNode) -> ChainNode:
+        '''合并节点链路，返回替换后的节点副本'''
+        return self._visit(copy.deepcopy(node, self._memo))
+
+    def _visit(self, node: ChainNode) -> ChainNode:
+        front = None
+        for n in flatten(node):
+            # 已经合并过的共享节点沿用首次合并的结果，不受之后的失效影响
+            if (merged := self._merged.get(id(n))) is not None:
+                front = merged
+                continue
+            if front is not None and n._front is not front:
+                n._front = front
+            if isinstance(n, Accessor) and n._args:
+                n._args = tuple(self._visit(arg) if isinstance(arg, ChainNode) else arg for arg in n._args)
+            front = self._merged[id(n)] = self._merge(n)
+        return front
+
+    def _merge(self, node: ChainNode) -> ChainNode:
+        key = self._keys[id(node)] = self._key(node)
+        if key is None:
+            self._invalidate(node)
+            return node
+        return self._nodes.setdefault(key, node)
+
+    def _invalidate(self, node: ChainNode) -> None:
+        '''有副作用的节点使依赖其调用对象和参数的合并候选失效'''
+        if isinstance(node, Accessor):
+            if node._args is None or (not node._impure and self.pure(node._name)):
+                return
+            targets = [node._front, *(arg for arg in node._args if isinstance(arg, ChainNode))]
+            keys = [self._keys.get(id(target)) for target in targets if target is not None]
+            if all(key is not None for key in keys):
+                self._nodes = {key: n for key, n in self._nodes.items() if not any(_depends(key, k) for k in keys)}
+                return
+        elif not isinstance(node, Entry) or not isinstance(node._ref, Scannable) or not self._mutates(node._ref):
+            return
+        self._nodes = {key: n for key, n in self._nodes.items() if key[0] == 'class'}
+
+    def _mutates(self, branch: Scannable) -> bool:
+        '''分支内部是否有副作用的调用'''
+        stack: List[Any] = [branch]
+        while stack:
+            obj = stack.pop()
+            if isinstance(obj, Scope):
+                stack.extend(obj._chains)
+            elif isinstance(obj, ChainNode):
+                for n in flatten(obj):
+                    if isinstance(n, Accessor) and n._args is not None:
+                        if n._impure or not self.pure(n._name):
+                            return True
+                        stack.extend(n._args)
+                    elif isinstance(n, Entry) and isinstance(n._ref, Scannable):
+                        stack.append(n._ref)
+            elif isinstance(obj, Scannable):
+                stack.extend(obj.scan())
+        return False
+
+    def _key(self, node: ChainNode) -> Tuple | None:
+        if node._impure or node._local is not None:
+            return None
+        front = None
+        if node._front is not None and (front := self._keys.get(id(node._front))) is None:
+            return None
+        if isinstance(node, Accessor):
+            if node._args is None or not self.pure(node._name):
+                return None
+            args = []
+            for arg in node._args:
+                if isinstance(arg, ChainNode):
+                    if (key := self._keys.get(id(arg))) is None:
+                        return None
+                    args.append(key)
+                elif isinstance(arg, Jsonable):
+                    return None
+                else:
+                    try:
+                        args.append((type(arg).__name__, json.dumps(arg)))
+                    except (TypeError, ValueError):
+                        return None
+            return ('method', node._name, tuple(args), front)
+        if type(node) is Entry and node._type == 'class':
+            return ('class', node._ref, front)
+        return None
+
+
+def _depends(key: Tuple, target: Tuple) -> bool:
+    '''合并键`key`对应的节点是否经由前置节点或者参数依赖`target`对应的节点（不含`target`本身）'''
+    stack = [key]
+    while stack:
+        if (k := stack.pop()) is None:
+            continue
+        if k[0] == 'class':
+            stack.append(k[2])
+            continue
+        _, _, args, front = k
+        if front == target or target in args:
+            return True
+        stack.append(front)
+        stack.extend(arg for arg in args if isinstance(arg, tuple) and arg and arg[0] in ('class', 'method'))
+    return False
+
+
+def optimize(chains: Chains, pure: Callable[[str], bool] = None) -> Chains:
+    '''结构化合并调用链（或作用域调用链）中相同的无副作用子链，参考`Merger`'''
+    merger = Merger(pure)
+    if isinstance(chains, ChainNode):
+        return merger.visit(chains)
+    return [merger.visit(node) if isinstance(node, ChainNode) else node for node in chains]
+
+
+def instance(clz: str) -> Accessor:
+    '''通过无参构造器创建对象'''
+    return Class(clz).getDeclaredConstructor().newInstance()
+
+
 def makefront(root: ChainNode, front: ChainNode):
     while root._front:
         root = root._front
     root._front = front
 
 
+def class_of(node: ChainNode, local: str = None, front: ChainNode = None) -> 'IfElse':
+    '''获取节点对象的类，节点本身是`Class`时直接使用该类（静态成员）'''
+    return IfElse(Class('java.lang.Class').isInstance(node), local=local, front=front).ifTrue(node).ifFalse(node.getClass())
+
+
+def search_fields(clz: ChainNode, name: str, depth: int, front: ChainNode = None,
+                  each: bool = False) -> Tuple[ChainNode, Accessor]:
+    '''沿继承链查找字段的调用链，返回`(查找过程, 字段节点)`，字段节点需要在查找过程之后执行
+
+    从`clz`开始逐层向上，最多查找`depth`层，找到后跳过其余层级，字段节点为最先找到的`Field`，找不到时为`null`。
+    当前层的类和查找结果保存在共享的`AtomicReference`节点中，序列化时按请求内出现的顺序编号为`$n`，
+    相同的查找总是生成相同的请求数据；调用链的长度与`depth`无关。
+    查找过程内部的遍历会覆盖`Iter.Each`，在遍历内使用时指定`each`，查找前保存、查找后恢复当前元素
+    '''
+    holder = 'java.util.concurrent.atomic.AtomicReference'
+    if each:
+        front = saved = Class(holder, front=front).getDeclaredConstructor(Class('java.lang.Object')).newInstance(Iter.Each)
+    current = Class(holder, front=front).getDeclaredConstructor(Class('java.lang.Object')).newInstance(clz)
+    found = Class(holder, front=current).getDeclaredConstructor().newInstance()
+    level = Scope()
+    level(Iter(current.get().getDeclaredFields()).filter(Iter.Each.getName().equals(name)).foreach(found.set(Iter.Each)))
+    level(current.set(current.get().getSuperclass()))
+    walk = Iter((0, depth)).foreach(IfElse(Class('java.util.Objects').isNull(found.get()))
+                                    .ifTrue(IfElse(Class('java.util.Objects').nonNull(current.get())).ifTrue(level)))
+    makefront(walk, found)
+    if each:
+        return Class('java.lang.Object', front=walk).cast(saved.get(local=Iter.Each._ref)), found.get()
+    return walk, found.get()
+
+
+class FieldBatch:
+    '''字段批量写入
+
+    模式内对目标对象的`obj.field = value`和`obj['field'] = value`不会立即请求，
+    退出模式时合并为一个作用域，复用同一个类引用查找字段并写入，单次请求提交。
+    不存在的字段不影响其他字段的写入，统一以`AttributeError`报告
+    ```
+    with player.batch():
+        player.level = 10
+        player['exp'] = 0
+    ```
+    '''
+
+    _CURRENT = contextvars.ContextVar('field_batch', default=None)
+
+    def __init__(self, target: ChainNode, depth: int = 32) -> None:
+        self._target = target
+        self._depth = depth
+        self._writes: List[Tuple[str, Any, int]] = []
+        self._token = None
+        self.results: Dict[str, bool] = {}
+        '''最近一次提交的字段写入结果'''
+
+    @classmethod
+    def current(cls, target: ChainNode) -> 'FieldBatch':
+        '''目标对象当前生效的批量写入模式'''
+        if (batch := cls._CURRENT.get()) is not None and batch._target is target:
+            return batch
+        return None
+
+    def write(self, name: str, value: Any, depth: int = None) -> None:
+        '''加入待写入字段，`depth`为沿继承链查找的层数'''
+        if isinstance(value, ChainNode):
+            value._try_freeze()
+        self._writes.append((name, value, depth or self._depth))
+
+    def flush(self) -> Dict[str, bool]:
+        '''合并提交所有待写入字段，返回每个字段是否写入成功'''
+        if not (writes := self._writes):
+            return {}
+        self._writes = []
+        target = self._target
+        scope = Scope()
+        scope(target)
+        # 每个字段的查找都从同一个类引用开始
+        clz = class_of(target)
+        missings = []
+        each = flatten(target)[0] is Iter.Each
+        for name, value, depth in writes:
+            walk, field = search_fields(clz, name, depth, each=each)
+            scope(walk)
+            scope(IfElse(missing := Class('java.util.Objects').isNull(field)).ifFalse(field.set(target, value)))
+            missings.append(missing)
+        for missing in missings:
+            scope.mark(missing)
+        self.results = {name: not missing for (name, *_), missing in zip(writes, scope.unwrap())}
+        if failures := [name for name, ok in self.results.items() if not ok]:
+            raise AttributeError(f'{", ".join(failures)}属性不存在')
+        return self.results
+
+    def __enter__(self) -> Self:
+        self._token = FieldBatch._CURRENT.set(self)
+        return self
+
+    def __exit__(self, exc_type, *args) -> None:
+        FieldBatch._CURRENT.reset(self._token)
+        if exc_type is None:
+            self.flush()
+
+
 class Iter(Entry):
     '''
     ```
@@ -353,7 +777,7 @@ class Iter(Entry):
 
     type Range = Tuple[int, int]
 
-    __slots__ = ('_filter',) + Entry.__slots__
+    __slots__ = ('_filter', '_setup')
 
     def __init__(self, root: ChainNode | Range, foreach: ChainNode = None):
         '''迭代遍历构造
@@ -374,10 +798,30 @@ class Iter(Entry):
             scope(foreach)
         super().__init__(type='iter', ref=scope, front=root)
         self._filter = None
+        self._setup: List[ChainNode] = []
+        '''遍历前创建、在遍历内复用的对象，参考`select`'''
 
     @staticmethod
     def range(range: Range):
         return Class('java.util.stream.IntStream').range(range[0], range[1]).boxed()
+
+    @staticmethod
+    def over(values: Iterable[Any], foreach: Callable[[Entry], ChainNode] = None) -> Scope:
+        '''对本地数据的每个元素执行相同的调用链，单次请求按顺序返回所有结果
+
+        输入数据作为字面量数组只发送一次，`foreach`接收`Iter.Each`，返回对每个元素执行的调用链
+        ```
+        levels = Iter.over(pids, lambda Each: manager.getPlayer(Long(Each)).getLevel()).unwrap()
+        ```
+        '''
+        it = Iter(Class('java.util.Arrays').asList(*values))
+        if foreach is not None:
+            it.foreach(foreach(Iter.Each))
+        li = it.tolist()
+        scope = Scope()
+        scope(li)
+        scope(it)
+        return scope(li)
     
     @property
     def _inner_scope(self) -> Scope:
@@ -414,9 +858,226 @@ class Iter(Entry):
         self._filter = scope
         return self
 
+    def select(self, *fields: str, depth: int = 32) -> Self:
+        '''只保留元素的指定字段，遍历结果映射为`LinkedHashMap<字段名, 字段值>`
+
+        字段在agent上沿继承链查找（参考`search_fields`）并通过反射读取，元素没有的字段不放入结果，只传输投影后的字段。
+        查找到的`Field`按元素的类缓存在遍历前创建的`HashMap`中，每个类只查找一次，同类的元素直接复用
+        ```
+        it = Iter(players).select('id', 'name', 'level')
+        li = it.tolist()
+        Scope()(li)(it)(li).unwrap()
+        ```
+        '''
+        if not fields:
+            raise ValueError('select需要至少一个字段')
+        element = self._inner_scope.result or Iter.Each
+        cache = instance('java.util.HashMap')
+        makefront(self._front, cache)
+        self._setup.append(cache)
+        row = instance('java.util.LinkedHashMap')
+        self.foreach(row)
+        clz = element.getClass()
+        lookup = Scope()
+        lookup(found := instance('java.util.ArrayList'))
+        for name in fields:
+            walk, field = search_fields(clz, name, depth, each=True)
+            lookup(walk)
+            lookup(found.add(field))
+        lookup(cache.put(clz, found))
+        self.foreach(IfElse(Class('java.util.Objects').isNull(cache.get(clz))).ifTrue(lookup))
+        self.foreach(found := cache.get(clz))
+        for i, name in enumerate(fields):
+            field = found.get(i)
+            self.foreach(IfElse(Class('java.util.Objects').nonNull(field)).ifTrue(row.put(name, field.get(element))))
+        return self.foreach(row)
+
+    def project(self) -> Self:
+        '''按当前`Projection`模式的列字段投影元素，参考`select`；不在投影模式内时不做处理'''
+        if (projection := Projection.current()) is not None:
+            self.select(*projection.fields)
+        return self
+
+    def _element(self, key: Callable[[ChainNode], ChainNode] = None) -> Tuple[ChainNode, ChainNode]:
+        '''当前遍历（过滤、映射后）的元素及其聚合键，聚合键在每次遍历时先行计算'''
+        element = self._inner_scope.result or Iter.Each
+        if key is None:
+            return element, element
+        self.foreach(value := key(element))
+        return element, value
+
+    def _aggregate(self, *accumulators: ChainNode, result: ChainNode) -> Scope:
+        '''在遍历前创建累加器，遍历后返回聚合结果'''
+        scope = Scope()
+        for accumulator in accumulators:
+            scope(accumulator)
+        scope(self)
+        return scope(result)
+
+    def count(self) -> Scope:
+        '''元素数量（过滤后）'''
+        counter = instance('java.util.concurrent.atomic.AtomicLong')
+        self.foreach(counter.incrementAndGet())
+        return self._aggregate(counter, result=counter.get())
+
+    def sum(self, key: Callable[[ChainNode], ChainNode] = None) -> Scope:
+        '''元素（或`key`映射值）的整数和'''
+        total = instance('java.util.concurrent.atomic.AtomicLong')
+        _, value = self._element(key)
+        self.foreach(total.addAndGet(value))
+        return self._aggregate(total, result=total.get())
+
+    def min(self, key: Callable[[ChainNode], ChainNode] = None) -> Scope:
+        '''`key`映射值（`Comparable`）最小的元素，没有元素时为`None`'''
+        return self._extremum(key, -1)
+
+    def max(self, key: Callable[[ChainNode], ChainNode] = None) -> Scope:
+        '''`key`映射值（`Comparable`）最大的元素，没有元素时为`None`'''
+        return self._extremum(key, 1)
+
+    def _extremum(self, key: Callable[[ChainNode], ChainNode], sign: int) -> Scope:
+        best = instance('java.util.concurrent.atomic.AtomicReference')
+        best_key = instance('java.util.concurrent.atomic.AtomicReference')
+        element, value = self._element(key)
+
+        def replace() -> Scope:
+            return Scope()(best.set(element))(best_key.set(value))
+
+        compare = Class('java.lang.Integer').signum(value.compareTo(best_key.get())).equals(Class('java.lang.Integer').valueOf(sign))
+        self.foreach(IfElse(Class('java.util.Objects').isNull(best_key.get())).ifTrue(replace())
+                     .ifFalse(IfElse(compare).ifTrue(replace())))
+        return self._aggregate(best, best_key, result=best.get())
+
+    def groupBy(self, key: Callable[[ChainNode], ChainNode]) -> 'Grouping':
+        '''按`key`映射值分组，参考`Grouping`'''
+        return Grouping(self, key)
+
+    def topN(self, n: int, key: Callable[[ChainNode], ChainNode] = None) -> Scope:
+        '''`key`映射值（`Comparable`）最大的`n`个元素，按映射值降序排列
+
+        agent上只保留当前最大的`n`个元素，映射值相同时先遍历到的元素在前，淘汰时也先淘汰
+        '''
+        tree = instance('java.util.TreeMap')
+        size = instance('java.util.concurrent.atomic.AtomicLong')
+        top = instance('java.util.ArrayList')
+        element, value = self._element(key)
+        self.foreach(tree.putIfAbsent(value, instance('java.util.ArrayDeque')))
+        self.foreach(tree.get(value).add(element))
+        evict = Scope()
+        evict(tree.firstEntry().getValue().pollFirst())
+        evict(IfElse(tree.firstEntry().getValue().isEmpty()).ifTrue(tree.pollFirstEntry()))
+        evict(size.decrementAndGet())
+        self.foreach(IfElse(size.incrementAndGet().equals(Class('java.lang.Long').valueOf(n + 1))).ifTrue(evict))
+        scope = self._aggregate(tree, size, top, result=top)
+        scope._pop()
+        scope(Iter(tree.descendingMap().values()).foreach(Iter(Iter.Each).foreach(top.add(Iter.Each))))
+        return scope(top)
+
+    def pages(self, size: int = 1000, ttl: float = 300) -> Generator[List[Any], None, None]:
+        '''分页遍历，返回逐页生成结果列表的生成器
+
+        遍历对象的迭代器通过`pin`保留在agent会话内作为游标，每次请求最多取出`size`个元素，
+        在agent上执行`filter`/`foreach`后只返回当前页的结果（同`tolist`，过滤后为空的页不生成）。
+        遍历结束，或者生成器提前关闭时释放游标；游标需要agent支持会话协议（`Agent.stateful`）
+        ```
+        for page in Iter(manager.getOnlinePlayers().values()).filter(...).pages(size=1000):
+            ...
+        ```
+        '''
+        cursor = self._front.iterator().pin(ttl)
+        try:
+            page = Class('java.util.ArrayList').getDeclaredConstructor().newInstance()
+            self.foreach(page.add(self._inner_scope.result or Iter.Each))
+            body = Scope()
+            body(cursor.next(local=Iter.Each._ref))
+            for chain in self._ref._chains:
+                body(chain)
+            scope = Scope()
+            scope(page)
+            # 游标请求不保留遍历前创建的对象，每页请求重新创建
+            for node in self._setup:
+                scope(node)
+            scope(Iter((0, size), IfElse(cursor.hasNext()).ifTrue(body)))
+            scope(Class('java.util.Arrays').asList(page, cursor.hasNext()))
+            data = serialize(scope.chains)
+            while True:
+                items, more = Agent.unwrap(data)
+                if items:
+                    yield items
+                if not more:
+                    break
+        finally:
+            cursor.release()
+
+
+class Grouping:
+    '''`Iter.groupBy`的分组聚合，结果为`HashMap<分组键, 聚合值>`
+    ```
+    Iter(players).groupBy(lambda Each: Each.getLevel()).count().unwrap()
+    ```
+    '''
+
+    __slots__ = ('_iter', '_key')
+
+    def __init__(self, it: Iter, key: Callable[[ChainNode], ChainNode]) -> None:
+        self._iter = it
+        self._key = key
+
+    def count(self) -> Scope:
+        '''每个分组的元素数量'''
+        return self._accumulate(lambda counter, element: counter.incrementAndGet())
+
+    def sum(self, value: Callable[[ChainNode], ChainNode]) -> Scope:
+        '''每个分组内`value`映射值的整数和'''
+        return self._accumulate(lambda total, element: total.addAndGet(value(element)))
+
+    def _accumulate(self, update: Callable[[ChainNode, ChainNode], ChainNode]) -> Scope:
+        it = self._iter
+        groups = instance('java.util.HashMap')
+        element, key = it._element(self._key)
+        it.foreach(groups.putIfAbsent(key, instance('java.util.concurrent.atomic.AtomicLong')))
+        it.foreach(update(groups.get(key), element))
+        return it._aggregate(groups, result=groups)
+
+
+class Projection:
+    '''列投影模式
+
+    模式内调用了`Iter.project`的遍历按`fields`投影元素，参考`Iter.select`；其余遍历（例如中间结果）不受影响。
+    `TableColumn`标记的代码在执行时自动进入该模式
+    ```
+    with Projection('id', 'name'):
+        it = Iter(players).project()
+        li = it.tolist()
+        Scope()(li)(it)(li).unwrap()
+    ```
+    '''
+
+    _CURRENT = contextvars.ContextVar('projection', default=None)
+
+    __slots__ = ('fields', '_token')
+
+    def __init__(self, *fields: str) -> None:
+        self.fields = fields
+        self._token = None
+
+    @classmethod
+    def current(cls) -> 'Projection':
+        '''当前上下文内生效的投影模式'''
+        return cls._CURRENT.get()
+
+    def __enter__(self) -> Self:
+        self._token = Projection._CURRENT.set(self)
+        return self
+
+    def __exit__(self, *args) -> None:
+        Projection._CURRENT.reset(self._token)
+
 
 class IfElse(Entry):
 
+    __slots__ = ()
+
     class _Branch(Scannable):
         '''if-else分支节点'''
         __slots__ = ('_if', '_true', '_false')
@@ -443,9 +1104,9 @@ class IfElse(Entry):
                 'false': self._false and self._false.expand(markers, markable),
             }
 
-    def __init__(self, condition: ChainNode):
+    def __init__(self, condition: ChainNode, local: str = None, front: ChainNode = None):
         '''条件分支表达式'''
-        super().__init__(type='if', ref=IfElse._Branch(condition))
+        super().__init__(type='if', ref=IfElse._Branch(condition), local=local, front=front)
 
     def ifTrue(self, onTrue: Chains):
         self._ref._true = onTrue
@@ -456,6 +1117,197 @@ class IfElse(Entry):
         return self
 
 
+class Handle(Entry):
+    '''`pin`保留在agent会话内的远程对象句柄，作为`Local`引用使用'''
+
+    __slots__ = ('_agent',)
+
+    def __init__(self, name: str, agent: Agent):
+        super().__init__(type='local', ref=name)
+        self._agent = agent
+
+    @namespace
+    def release(self) -> None:
+        '''释放agent会话内保留的对象，已过期或已释放的句柄忽略
+
+        释放请求与普通调用一样按协商的传输格式发送并计入耗时统计，agent返回错误时抛出`AgentError`
+        '''
+        agent = self._agent
+        if agent.handles.pop(self._ref, None) is None:
+            return
+        with agent:
+            Agent.unwrap(serialize([], {'release': [self._ref]}))
+
+
+class Deferred:
+    '''批量模式下`unwrap`返回的延迟结果
+
+    首次读取`value`时提交所在批次的全部待执行节点。
+    比较、算术运算和属性访问都作用于`value`，同样会先提交批次。
+    作为同一批次内其他调用的参数时，替换为原节点，提交时在同一次请求内以`$n`引用，不会提前提交：
+    ```
+    with Batch():
+        player = manager.getPlayer(Long(1001)).unwrap()
+        level = Class('...LevelUtil').levelOf(player).unwrap()
+    level.value
+    ```
+    '''
+
+    __slots__ = ('_batch', '_node', '_value', '_error', '_done')
+
+    def __init__(self, batch: 'Batch', node: ChainNode) -> None:
+        self._batch = batch
+        self._node = node
+        self._value = None
+        self._error: AgentError = None
+        self._done = False
+
+    def _resolve(self, value: Any = None, error: AgentError = None):
+        self._value = value
+        self._error = error
+        self._done = True
+
+    def _arg(self) -> Any:
+        '''作为调用参数的值：所在批次尚未提交且仍在生效时为原节点，否则为结果值'''
+        if not self._done and self._batch is Batch.current():
+            return self._node
+        return self.value
+
+    @property
+    def value(self) -> Any:
+        if not self._done:
+            self._batch.flush()
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+    def __bool__(self) -> bool:
+        return bool(self.value)
+
+    def __eq__(self, other: Any) -> bool:
+        return self.value == (other.value if isinstance(other, Deferred) else other)
+
+    def __hash__(self) -> int:
+        return hash(self.value)
+
+    def __len__(self) -> int:
+        return len(self.value)
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __getitem__(self, key):
+        return self.value[key]
+
+    def __str__(self) -> str:
+        return str(self.value)
+
+    def __repr__(self) -> str:
+        return f'Deferred({self.value!r})' if self._done else 'Deferred(...)'
+
+    def __getattr__(self, name: str):
+        return getattr(self.value, name)
+
+    def __contains__(self, item) -> bool:
+        return item in self.value
+
+    def __int__(self) -> int:
+        return int(self.value)
+
+    def __float__(self) -> float:
+        return float(self.value)
+
+    def __index__(self) -> int:
+        return operator.index(self.value)
+
+
+def _deferred_operator(op: Callable[..., Any], reflected: bool = False):
+    def method(self: Deferred, *args):
+        args = [arg.value if isinstance(arg, Deferred) else arg for arg in args]
+        return op(*args, self.value) if reflected else op(self.value, *args)
+    return method
+
+
+for _name in ('lt', 'le', 'gt', 'ge', 'ne', 'neg', 'pos', 'abs', 'invert'):
+    setattr(Deferred, f'__{_name}__', _deferred_operator(getattr(operator, _name)))
+for _name in ('add', 'sub', 'mul', 'truediv', 'floordiv', 'mod', 'pow', 'and', 'or', 'xor', 'lshift', 'rshift'):
+    _op = getattr(operator, f'{_name}_' if _name in ('and', 'or') else _name)
+    setattr(Deferred, f'__{_name}__', _deferred_operator(_op))
+    setattr(Deferred, f'__r{_name}__', _deferred_operator(_op, reflected=True))
+
+
+class Batch:
+    '''批量合并模式
+
+    模式内的`unwrap`不会立即请求，而是返回`Deferred`延迟结果。
+    退出模式或者首次读取结果时，所有待执行节点合并为一个作用域并标记返回值，单次请求提交
+    ```
+    with Batch():
+        a = node1.unwrap()
+        b = node2.unwrap()
+    a.value, b.value
+    ```
+    '''
+
+    _CURRENT = contextvars.ContextVar('batch', default=None)
+
+    def __init__(self) -> None:
+        self._pending: List[Tuple[ChainNode, Deferred, Tuple[str, str] | None]] = []
+        self._token = None
+
+    @classmethod
+    def current(cls) -> 'Batch':
+        '''当前上下文内生效的批量模式'''
+        return cls._CURRENT.get()
+
+    def defer(self, node: ChainNode) -> Deferred:
+        '''加入待执行节点
+
+        标记了`cached`的节点先查询缓存，命中时直接返回结果，否则提交后写入缓存
+        '''
+        deferred, key = Deferred(self, node), None
+        if node._ttl is not None and (agent := Agent._SHARED) is not None:
+            hit, val = CACHE.get(key := CACHE.key(agent.server, serialize(node)))
+            # 缓存键的序列化不发出请求
+            Timing.discard()
+            if hit:
+                deferred._resolve(val)
+                return deferred
+        self._pending.append((node, deferred, key))
+        return deferred
+
+    def flush(self) -> None:
+        '''合并提交所有待执行节点'''
+        if not (pending := self._pending):
+            return
+        self._pending = []
+        try:
+            if len(pending) == 1:
+                values = (pending[0][0]._fetch(),)
+            else:
+                scope = Scope()
+                for node, _, _ in pending:
+                    scope(node, mark=True)
+                values = scope.unwrap()
+        except AgentError as ae:
+            for _, deferred, _ in pending:
+                deferred._resolve(error=ae)
+            raise
+        for (node, deferred, key), value in zip(pending, values):
+            deferred._resolve(value)
+            if key is not None:
+                CACHE.put(key, value, node._ttl)
+
+    def __enter__(self) -> Self:
+        self._token = Batch._CURRENT.set(self)
+        return self
+
+    def __exit__(self, exc_type, *args) -> None:
+        Batch._CURRENT.reset(self._token)
+        if exc_type is None:
+            self.flush()
+
+
 def Class(clz: str, local: str = None, front: ChainNode = None) -> Entry:
     return Entry('class', clz, local, front=front)
 
@@ -472,35 +1324,40 @@ def Local(ref: str, front: ChainNode = None) -> Entry:
     return Entry('local', ref, front=front)
 
 
-def flatten(node: ChainNode) -> Generator[ChainNode, Any, None]:
+def flatten(node: ChainNode) -> List[ChainNode]:
     '''
     展开链路节点
 
         `flatten_mark` 与 `flatten_scan`通常是一起配合使用的，用于标记重复出现的节点并将后现的节点替换为前者的引用
 
         `flatten`函数则直接展开，不论是否重复出现
+
+    展开过程均为迭代实现，链路长度不受递归深度限制
     '''
-    if (front := node._front) is not None:
-        yield from flatten(front)
-    yield node
+    nodes = []
+    while node is not None:
+        nodes.append(node)
+        node = node._front
+    nodes.reverse()
+    return nodes
 
 
-def flatten_scan(node: ChainNode, markers: Dict[ChainNode, bool | Dict]) -> Generator[ChainNode, Any, None]:
+def flatten_scan(node: ChainNode, markers: Dict[ChainNode, bool | Dict]) -> List[ChainNode]:
     '''
     扫描并展开链路节点
         一般是非主链路的分支节点，为了在已经统一标记的情况下，仅扫描节点并在合适的位置展开，不再重复标记
     '''
-    marker = markers.get(node)
+    nodes = [node]
     # 引用标记展开，避免参数节点首次展开被错误截止
-    # 只有在当前node节点已经存在引用替换节点时，才中断后续展开，直接返回（已经可替换表示后续都是重复节点，直接引用当前节点即可）
-    if marker in (None, False, True):
-        # 只要是非引用替换节点状态，都需要继续尝试展开，因为此时还没有引用源节点链路（即引用替换节点的指向）
-        if (front := node._front) is not None:
-            yield from flatten_scan(front, markers)
-    yield node
+    # 只有在当前node节点已经存在引用替换节点时，才中断后续展开（已经可替换表示后续都是重复节点，直接引用当前节点即可）
+    # 只要是非引用替换节点状态，都需要继续尝试展开，因为此时还没有引用源节点链路（即引用替换节点的指向）
+    while markers.get(node) in (None, False, True) and (node := node._front) is not None:
+        nodes.append(node)
+    nodes.reverse()
+    return nodes
 
 
-def flatten_mark(node: ChainNode, markers: Dict[ChainNode, bool]) -> Generator[ChainNode, Any, None]:
+def flatten_mark(node: ChainNode, markers: Dict[ChainNode, bool]) -> List[ChainNode]:
     '''展开并标记节点
         展开根链路节点，同时会标记所有扫描到的`ChainNode`节点
 
@@ -516,22 +1373,44 @@ def flatten_mark(node: ChainNode, markers: Dict[ChainNode, bool]) -> Generator[C
             `Dict` : 在节点序列化解释的过程中，可能会存在可复用的引用替换节点，属于原节点`True`状态的扩展数据
     ---
     函数返回值
-        节点链路展开的生成器
+        节点链路展开的列表
+
+    使用显式栈模拟深度优先的标记顺序：
+    首次录入的节点先标记前置节点，再标记扫描到的分支节点，最后录入自身；已录入的节点截止展开，并确认重复标记
     '''
-    marker = markers.get(node)
-
-    if marker is None:      # ①首次录入，展开统计
-        # 录入前置节点
-        if (front := node._front) is not None:
-            yield from flatten_mark(front, markers)
-        if isinstance(node, Scannable):
-            for scan in node.scan():
-                tuple(flatten_mark(scan, markers))
-        markers[node] = False
-    elif marker is False:   # ②待标记，直接确认标记
-        # 修改当前节点为重复标记
-        markers[node] = True
-    yield node
+    nodes = _mark(node, markers)
+    stack: List[Tuple[int, ChainNode]] = []
+    _visit(nodes, markers, stack)
+    while stack:
+        task, n = stack.pop()
+        if task == _VISIT:      # 分支节点，只标记不展开
+            _visit(_mark(n, markers), markers, stack)
+        elif task == _SCAN:     # 先标记扫描到的分支节点，再录入自身
+            stack.append((_DONE, n))
+            if isinstance(n, Scannable):
+                stack.extend((_VISIT, scan) for scan in reversed(tuple(n.scan())))
+        else:
+            markers[n] = False
+    return nodes
+
+
+_VISIT, _SCAN, _DONE = range(3)
+
+
+def _mark(node: ChainNode, markers: Dict[ChainNode, bool]) -> List[ChainNode]:
+    '''展开到第一个已录入的节点为止（包括该节点）'''
+    nodes = [node]
+    while markers.get(node) is None and (node := node._front) is not None:
+        nodes.append(node)
+    nodes.reverse()
+    return nodes
+
+
+def _visit(nodes: List[ChainNode], markers: Dict[ChainNode, bool], stack: List[Tuple[int, ChainNode]]) -> None:
+    '''已录入的截止节点再次出现，确认重复标记；其余首次录入的节点按展开顺序逆序入栈'''
+    if markers.get(nodes[0]) is False:
+        markers[nodes[0]] = True
+    stack.extend((_SCAN, n) for n in reversed(nodes) if markers.get(n) is None)
 
 
 def chainify(chains: Chains, markers: Dict[ChainNode, bool | Dict] = None, markable: bool = True):
@@ -576,20 +1455,29 @@ def transmute(chains: Chains, markers: Dict[ChainNode, bool | Dict] = None, mark
 
 
 class Jsonify(json.JSONEncoder):
+    '''调用链序列化
 
-    def __init__(self, *args, markers: Dict[ChainNode, bool | Dict] = None, **kwargs):
+    重复出现的节点标记为`$n`引用；启用`symbols`时，类名和方法名收集到负载顶层的`symbols`符号表，
+    节点内以符号表的下标代替：
+    ```
+    {"symbols":["java.lang.Integer","valueOf"],"chains":[{"type":"class","ref":0},{"method":1,"args":[0]}, ...]}
+    ```
+    '''
+
+    def __init__(self, *args, markers: Dict[ChainNode, bool | Dict] = None, symbols: Dict[str, int] = None, **kwargs):
         self.markers = markers
+        self.symbols = symbols
         self.refid = 0
         super().__init__(*args, **kwargs)
 
     def default(self, obj: Any) -> Any:
         if isinstance(obj, Jsonable):
             if self.markers is None:
-                return obj.__json__()
+                return self.intern(obj.__json__())
             marker = self.markers.get(obj)
             if isinstance(marker, dict):
                 return marker
-            json = obj.__json__(self.markers)
+            json = self.intern(obj.__json__(self.markers))
             if marker is True:
                 if (local := obj._local) is None:
                     self.refid += 1
@@ -600,6 +1488,457 @@ class Jsonify(json.JSONEncoder):
             return json
         return super().default(obj)
 
+    def intern(self, json: Any) -> Any:
+        '''替换节点的类名和方法名为符号表下标'''
+        if (symbols := self.symbols) is None or not isinstance(json, dict):
+            return json
+        if (name := json.get('method')) is not None:
+            json['method'] = symbols.setdefault(name, len(symbols))
+        elif json.get('type') == 'class' and isinstance(name := json['ref'], str):
+            json['ref'] = symbols.setdefault(name, len(symbols))
+        return json
+
+    @classmethod
+    def dumps(cls, chains: ChainNode | List[ChainNode], symbols: bool = False) -> str:
+        '''序列化为JSON格式，由`Writer`直接写入输出缓冲'''
+        writer = Writer(markers := {}, {} if symbols else None)
+        start = time.monotonic()
+        chains = transmute(chains, markers)
+        built = time.monotonic()
+        text = writer.dumps(chains)
+        if writer.symbols:
+            # 符号表作为顶层对象的第一个字段，agent解析节点前即可取得
+            text = prepend(text, 'symbols', list(writer.symbols))
+        Timing.serialized(built - start, time.monotonic() - built)
+        return text
+
     @classmethod
-    def dumps(cls, chains: ChainNode | List[ChainNode]) -> str:
-        return json.dumps(transmute(chains, markers := {}), cls=cls, separators=(',', ':'), markers=markers)
+    def packb(cls, chains: ChainNode | List[ChainNode], symbols: bool = False) -> bytes:
+        '''序列化为二进制格式，节点的标记和引用替换与`dumps`一致'''
+        encoder = cls(markers=(markers := {}), symbols={} if symbols else None)
+        start = time.monotonic()
+        chains = transmute(chains, markers)
+        built = time.monotonic()
+        data = wire.packb(chains, default=encoder.default)
+        if encoder.symbols:
+            data = prepend(data, 'symbols', list(encoder.symbols))
+        Timing.serialized(built - start, time.monotonic() - built)
+        return data
+
+
+class Writer:
+    '''调用链的JSON写入器
+
+    单次遍历节点，直接写入输出缓冲，不经过`__json__`生成中间字典，也不再由`json`模块二次遍历。
+    `Entry`和`Accessor`节点直接写入，其他`Jsonable`节点回退到`__json__`；
+    输出与`Jsonify`编码器（紧凑分隔符）逐字节一致，包括`$n`引用的编号顺序和符号表的下标顺序。
+
+    与`flatten`相同，嵌套的数组、字典和节点参数不递归写入，而是作为生成器压入显式的工作栈，
+    嵌套深度不受解释器递归深度的限制
+    '''
+
+    __slots__ = ('markers', 'symbols', 'refid', '_write')
+
+    def __init__(self, markers: Dict[ChainNode, bool | Dict] = None, symbols: Dict[str, int] = None) -> None:
+        self.markers = markers
+        self.symbols = symbols
+        self.refid = 0
+
+    def dumps(self, value: Any) -> str:
+        buf: List[str] = []
+        self._write = buf.append
+        stack = [] if (frame := self.value(value)) is None else [frame]
+        while stack:
+            for frame in stack[-1]:
+                # 先写完嵌套的值，再回到外层继续
+                stack.append(frame)
+                break
+            else:
+                stack.pop()
+        return ''.join(buf)
+
+    def value(self, o: Any) -> Iterator | None:
+        '''写入标量；数组、字典和带子节点的节点返回待写入的生成器'''
+        cls = o.__class__
+        if cls is str:
+            self._write(_quote(o))
+        elif cls is int:
+            self._write(int.__repr__(o))
+        elif (kind := _KINDS.get(cls)) is not None:
+            return self.node(o, kind)
+        elif cls is tuple or cls is list:
+            return self.array(o)
+        elif cls is dict:
+            return self.dict(o)
+        elif isinstance(o, str):
+            self._write(_quote(o))
+        elif o is None:
+            self._write('null')
+        elif o is True:
+            self._write('true')
+        elif o is False:
+            self._write('false')
+        elif isinstance(o, int):
+            self._write(int.__repr__(o))
+        elif isinstance(o, float):
+            self._write(_float(o))
+        elif isinstance(o, (list, tuple)):
+            return self.array(o)
+        elif isinstance(o, dict):
+            return self.dict(o)
+        elif isinstance(o, Jsonable):
+            return self.node(o, _kind(cls))
+        else:
+            raise TypeError(f'Object of type {cls.__name__} is not JSON serializable')
+
+    def array(self, o: List | Tuple, close: str = ']') -> Iterator:
+        write, node, value = self._write, self.node, self.value
+        sep = '['
+        for item in o:
+            cls = item.__class__
+            if cls is str:
+                write(sep + _quote(item))
+            elif cls is int:
+                write(sep + int.__repr__(item))
+            elif (kind := _KINDS.get(cls)) is not None:
+                write(sep)
+                if (frame := node(item, kind)) is not None:
+                    yield frame
+            else:
+                write(sep)
+                if (frame := value(item)) is not None:
+                    yield frame
+            sep = ','
+        write('[' + close if sep == '[' else close)
+
+    def dict(self, o: Dict) -> Iterator:
+        write, value = self._write, self.value
+        sep = '{'
+        for key, val in o.items():
+            write(sep + _quote(key if key.__class__ is str else _key(key)) + ':')
+            if (frame := value(val)) is not None:
+                yield frame
+            sep = ','
+        write('{}' if sep == '{' else '}')
+
+    def enclose(self, o: Any, tail: str) -> Iterator:
+        if (frame := self.value(o)) is not None:
+            yield frame
+        self._write(tail)
+
+    def node(self, o: Jsonable, kind: int) -> Iterator | None:
+        write, markers = self._write, self.markers
+        marker = None if markers is None else markers.get(o)
+        if marker.__class__ is dict:
+            # 引用替换节点，结构固定
+            return write('{"type":"local","ref":' + _quote(marker['ref']) + '}')
+        if kind == _GENERIC:
+            return self.generic(o, marker)
+        # 引用编号先于子节点分配，与编码器钩子的顺序一致
+        local = o._local
+        if marker is True:
+            if local is None:
+                self.refid += 1
+                local = f'${self.refid}'
+            markers[o] = {'type': 'local', 'ref': local}
+            tail = ',"local":' + _quote(local) + '}'
+        elif local:
+            tail = ',"local":' + _quote(local) + '}'
+        else:
+            tail = '}'
+        symbols = self.symbols
+        if kind == _ACCESSOR:
+            # 参数节点需要在写入前全部展开，展开的截止位置取决于写入前的标记状态
+            args = [transmute(arg, markers, markable=False) if isinstance(arg, ChainNode) else arg for arg in o._args]
+            name = _quote(o._name) if symbols is None else int.__repr__(symbols.setdefault(o._name, len(symbols)))
+            if args:
+                write('{"method":' + name + ',"args":')
+                return self.array(args, ']' + tail)
+            return write('{"method":' + name + ',"args":[]' + tail)
+        ref, type = o._ref, o._type
+        if ref.__class__ is str:
+            if symbols is not None and type == 'class':
+                ref = int.__repr__(symbols.setdefault(ref, len(symbols)))
+            else:
+                ref = _quote(ref)
+            return write('{"type":' + _quote(type) + ',"ref":' + ref + tail)
+        write('{"type":' + _quote(type) + ',"ref":')
+        if isinstance(ref, Scannable):
+            ref = ref.expand(markers)
+        elif symbols is not None and type == 'class' and isinstance(ref, str):
+            return write(int.__repr__(symbols.setdefault(ref, len(symbols))) + tail)
+        return self.enclose(ref, tail)
+
+    def generic(self, o: Jsonable, marker: bool | None) -> Iterator | None:
+        '''回退到`__json__`，与`Jsonify.default`一致'''
+        markers = self.markers
+        json = o.__json__() if markers is None else o.__json__(markers)
+        if (symbols := self.symbols) is not None and isinstance(json, dict):
+            if (name := json.get('method')) is not None:
+                json['method'] = symbols.setdefault(name, len(symbols))
+            elif json.get('type') == 'class' and isinstance(name := json['ref'], str):
+                json['ref'] = symbols.setdefault(name, len(symbols))
+        if marker is True:
+            if (local := o._local) is None:
+                self.refid += 1
+                local = f'${self.refid}'
+            json['local'] = local
+            markers[o] = {'type': 'local', 'ref': local}
+        return self.value(json)
+
+
+_GENERIC, _ACCESSOR, _ENTRY = range(3)
+_KINDS: Dict[type, int] = {}
+'''节点类型的写入方式，按`__json__`是否被重写判断'''
+
+
+def _kind(cls: type) -> int:
+    if (kind := _KINDS.get(cls)) is None:
+        if cls.__json__ is Accessor.__json__:
+            kind = _ACCESSOR
+        elif cls.__json__ is Entry.__json__:
+            kind = _ENTRY
+        else:
+            kind = _GENERIC
+        _KINDS[cls] = kind
+    return kind
+
+
+for _cls in (Accessor, Entry, Iter, IfElse):
+    _kind(_cls)
+
+
+def _float(o: float) -> str:
+    if o != o:
+        return 'NaN'
+    if o == float('inf'):
+        return 'Infinity'
+    if o == -float('inf'):
+        return '-Infinity'
+    return float.__repr__(o)
+
+
+def _key(key: Any) -> str:
+    '''字典键按`json`模块的规则转为字符串'''
+    if isinstance(key, str):
+        return key
+    if isinstance(key, float):
+        return _float(key)
+    if key is True:
+        return 'true'
+    if key is False:
+        return 'false'
+    if key is None:
+        return 'null'
+    if isinstance(key, int):
+        return int.__repr__(key)
+    raise TypeError(f'keys must be str, int, float, bool or None, not {key.__class__.__name__}')
+
+
+def serialize(chains: Chains, session: Dict[str, Any] = None) -> str | bytes:
+    '''按当前agent协商的传输格式序列化调用链
+
+    agent持有`pin`句柄，或者指定了`session`时，附带会话信息。序列化耗时由随后发出的请求计入，参考`Timing`
+    '''
+    if (agent := Agent._SHARED) is None:
+        return Jsonify.dumps(chains)
+    return attach(Jsonify.packb(chains, agent.symbols) if agent.binary else Jsonify.dumps(chains, agent.symbols), session)
+
+
+def attach(data: str | bytes, session: Dict[str, Any] = None) -> str | bytes:
+    '''当前agent持有`pin`句柄，或者指定了`session`时，为序列化数据附带会话信息'''
+    if (agent := Agent._SHARED) is not None and (session is not None or agent.handles):
+        data = prepend(data, 'session', {'id': agent.session, **(session or {})})
+    return data
+
+
+def prepend(data: str | bytes, key: str, value: Any) -> str | bytes:
+    '''在序列化数据的顶层对象开头插入字段'''
+    if isinstance(data, str):
+        return '{' + json.dumps(key) + ':' + json.dumps(value, separators=(',', ':')) + ',' + data[1:]
+    # 二进制格式的顶层对象为fixmap，字段数加一后插入
+    return bytes((data[0] + 1,)) + wire.packb(key) + wire.packb(value) + data[1:]
+
+
+def chunked(chains: Chains) -> List[str | bytes]:
+    '''按当前agent的`limit`序列化调用链，超过限制时拆分为多段会话请求
+
+    只在链路的起点（`class`/`local`/`self`入口）处拆分，单条超过限制的链路不会再拆分。
+    每段请求附带agent会话信息，同一次拆分的请求以`chunk`区分：agent执行前载入会话句柄和该分段保存的引用，
+    执行后保存`keep`列出的引用（后续分段用到的`$n`）；最后一段关闭分段，其结果即为整个调用链的结果。
+    任意一段执行失败时agent丢弃该分段保存的引用：
+    ```
+    {"session":{"id":"...","chunk":"...","keep":["$1"]},"chains":[...]}
+    {"session":{"id":"...","chunk":"...","keep":[],"close":true},"chains":[...]}
+    ```
+    会话协议需要agent实现（`Agent.stateful`，HTTP agent通过`SESSIONS_HEADER`声明），否则不拆分。
+    调用链只序列化一次，超过限制时解析序列化数据拆分，各分段沿用同一个符号表；
+    每段重复发送的会话信息和符号表计入分段大小，`keep`按分段内定义的全部`$n`估算
+    '''
+    data = serialize(chains)
+    if (agent := Agent._SHARED) is None or not (limit := agent.limit) or not agent.stateful \
+            or len(data if isinstance(data, bytes) else data.encode()) <= limit:
+        return [data]
+    start = time.monotonic()
+    payload = wire.unpackb(data) if isinstance(data, bytes) else json.loads(data)
+    payload.pop('session', None)
+    symbols = payload.pop('symbols', None)
+    dumps = wire.packb if agent.binary else lambda obj: json.dumps(obj, separators=(',', ':'))
+    nbytes = lambda obj: len(encoded if isinstance(encoded := dumps(obj), bytes) else encoded.encode())
+    # 从入口开始的完整链路，分段时整体计入大小
+    links: List[List[Dict]] = []
+    for node in payload['chains'] if 'chains' in payload else (payload,):
+        if not links or node.get('type') in _CHUNK_ENTRIES:
+            links.append([])
+        links[-1].append(node)
+    sid, cid = agent.session, uuid.uuid4().hex
+    envelope = {'session': {'id': sid, 'chunk': cid, 'keep': [], 'close': True}, 'chains': []}
+    if symbols is not None:
+        envelope['symbols'] = symbols
+    overhead = nbytes(envelope)
+    groups: List[List[Dict]] = []
+    group, size = [], overhead
+    for link in links:
+        length = sum(nbytes(node) + 1 for node in link) + sum(nbytes(name) + 1 for name in _locals(link, 'local'))
+        if group and size + length > limit:
+            groups.append(group)
+            group, size = [], overhead
+        group.extend(link)
+        size += length
+    groups.append(group)
+    if len(groups) == 1:
+        return [data]
+    # 后续分段引用的`$n`
+    refs: List[set] = [set()]
+    for group in reversed(groups[1:]):
+        refs.append(refs[-1] | _locals(group, 'ref'))
+    refs.reverse()
+    chunks = []
+    for i, group in enumerate(groups):
+        session = {'id': sid, 'chunk': cid, 'keep': sorted(_locals(group, 'local') & refs[i])}
+        if i == len(groups) - 1:
+            session['close'] = True
+        if symbols is None:
+            chunks.append(dumps({'session': session, 'chains': group}))
+        else:
+            chunks.append(dumps({'session': session, 'symbols': symbols, 'chains': group}))
+    # 拆分的耗时计入第一段请求的`serialize`阶段
+    Timing.serialized(0.0, time.monotonic() - start)
+    return chunks
+
+
+_CHUNK_ENTRIES = ('class', 'local', 'self')
+'''可以作为分段起点的入口类型，不依赖前一个节点的值'''
+
+
+def _locals(nodes: List[Dict], kind: str) -> set:
+    '''收集节点（包括参数和分支内部）定义（`local`）或者引用（`ref`）的`$n`'''
+    names = set()
+    stack: List[Any] = [nodes]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, dict):
+            if kind == 'local':
+                if (local := obj.get('local')) is not None:
+                    names.add(local)
+            elif obj.get('type') == 'local':
+                names.add(obj['ref'])
+            stack.extend(obj.values())
+        elif isinstance(obj, list):
+            stack.extend(obj)
+    return names
+
+
+class Placeholder(Jsonable):
+    '''预编译调用链的命名参数占位符
+
+    作为调用参数使用，序列化时保留占位，由`Prepared.bind`替换为实际的值
+    '''
+
+    __slots__ = ('name',)
+
+    def __init__(self, name: str) -> None:
+        if not (name.isascii() and name.isidentifier()):
+            raise ValueError(f'invalid placeholder name {name!r}')
+        self.name = name
+
+    @override
+    def __json__(self, markers=None) -> str:
+        return f'{_PLACEHOLDER}{self.name}{_PLACEHOLDER}'
+
+
+_PLACEHOLDER = '\0pyava.placeholder\0'
+_PLACEHOLDER_PATTERN = re.compile('"{0}(\\w+){0}"'.format(re.escape(json.dumps(_PLACEHOLDER)[1:-1])))
+
+
+class Prepared:
+    '''预编译调用链
+
+    调用链只构建和序列化一次，生成以`Placeholder`分段的模板；
+    之后每次执行只需要把参数值序列化后拼接到模板中，不再遍历节点。
+    agent协商使用二进制传输格式后，改用二进制模板拼接（`bindb`）
+    ```
+    prepared = Class('...Manager').getPlayer(Placeholder('pid')).getLevel().prepare()
+    prepared.unwrap(pid=1001)
+    ```
+    '''
+
+    def __init__(self, chains: Chains, **defaults) -> None:
+        template = Jsonify.dumps(chains)
+        self._chains = chains
+        self._parts: List[str] = _PLACEHOLDER_PATTERN.split(template)
+        self._packed: List[bytes] = None
+        self.names = frozenset(self._parts[1::2])
+        '''模板中的占位符名称'''
+        if unknowns := defaults.keys() - self.names:
+            raise ValueError(f'unknown placeholders: {", ".join(unknowns)}')
+        self.defaults = defaults
+        self.ttl: None | float = None
+        '''`unwrap`结果的缓存时间，参考`cached`'''
+
+    def cached(self, ttl: float = 60) -> Self:
+        '''标记`unwrap`结果可以缓存`ttl`秒，相同参数的执行共用缓存，参考`ChainMixin.cached`'''
+        self.ttl = ttl
+        return self
+
+    def bind(self, **values) -> str:
+        '''绑定占位符的值，生成可直接执行的序列化数据'''
+        return ''.join(self._fill(self._parts, values, lambda value: json.dumps(value, separators=(',', ':'))))
+
+    def bindb(self, **values) -> bytes:
+        '''绑定占位符的值，生成二进制传输格式的序列化数据，二进制模板在首次使用时生成'''
+        if (parts := self._packed) is None:
+            names = {wire.packb(f'{_PLACEHOLDER}{name}{_PLACEHOLDER}'): name for name in self.names}
+            pattern = re.compile(b'(' + b'|'.join(map(re.escape, names)) + b')') if names else None
+            template = Jsonify.packb(self._chains)
+            parts = self._packed = [names.get(part, part) if i % 2 else part for i, part in
+                                    enumerate(pattern.split(template) if pattern else (template,))]
+        return b''.join(self._fill(parts, values, wire.packb))
+
+    def _fill[T: str | bytes](self, parts: List[T], values: Dict[str, Any], dumps: Callable[[Any], T]) -> List[T]:
+        if unknowns := values.keys() - self.names:
+            raise ValueError(f'unknown placeholders: {", ".join(unknowns)}')
+        values = {**self.defaults, **values}
+        parts = parts.copy()
+        for i in range(1, len(parts), 2):
+            if (name := parts[i]) not in values:
+                raise ValueError(f'缺少参数<{name}>')
+            if isinstance(value := values[name], (Jsonable, Scope)):
+                raise TypeError(f'placeholder <{name}> only accepts JSON data, <{type(value).__name__}> found')
+            parts[i] = dumps(value)
+        return parts
+
+    def _data(self, values: Dict[str, Any]) -> str | bytes:
+        '''按当前agent协商的传输格式绑定参数'''
+        if (agent := Agent._SHARED) is not None and agent.binary:
+            return attach(self.bindb(**values))
+        return attach(self.bind(**values))
+
+    def invoke(self, **values) -> Dict[str, Any]:
+        return Agent.invoke(self._data(values))
+
+    def unwrap(self, **values) -> Any:
+        return Agent.unwrap(self._data(values), ttl=self.ttl)
+
+    async def aunwrap(self, **values) -> Any:
+        return await Agent.aunwrap(self._data(values), ttl=self.ttl)
@@ -0,0 +1,789 @@
+import enum
+import gzip
+import json
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Self, Tuple
+
+from . import wire
+from .agent import ENCODERS, SESSIONS_HEADER, SYMBOLS_HEADER, Agent, zstandard
+
+
+class LocalError(Exception):
+    '''本地执行异常，对应agent端抛出的Java异常'''
+    pass
+
+
+class LocalClass:
+    '''本地模拟的Java类对象
+
+    `type`为实例对应的Python类型，`statics`为静态成员所在的命名空间（默认即`type`）
+    '''
+
+    __slots__ = ('type', 'name', 'statics')
+
+    def __init__(self, type: type, name: str, statics: Any = None) -> None:
+        self.type = type
+        self.name = name
+        self.statics = type if statics is None else statics
+
+    def member(self, agent: 'LocalAgent', name: str) -> Callable:
+        '''查找类的反射方法或者静态方法'''
+        if (reflect := getattr(self, '_' + name, None)) is not None:
+            return lambda *args: reflect(agent, *args)
+        if (static := getattr(self.statics, name, None)) is not None:
+            return static
+        if issubclass(self.type, enum.Enum) and name == 'valueOf':
+            return lambda val: self.type[val]
+        raise LocalError(f'NoSuchMethodException: {self.name}.{name}')
+
+    def _getName(self, agent):
+        return self.name
+
+    def _getSimpleName(self, agent):
+        return self.name.rsplit('.', 1)[-1]
+
+    def _getClass(self, agent):
+        return agent.classof(self)
+
+    def _equals(self, agent, other):
+        return isinstance(other, LocalClass) and other.type is self.type
+
+    def _isInstance(self, agent, obj):
+        return isinstance(obj, self.type)
+
+    def _cast(self, agent, obj):
+        return obj
+
+    def _isAssignableFrom(self, agent, other: 'LocalClass'):
+        return issubclass(other.type, self.type)
+
+    def _getSuperclass(self, agent):
+        if self.type is object or len(mro := self.type.__mro__) < 2:
+            return None
+        return agent.classof(mro[1], type=True)
+
+    def fields(self) -> List[str]:
+        '''类自身声明的字段：类型注解、`__slots__`以及非方法的类属性'''
+        namespace = self.type.__dict__
+        names = dict.fromkeys((*namespace.get('__annotations__', ()), *namespace.get('__slots__', ())))
+        for name, val in namespace.items():
+            if not name.startswith('__') and not callable(val) and not isinstance(val, (staticmethod, classmethod, property)):
+                names[name] = None
+        return list(names)
+
+    def _getDeclaredField(self, agent, name: str):
+        if name in self.fields():
+            return LocalField(self, name)
+        raise LocalError(f'NoSuchFieldException: {name}')
+
+    def _getDeclaredFields(self, agent):
+        return [LocalField(self, name) for name in self.fields()]
+
+    def _getEnumConstants(self, agent):
+        if issubclass(self.type, enum.Enum):
+            return list(self.type)
+        return None
+
+    def _getDeclaredConstructor(self, agent, *types):
+        return LocalConstructor(self)
+
+    def _getConstructors(self, agent):
+        return [LocalConstructor(self)]
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, LocalClass) and other.type is self.type
+
+    def __hash__(self) -> int:
+        return hash(self.type)
+
+    def __str__(self) -> str:
+        return f'class {self.name}'
+
+
+class LocalField:
+    '''本地模拟的`java.lang.reflect.Field`'''
+
+    __slots__ = ('clz', 'name')
+
+    def __init__(self, clz: LocalClass, name: str) -> None:
+        self.clz = clz
+        self.name = name
+
+    def owner(self, obj):
+        # 静态字段忽略调用对象
+        return self.clz.statics if obj is None or isinstance(obj, LocalClass) else obj
+
+    def get(self, obj):
+        return getattr(self.owner(obj), self.name)
+
+    def set(self, obj, val):
+        setattr(self.owner(obj), self.name, val)
+
+    def getName(self):
+        return self.name
+
+    def setAccessible(self, flag):
+        pass
+
+    def __str__(self) -> str:
+        return f'{self.clz.name}.{self.name}'
+
+
+class LocalConstructor:
+    '''本地模拟的`java.lang.reflect.Constructor`'''
+
+    __slots__ = ('clz',)
+
+    def __init__(self, clz: LocalClass) -> None:
+        self.clz = clz
+
+    def newInstance(self, *args):
+        return self.clz.type(*args)
+
+    def setAccessible(self, flag):
+        pass
+
+
+class LocalStream:
+    '''本地模拟的`java.util.stream.Stream`'''
+
+    __slots__ = ('iterable',)
+
+    def __init__(self, iterable) -> None:
+        self.iterable = iterable
+
+    def boxed(self):
+        return self
+
+    def count(self):
+        return sum(1 for _ in self.iterable)
+
+    def toList(self):
+        return list(self.iterable)
+
+    def iterator(self):
+        return LocalIterator(self.iterable)
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+
+class LocalIterator:
+    '''本地模拟的`java.util.Iterator`'''
+
+    __slots__ = ('_iterator', '_next', '_has')
+
+    def __init__(self, iterable) -> None:
+        self._iterator = iter(iterable)
+        self._advance()
+
+    def _advance(self) -> None:
+        try:
+            self._next, self._has = next(self._iterator), True
+        except StopIteration:
+            self._next, self._has = None, False
+
+    def hasNext(self) -> bool:
+        return self._has
+
+    def next(self) -> Any:
+        if not self._has:
+            raise LocalError('NoSuchElementException')
+        value = self._next
+        self._advance()
+        return value
+
+
+class LocalAtomicLong:
+    '''本地模拟的`java.util.concurrent.atomic.AtomicLong`'''
+
+    __slots__ = ('value',)
+
+    def __init__(self, value: int = 0) -> None:
+        self.value = value
+
+    def get(self) -> int:
+        return self.value
+
+    def set(self, value: int) -> None:
+        self.value = value
+
+    def addAndGet(self, delta: int) -> int:
+        self.value += delta
+        return self.value
+
+    def incrementAndGet(self) -> int:
+        return self.addAndGet(1)
+
+    def decrementAndGet(self) -> int:
+        return self.addAndGet(-1)
+
+
+class LocalAtomicReference:
+    '''本地模拟的`java.util.concurrent.atomic.AtomicReference`'''
+
+    __slots__ = ('value',)
+
+    def __init__(self, value: Any = None) -> None:
+        self.value = value
+
+    def get(self) -> Any:
+        return self.value
+
+    def set(self, value: Any) -> None:
+        self.value = value
+
+
+class LocalTreeMap(dict):
+    '''本地模拟的`java.util.TreeMap`，按键的自然顺序排列'''
+
+    def firstEntry(self):
+        return (key := min(self), self[key]) if self else None
+
+    def pollFirstEntry(self):
+        if (entry := self.firstEntry()) is not None:
+            del self[entry[0]]
+        return entry
+
+    def descendingMap(self):
+        return {key: self[key] for key in sorted(self, reverse=True)}
+
+
+class _System:
+    properties: Dict[str, str] = {}
+
+    @staticmethod
+    def getProperty(key, default=None):
+        return _System.properties.get(key, default)
+
+    @staticmethod
+    def setProperty(key, val):
+        old = _System.properties.get(key)
+        _System.properties[key] = val
+        return old
+
+    @staticmethod
+    def currentTimeMillis():
+        return int(time.time() * 1000)
+
+    @staticmethod
+    def nanoTime():
+        return time.perf_counter_ns()
+
+
+class _Objects:
+
+    @staticmethod
+    def isNull(obj):
+        return obj is None
+
+    @staticmethod
+    def nonNull(obj):
+        return obj is not None
+
+    @staticmethod
+    def equals(a, b):
+        return a == b
+
+    @staticmethod
+    def requireNonNull(obj, message=None):
+        if obj is None:
+            raise LocalError(f'NullPointerException: {message}')
+        return obj
+
+    @staticmethod
+    def toString(obj, default='null'):
+        return default if obj is None else str(obj)
+
+
+class _Arrays:
+
+    @staticmethod
+    def asList(*args):
+        return list(args)
+
+
+class _Array:
+
+    @staticmethod
+    def get(arr, index):
+        return arr[index]
+
+    @staticmethod
+    def getLength(arr):
+        return len(arr)
+
+
+class _Integer:
+    MAX_VALUE = 2 ** 31 - 1
+    MIN_VALUE = -2 ** 31
+    valueOf = parseInt = staticmethod(int)
+
+    @staticmethod
+    def signum(value):
+        return (value > 0) - (value < 0)
+
+
+class _Long:
+    MAX_VALUE = 2 ** 63 - 1
+    MIN_VALUE = -2 ** 63
+    valueOf = parseLong = staticmethod(int)
+
+
+class _String:
+
+    @staticmethod
+    def valueOf(obj):
+        return 'null' if obj is None else str(obj)
+
+
+class _IntStream:
+
+    @staticmethod
+    def range(start, end):
+        return LocalStream(range(start, end))
+
+
+def _put(mp: dict, key, val):
+    old = mp.get(key)
+    mp[key] = val
+    return old
+
+
+def _put_absent(mp: dict, key, val):
+    old = mp.get(key)
+    if old is None:
+        mp[key] = val
+    return old
+
+
+def _poll_first(dq: deque):
+    return dq.popleft() if dq else None
+
+
+def _add(li: list, *args):
+    li.insert(args[0], args[1]) if len(args) == 2 else li.append(args[0])
+    return True
+
+
+def _set(li: list, index, val):
+    old = li[index]
+    li[index] = val
+    return old
+
+
+METHODS: Dict[type, Dict[str, Callable]] = {
+    list: {
+        'add': _add, 'get': list.__getitem__, 'set': _set, 'size': len,
+        'isEmpty': lambda li: not li, 'contains': list.__contains__, 'clear': list.clear,
+        'stream': LocalStream, 'toArray': list, 'iterator': LocalIterator,
+    },
+    dict: {
+        'put': _put, 'putIfAbsent': _put_absent, 'get': dict.get, 'getOrDefault': dict.get, 'remove': lambda mp, key: mp.pop(key, None),
+        'containsKey': dict.__contains__, 'size': len, 'isEmpty': lambda mp: not mp,
+        'keySet': list, 'values': lambda mp: list(mp.values()), 'entrySet': lambda mp: list(mp.items()),
+    },
+    str: {
+        'length': len, 'isEmpty': lambda s: not s, 'contains': str.__contains__,
+        'startsWith': str.startswith, 'endsWith': str.endswith, 'toUpperCase': str.upper,
+        'toLowerCase': str.lower, 'substring': lambda s, start, end=None: s[start:end],
+        'compareTo': lambda a, b: (a > b) - (a < b),
+    },
+    deque: {
+        'add': lambda dq, val: dq.append(val) or True, 'pollFirst': _poll_first, 'size': len,
+        'isEmpty': lambda dq: not dq,
+    },
+    tuple: {
+        'getKey': lambda entry: entry[0], 'getValue': lambda entry: entry[1],
+    },
+    int: {
+        'intValue': int, 'longValue': int, 'doubleValue': float,
+        'compareTo': lambda a, b: (a > b) - (a < b),
+    },
+}
+'''Python内置类型的Java方法映射'''
+
+OBJECT_METHODS: Dict[str, Callable] = {
+    'equals': lambda obj, other: obj == other,
+    'hashCode': hash,
+    'toString': str,
+}
+'''所有对象共有的Java方法映射'''
+
+
+CLASSES: Dict[str, LocalClass] = {clz.name: clz for clz in (
+    LocalClass(object, 'java.lang.Object'),
+    LocalClass(LocalClass, 'java.lang.Class'),
+    LocalClass(int, 'java.lang.Integer', _Integer),
+    LocalClass(int, 'java.lang.Long', _Long),
+    LocalClass(bool, 'java.lang.Boolean'),
+    LocalClass(float, 'java.lang.Double'),
+    LocalClass(str, 'java.lang.String', _String),
+    LocalClass(_System, 'java.lang.System'),
+    LocalClass(_Objects, 'java.util.Objects'),
+    LocalClass(_Arrays, 'java.util.Arrays'),
+    LocalClass(_Array, 'java.lang.reflect.Array'),
+    LocalClass(LocalField, 'java.lang.reflect.Field'),
+    LocalClass(list, 'java.util.ArrayList'),
+    LocalClass(dict, 'java.util.HashMap'),
+    LocalClass(dict, 'java.util.LinkedHashMap'),
+    LocalClass(LocalStream, 'java.util.stream.Stream'),
+    LocalClass(LocalIterator, 'java.util.Iterator'),
+    LocalClass(LocalTreeMap, 'java.util.TreeMap'),
+    LocalClass(deque, 'java.util.ArrayDeque'),
+    LocalClass(LocalAtomicLong, 'java.util.concurrent.atomic.AtomicLong'),
+    LocalClass(LocalAtomicReference, 'java.util.concurrent.atomic.AtomicReference'),
+    LocalClass(_IntStream, 'java.util.stream.IntStream'),
+)}
+'''默认的本地类模型'''
+
+
+class LocalAgent(Agent):
+    '''本地执行代理
+
+    纯Python实现的调用链解释器，在一个简易的本地对象模型上执行`Jsonify`生成的调用链，
+    支持`class`/`local`/`self`/`iter`/`if`入口，`$n`引用、符号表和标记返回值。
+    可以直接在进程内使用，也可以通过`serve`启动本地HTTP服务替代真实的agent，用于离线测试和压测
+    '''
+
+    EACH = '$_each_in_iter'
+    '''迭代元素的引用名称'''
+
+    SYMBOLS = '$_symbols'
+    '''请求符号表的引用名称'''
+
+    def __init__(self, root: Any = None, classes: Dict[str, LocalClass] = None, *, max_handles: int = 64) -> None:
+        '''初始化本地代理
+
+        参数
+        ---
+        `root: Any`
+            `self`入口对应的根对象
+        `classes: Dict[str, LocalClass]`
+            额外注册的本地类模型，与默认的`CLASSES`合并
+        `max_handles: int`
+            单个会话最多持有的`pin`句柄数量
+        ---
+        '''
+        self.root = root
+        self.classes = {**CLASSES, **(classes or {})}
+        self.max_handles = max_handles
+        self.sessions: Dict[str, LocalSession] = {}
+        '''会话保存的句柄和分段引用，参考`pyava.chains.chunked`和`pin`'''
+        self._names = {}
+        self._lock = threading.Lock()
+        for clz in self.classes.values():
+            self._names.setdefault(clz.type, clz)
+
+    def register(self, name: str, type: type, statics: Any = None) -> LocalClass:
+        '''注册本地类模型'''
+        self.classes[name] = clz = LocalClass(type, name, statics)
+        self._names.setdefault(type, clz)
+        return clz
+
+    def classof(self, obj: Any, type: bool = False) -> LocalClass:
+        '''获取对象（或者Python类型）对应的本地类模型'''
+        t = obj if type else obj.__class__
+        if (clz := self._names.get(t)) is None:
+            clz = LocalClass(t, f'{t.__module__}.{t.__qualname__}')
+        return clz
+
+    def forname(self, name: str) -> LocalClass:
+        '''按类名查找本地类模型'''
+        if (clz := self.classes.get(name)) is None:
+            raise LocalError(f'ClassNotFoundException: {name}')
+        return clz
+
+    @property
+    def symbols(self) -> bool:
+        return True
+
+    @property
+    def stateful(self) -> bool:
+        return True
+
+    def debug(self, data) -> Dict[str, Any]:
+        session = None
+        try:
+            payload = wire.unpackb(data) if isinstance(data, bytes) else json.loads(data)
+            locals = {}
+            if (session := payload.get('session')) is not None:
+                locals.update(self.load(session))
+            if (symbols := payload.get('symbols')) is not None:
+                locals[self.SYMBOLS] = Symbols(symbols)
+            ret = self.execute(payload, locals)
+            if session is not None:
+                ret = self.save(session, locals, ret)
+            return {'code': 200, 'data': json.loads(json.dumps(ret, default=self._encode))}
+        except LocalError as e:
+            ret = {'code': 500, 'message': str(e)}
+        except Exception as e:
+            ret = {'code': 500, 'message': f'{type(e).__name__}: {e}'}
+        if session is not None:
+            self.discard(session)
+        return ret
+
+    def load(self, session: Dict[str, Any]) -> Dict[str, Any]:
+        '''载入会话的句柄和分段引用，同时清理所有会话内过期的句柄'''
+        now = time.monotonic()
+        with self._lock:
+            for sid, state in tuple(self.sessions.items()):
+                state.purge(now)
+                if state.empty:
+                    del self.sessions[sid]
+            if (state := self.sessions.get(session['id'])) is None:
+                state = LocalSession()
+            if (pin := session.get('pin')) is not None and pin['name'] not in state.handles \
+                    and len(state.handles) - len(session.get('release', ())) >= self.max_handles:
+                raise LocalError(f'too many handles in session {session["id"]}: {self.max_handles}')
+            locals = {name: value for name, (_, value) in state.handles.items()}
+            if (chunk := session.get('chunk')) is not None:
+                locals.update(state.chunks.get(chunk, ()))
+            return locals
+
+    def save(self, session: Dict[str, Any], locals: Dict[str, Any], ret: Any) -> Any:
+        '''保存会话的句柄和分段引用，`pin`请求不返回结果'''
+        with self._lock:
+            state = self.sessions.setdefault(session['id'], LocalSession())
+            for name in session.get('release', ()):
+                state.handles.pop(name, None)
+            if (pin := session.get('pin')) is not None:
+                state.handles[pin['name']] = (time.monotonic() + pin.get('ttl', 300), ret)
+                ret = None
+            if (chunk := session.get('chunk')) is not None:
+                if session.get('close'):
+                    state.chunks.pop(chunk, None)
+                else:
+                    state.chunks.setdefault(chunk, {}).update((name, locals[name]) for name in session.get('keep', ()))
+            if state.empty:
+                del self.sessions[session['id']]
+        return ret
+
+    def discard(self, session: Dict[str, Any]) -> None:
+        '''执行失败时丢弃分段保存的引用，句柄不受影响'''
+        with self._lock:
+            if (state := self.sessions.get(session['id'])) is None:
+                return
+            if (chunk := session.get('chunk')) is not None:
+                state.chunks.pop(chunk, None)
+            if state.empty:
+                del self.sessions[session['id']]
+
+    def execute(self, payload: Dict[str, Any], locals: Dict[str, Any]) -> Any:
+        '''顺序执行调用链，返回最后一个节点的值'''
+        value = None
+        for node in payload['chains'] if 'chains' in payload else (payload,):
+            value = self.step(node, value, locals)
+            if (local := node.get('local')) is not None:
+                locals[local] = value
+        return value
+
+    def step(self, node: Dict[str, Any], value: Any, locals: Dict[str, Any]) -> Any:
+        '''执行单个节点，`value`为前置节点的值'''
+        if (method := node.get('method')) is not None:
+            if isinstance(method, int):
+                method = locals[self.SYMBOLS].names[method]
+            args = [self.argument(arg, locals) for arg in node.get('args', ())]
+            return self.call(value, method, args)
+        match node.get('type'), node.get('ref'):
+            case 'class', int(index):
+                return locals[self.SYMBOLS].resolve(self, index)
+            case 'class', ref:
+                return self.forname(ref)
+            case 'local', ref:
+                if ref not in locals:
+                    raise LocalError(f'undefined local reference: {ref}')
+                return locals[ref]
+            case 'self', _:
+                return self.root
+            case 'iter', ref:
+                for each in value:
+                    locals[self.EACH] = each
+                    self.execute(ref, locals)
+                return None
+            case 'if', ref:
+                branch = ref['true'] if self.execute(ref['if'], locals) else ref['false']
+                return None if branch is None else self.execute(branch, locals)
+            case other, _:
+                raise LocalError(f'unknown entry type: {other}')
+
+    def argument(self, arg: Any, locals: Dict[str, Any]) -> Any:
+        if isinstance(arg, dict):
+            return self.execute(arg, locals)
+        return arg
+
+    def call(self, target: Any, name: str, args: List[Any]) -> Any:
+        if target is None:
+            raise LocalError(f'NullPointerException: null.{name}')
+        if isinstance(target, LocalClass):
+            return target.member(self, name)(*args)
+        if name == 'getClass':
+            return self.classof(target)
+        for t in target.__class__.__mro__:
+            if (methods := METHODS.get(t)) and (method := methods.get(name)):
+                return method(target, *args)
+        if callable(method := getattr(target, name, None)):
+            return method(*args)
+        if isinstance(target, enum.Enum) and name in ('name', 'ordinal'):
+            return target.name if name == 'name' else list(target.__class__).index(target)
+        if (method := OBJECT_METHODS.get(name)) is not None:
+            return method(target, *args)
+        raise LocalError(f'NoSuchMethodException: {self.classof(target).name}.{name}')
+
+    def _encode(self, obj: Any) -> Any:
+        if isinstance(obj, LocalClass):
+            return obj.name
+        if isinstance(obj, enum.Enum):
+            return obj.name
+        if isinstance(obj, (LocalAtomicLong, LocalAtomicReference)):
+            return obj.value
+        if isinstance(obj, (LocalStream, set, frozenset, tuple, range, deque)):
+            return list(obj)
+        if hasattr(obj, '__dict__'):
+            return vars(obj)
+        return str(obj)
+
+    def serve(self, host: str = '127.0.0.1', port: int = 0) -> 'LocalServer':
+        '''启动本地HTTP服务替代真实的agent
+
+        ```
+        with LocalAgent().serve() as server, HttpAgent(server.url):
+            ...
+        ```
+        '''
+        return LocalServer(self, (host, port))
+
+
+class LocalSession:
+    '''本地代理的会话状态'''
+
+    __slots__ = ('handles', 'chunks')
+
+    def __init__(self) -> None:
+        self.handles: Dict[str, Tuple[float, Any]] = {}
+        '''`pin`句柄：名称 -> (过期时间, 对象)'''
+        self.chunks: Dict[str, Dict[str, Any]] = {}
+        '''分段请求保存的引用：分段标识 -> 引用'''
+
+    def purge(self, now: float) -> None:
+        for name in [name for name, (expires, _) in self.handles.items() if expires <= now]:
+            del self.handles[name]
+
+    @property
+    def empty(self) -> bool:
+        return not self.handles and not self.chunks
+
+
+class Symbols:
+    '''请求的符号表，在请求内缓存下标对应的类模型'''
+
+    def __init__(self, names: List[str]) -> None:
+        self.names = names
+        self.classes: Dict[int, LocalClass] = {}
+
+    def resolve(self, agent: LocalAgent, index: int) -> LocalClass:
+        if (clz := self.classes.get(index)) is None:
+            clz = self.classes[index] = agent.forname(self.names[index])
+        return clz
+
+
+DECODERS: Dict[str, Callable[[bytes], bytes]] = {'gzip': gzip.decompress}
+'''本地HTTP服务支持的请求体压缩编码'''
+if zstandard is not None:
+    # zstd的解压器实例不是线程安全的，每次解压单独创建
+    DECODERS['zstd'] = lambda body: zstandard.ZstdDecompressor().decompress(body)
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    server: 'LocalServer'
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self) -> None:
+        self.send_response(200)
+        if wire.CONTENT_TYPE in self.headers.get('Accept', ''):
+            self.send_header('Content-Type', wire.CONTENT_TYPE)
+        self.send_header('Accept-Encoding', ', '.join(DECODERS))
+        self.send_header(SYMBOLS_HEADER, '1')
+        self.send_header(SESSIONS_HEADER, '1')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if (encoding := self.headers.get('Content-Encoding', 'identity')) != 'identity':
+            if (decode := DECODERS.get(encoding)) is None:
+                # 不支持的请求体压缩编码，客户端按响应头重新协商
+                return self.reply(415, 'text/plain', f'unsupported Content-Encoding: {encoding}'.encode())
+            body = decode(body)
+        self.server.encodings[f'request:{encoding}'] += 1
+        if self.headers.get('Content-Type', '').startswith(wire.CONTENT_TYPE):
+            ret = self.server.agent.debug(body)
+        else:
+            ret = self.server.agent.debug(json.loads(body)['json'])
+        if wire.CONTENT_TYPE in self.headers.get('Accept', ''):
+            content_type, body = wire.CONTENT_TYPE, wire.packb(ret)
+        else:
+            content_type, body = 'application/json', json.dumps(ret, separators=(',', ':')).encode()
+        self.reply(200, content_type, body)
+
+    def reply(self, status: int, content_type: str, body: bytes) -> None:
+        accepts = {token.split(';')[0].strip() for token in self.headers.get('Accept-Encoding', '').split(',')}
+        encoding = next((encoding for encoding in reversed(ENCODERS) if encoding in accepts), None)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Accept-Encoding', ', '.join(DECODERS))
+        self.send_header(SYMBOLS_HEADER, '1')
+        self.send_header(SESSIONS_HEADER, '1')
+        if status == 200 and encoding is not None and len(body) >= self.server.compress:
+            body = ENCODERS[encoding](body)
+            self.send_header('Content-Encoding', encoding)
+        else:
+            encoding = 'identity'
+        self.server.encodings[f'response:{encoding}'] += 1
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class LocalServer(ThreadingHTTPServer):
+    '''本地agent的HTTP服务，在后台线程内运行
+
+    支持`gzip`和`zstd`（安装了`zstandard`时）压缩的请求体，响应体超过`compress`字节时按`Accept-Encoding`压缩。
+    `encodings`按`request:编码`和`response:编码`统计收发的请求数
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, agent: LocalAgent, address, compress: int = 1024) -> None:
+        super().__init__(address, _Handler)
+        self.agent = agent
+        self.compress = compress
+        self.encodings: Counter[str] = Counter()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def start(self) -> Self:
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> Self:
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
@@ -4,6 +4,8 @@ from typing import Callable, Dict, List
 
 from back.json import jsonify
 
+from .chains import Projection
+
 _void = inspect.Signature.empty
 
 
@@ -52,13 +54,18 @@ def Param(argname: str, type=_void, default=_void, desc: str = _void):
 
 
 def TableColumn(name: str, label: str, **kwargs):
-    '''标记列表结果的表格列字段信息'''
+    '''标记列表结果的表格列字段信息
+
+    代码执行期间处于`Projection`模式，调用了`Iter.project`的遍历只在agent上读取并返回标记的列字段
+    '''
     def decorator[C: Callable](code: C) -> C:
         is_raw = (cs := getattr(code, '__meta_columns__', None)) is None
         if is_raw:
             @functools.wraps(code)
             def wrapper(*args, **kwargs):
-                return {'meta': {'field': 'data', 'columns': cs}, 'data': jsonify(code(*args, **kwargs))}
+                with Projection(*(column['name'] for column in cs)):
+                    data = code(*args, **kwargs)
+                return {'meta': {'field': 'data', 'columns': cs}, 'data': jsonify(data)}
             setattr(wrapper, '__meta_columns__', cs := [])
         kwargs['name'] = name
         kwargs['label'] = label
@@ -0,0 +1,178 @@
+'''
+二进制传输格式
+
+MessagePack兼容的紧凑编码，用于调用链数据和执行结果的传输。
+安装了`msgpack`时直接使用其C实现，否则使用纯Python实现；纯Python实现比JSON更慢，只用于解码agent的二进制响应
+'''
+import struct
+from typing import Any, Callable
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+NATIVE = msgpack is not None and msgpack.Packer.__module__ != 'msgpack.fallback'
+'''是否可以使用`msgpack`的C实现，只有这时才协商二进制传输格式'''
+
+CONTENT_TYPE = 'application/x-msgpack'
+'''二进制格式的Content-Type'''
+
+
+def _pack(obj: Any, default: Callable[[Any], Any] = None) -> bytes:
+    buf = bytearray()
+    write = buf.extend
+    pack = struct.pack
+
+    def encode(obj: Any) -> None:
+        if obj is None:
+            buf.append(0xc0)
+        elif obj is True:
+            buf.append(0xc3)
+        elif obj is False:
+            buf.append(0xc2)
+        elif isinstance(obj, int):
+            if 0 <= obj < 0x80:
+                buf.append(obj)
+            elif -0x20 <= obj < 0:
+                buf.append(obj & 0xff)
+            elif obj >= 0:
+                if obj <= 0xff:
+                    write(pack('>BB', 0xcc, obj))
+                elif obj <= 0xffff:
+                    write(pack('>BH', 0xcd, obj))
+                elif obj <= 0xffffffff:
+                    write(pack('>BI', 0xce, obj))
+                else:
+                    write(pack('>BQ', 0xcf, obj))
+            elif obj >= -0x80:
+                write(pack('>Bb', 0xd0, obj))
+            elif obj >= -0x8000:
+                write(pack('>Bh', 0xd1, obj))
+            elif obj >= -0x80000000:
+                write(pack('>Bi', 0xd2, obj))
+            else:
+                write(pack('>Bq', 0xd3, obj))
+        elif isinstance(obj, float):
+            write(pack('>Bd', 0xcb, obj))
+        elif isinstance(obj, str):
+            data = obj.encode()
+            if (n := len(data)) < 0x20:
+                buf.append(0xa0 | n)
+            elif n <= 0xff:
+                write(pack('>BB', 0xd9, n))
+            elif n <= 0xffff:
+                write(pack('>BH', 0xda, n))
+            else:
+                write(pack('>BI', 0xdb, n))
+            write(data)
+        elif isinstance(obj, (list, tuple)):
+            if (n := len(obj)) < 0x10:
+                buf.append(0x90 | n)
+            elif n <= 0xffff:
+                write(pack('>BH', 0xdc, n))
+            else:
+                write(pack('>BI', 0xdd, n))
+            for item in obj:
+                encode(item)
+        elif isinstance(obj, dict):
+            if (n := len(obj)) < 0x10:
+                buf.append(0x80 | n)
+            elif n <= 0xffff:
+                write(pack('>BH', 0xde, n))
+            else:
+                write(pack('>BI', 0xdf, n))
+            for key, val in obj.items():
+                encode(key)
+                encode(val)
+        elif isinstance(obj, (bytes, bytearray)):
+            if (n := len(obj)) <= 0xff:
+                write(pack('>BB', 0xc4, n))
+            elif n <= 0xffff:
+                write(pack('>BH', 0xc5, n))
+            else:
+                write(pack('>BI', 0xc6, n))
+            write(obj)
+        elif default is not None:
+            encode(default(obj))
+        else:
+            raise TypeError(f'Object of type {type(obj).__name__} is not msgpack serializable')
+
+    encode(obj)
+    return bytes(buf)
+
+
+_FIXED = {
+    0xcc: struct.Struct('>B'), 0xcd: struct.Struct('>H'), 0xce: struct.Struct('>I'), 0xcf: struct.Struct('>Q'),
+    0xd0: struct.Struct('>b'), 0xd1: struct.Struct('>h'), 0xd2: struct.Struct('>i'), 0xd3: struct.Struct('>q'),
+    0xca: struct.Struct('>f'), 0xcb: struct.Struct('>d'),
+}
+_SIZES = {
+    0xd9: struct.Struct('>B'), 0xda: struct.Struct('>H'), 0xdb: struct.Struct('>I'),
+    0xc4: struct.Struct('>B'), 0xc5: struct.Struct('>H'), 0xc6: struct.Struct('>I'),
+    0xdc: struct.Struct('>H'), 0xdd: struct.Struct('>I'),
+    0xde: struct.Struct('>H'), 0xdf: struct.Struct('>I'),
+}
+
+
+def _unpack(data: bytes) -> Any:
+    view = memoryview(data)
+    pos = 0
+
+    def decode() -> Any:
+        nonlocal pos
+        b = data[pos]
+        pos += 1
+        if b < 0x80:
+            return b
+        if b >= 0xe0:
+            return b - 0x100
+        if 0xa0 <= b <= 0xbf:
+            n = b & 0x1f
+        elif 0x90 <= b <= 0x9f:
+            return [decode() for _ in range(b & 0x0f)]
+        elif 0x80 <= b <= 0x8f:
+            return {decode(): decode() for _ in range(b & 0x0f)}
+        elif b == 0xc0:
+            return None
+        elif b == 0xc2:
+            return False
+        elif b == 0xc3:
+            return True
+        elif (fixed := _FIXED.get(b)) is not None:
+            val, = fixed.unpack_from(data, pos)
+            pos += fixed.size
+            return val
+        elif (size := _SIZES.get(b)) is not None:
+            n, = size.unpack_from(data, pos)
+            pos += size.size
+            if b in (0xdc, 0xdd):
+                return [decode() for _ in range(n)]
+            if b in (0xde, 0xdf):
+                return {decode(): decode() for _ in range(n)}
+            if b in (0xc4, 0xc5, 0xc6):
+                pos += n
+                return bytes(view[pos - n:pos])
+        else:
+            raise ValueError(f'unsupported msgpack type 0x{b:02x} at {pos - 1}')
+        pos += n
+        return str(view[pos - n:pos], 'utf-8')
+
+    val = decode()
+    if pos != len(data):
+        raise ValueError(f'extra data after msgpack value at {pos}')
+    return val
+
+
+def packb(obj: Any, default: Callable[[Any], Any] = None) -> bytes:
+    '''编码为二进制数据，`default`用于转换无法直接编码的对象'''
+    if msgpack is not None:
+        return msgpack.packb(obj, default=default, use_bin_type=True)
+    return _pack(obj, default)
+
+
+def unpackb(data: bytes) -> Any:
+    '''解码二进制数据'''
+    if msgpack is not None:
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+    return _unpack(data)
@@ -0,0 +1,99 @@
+import unittest
+
+from pyava import Class
+from pyava.analyze import AnalyzeAgent, FakeRow, analyze
+from pyava.chains import Iter
+
+
+def manager():
+    return Class('x.PlayerManager').getInstance()
+
+
+def per_player(pids):
+    levels = []
+    for pid in pids:
+        levels.append(manager().getPlayer(pid).getLevel().unwrap())
+    return levels
+
+
+def vectorized(pids):
+    return Iter.over(pids, lambda Each: manager().getPlayer(Each).getLevel()).unwrap()
+
+
+def paged(n):
+    for _ in range(n):
+        for page in Iter(manager().getPlayers()).pages(size=100):
+            pass
+
+
+class AnalyzeTest(unittest.TestCase):
+
+    def test_loop_is_reported(self) -> None:
+        report = analyze(per_player, args=(range(5),))
+        self.assertEqual(len(report.requests), 5)
+        loop, = report.loops()
+        self.assertEqual(loop['count'], 5)
+        self.assertIn('per_player', loop['site'])
+        self.assertEqual(loop['bytes'], report.total)
+        self.assertAlmostEqual(report.cost, 5 * report.rtt + report.total / report.bandwidth)
+        self.assertIn('N+1: 5 requests', str(report))
+
+    def test_vectorized_has_no_loop(self) -> None:
+        report = analyze(vectorized, kwargs={'pids': range(5)})
+        self.assertEqual(len(report.requests), 1)
+        self.assertEqual(report.loops(), [])
+        self.assertIsNone(report.error)
+
+    def test_session_traffic_is_not_a_loop(self) -> None:
+        report = analyze(paged, args=(3,))
+        # 每次分页遍历包括游标、分页和释放请求
+        self.assertEqual(len(report.requests), 9)
+        self.assertTrue(all(request.session for request in report.requests))
+        self.assertEqual(report.loops(), [])
+
+    def test_error_is_recorded(self) -> None:
+        def code():
+            manager().getPlayer(1).unwrap()
+            raise KeyError('level')
+
+        report = analyze(code)
+        self.assertEqual(len(report.requests), 1)
+        self.assertEqual(report.error, "KeyError: 'level'")
+        self.assertEqual(report.json()['detail'][0]['method'], 'getPlayer')
+
+    def test_deepest(self) -> None:
+        def code():
+            manager().getPlayer(Class('java.lang.Long').valueOf(manager().getPlayerCount())).unwrap()
+            manager().unwrap()
+
+        report = analyze(code)
+        self.assertEqual(report.deepest.index, 0)
+        self.assertEqual(report.deepest.depth, 3)
+        # 单个节点的请求数据同样计入
+        self.assertEqual(report.requests[1].nodes, 2)
+
+
+class AnalyzeAgentTest(unittest.TestCase):
+
+    def test_fakes(self) -> None:
+        agent = AnalyzeAgent(size=3, fakes={'getLevel': 7})
+        with agent:
+            self.assertEqual(manager().getPlayer(1).getLevel().unwrap(), 7)
+            self.assertEqual(manager().getPlayerCount().unwrap(), 3)
+            self.assertEqual(len(manager().getPlayers().unwrap()), 3)
+            self.assertTrue(manager().isOnline().unwrap())
+            self.assertIsInstance(manager().getPlayer(1).unwrap(), FakeRow)
+            self.assertEqual(manager().getPlayer(1).unwrap()['level'], 0)
+        self.assertEqual(len(agent.requests), 6)
+
+    def test_pin(self) -> None:
+        agent = AnalyzeAgent()
+        with agent:
+            handle = manager().pin()
+            self.assertEqual(handle.getPlayerCount().unwrap(), 10)
+            handle.release()
+        self.assertEqual([request.session for request in agent.requests], [True, True, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import asyncio
+import unittest
+
+from pyava import Class, Scope
+from pyava.agent import Agent, AgentError, HttpAgent, HttpPool
+from pyava.local import LocalAgent
+
+
+def size(n: int):
+    return Class('java.util.Arrays').asList(*range(n)).size()
+
+
+class AsyncTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_aunwrap(self) -> None:
+        async with LocalAgent():
+            self.assertEqual(await size(3).aunwrap(), 3)
+            self.assertEqual((await size(2).ainvoke())['data'], 2)
+            li = Class('java.util.ArrayList').getDeclaredConstructor().newInstance()
+            self.assertEqual(await Scope()(li)(li.add(1))(li.size()).aunwrap(), 1)
+        self.assertIsNone(Agent._SHARED)
+
+    async def test_error(self) -> None:
+        async with LocalAgent():
+            with self.assertRaises(AgentError):
+                await Class('x.Missing').foo().aunwrap()
+
+    async def test_http(self) -> None:
+        server, pool = LocalAgent().serve(port=0).start(), HttpPool()
+        try:
+            async with HttpAgent(server.url, pool=pool):
+                self.assertEqual(await asyncio.gather(*(size(n).aunwrap() for n in range(5))), list(range(5)))
+        finally:
+            server.stop()
+            pool.close()
+
+    async def test_tasks_use_own_agent(self) -> None:
+        '''同一事件循环内的任务分别使用各自的agent'''
+        agents = [LocalAgent() for _ in range(3)]
+
+        async def run(agent: LocalAgent) -> Agent:
+            async with agent:
+                await asyncio.sleep(0)
+                await size(1).aunwrap()
+                return Agent._SHARED
+
+        self.assertEqual(await asyncio.gather(*map(run, agents)), agents)
+
+
+if __name__ == '__main__':
+    unittest.main()
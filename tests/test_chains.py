@@ -0,0 +1,582 @@
+import copy
+import json
+import time
+import unittest
+from typing import List
+from unittest import mock
+
+from pyava import Batch, Class, Placeholder, Scope, wire
+from pyava.agent import CACHE, AgentError, HttpAgent, HttpPool, ResponseCache, iterdecode
+from pyava.chains import IfElse, Iter, Jsonify, Projection, flatten, optimize, transmute
+from pyava.local import LocalAgent, LocalClass
+
+
+def decode(chunks):
+    '''逐个读取`iterdecode`生成的元素，返回`(元素列表, 其余字段)`'''
+    gen, items = iterdecode(chunks), []
+    while True:
+        try:
+            items.append(next(gen))
+        except StopIteration as stop:
+            return items, stop.value
+
+
+def split(text: str, size: int):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class Registry:
+    '''测试用的本地类，`getMap`每次返回同一个字典'''
+
+    map = {}
+
+    @staticmethod
+    def getMap():
+        return Registry.map
+
+
+class Base:
+    base: int
+
+    def __init__(self) -> None:
+        self.base = 1
+
+
+class Player(Base):
+    id: int
+
+    def __init__(self, id: int) -> None:
+        super().__init__()
+        self.id = id
+
+
+class Manager:
+    tag = 'T'
+    players = [Player(i) for i in range(5)]
+
+
+class CountingAgent(LocalAgent):
+    '''记录请求次数的本地agent'''
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.requests = []
+
+    def debug(self, data):
+        self.requests.append(data)
+        return super().debug(data)
+
+
+class StatelessAgent(CountingAgent):
+
+    @property
+    def stateful(self) -> bool:
+        return False
+
+
+class IterdecodeTest(unittest.TestCase):
+
+    def test_every_split(self) -> None:
+        data = [0, -1.5e3, 'a"b\\c', 'ü中\n', None, True, {'k': [1, {'x': ']'}]}, [], '}', 12345678901234567890]
+        text = json.dumps({'code': 200, 'data': data, 'extra': 'tail'})
+        for size in range(1, len(text) + 1):
+            items, rest = decode(split(text, size))
+            self.assertEqual(items, data, size)
+            self.assertEqual(rest, {'code': 200, 'extra': 'tail'}, size)
+
+    def test_dict_items(self) -> None:
+        text = json.dumps({'code': 200, 'data': {'a': 1, 'b': [2, 3]}})
+        for size in (1, 2, 7):
+            self.assertEqual(decode(split(text, size)), ([('a', 1), ('b', [2, 3])], {'code': 200}))
+
+    def test_error_is_not_streamed(self) -> None:
+        text = json.dumps({'data': [1, 2], 'code': 500})
+        self.assertEqual(decode(split(text, 3)), ([], {'data': [1, 2], 'code': 500}))
+
+    def test_truncated(self) -> None:
+        with self.assertRaises(ValueError):
+            decode(split('{"code":200,"data":[1,"ab', 4))
+
+    def test_unwrap_iter(self) -> None:
+        with LocalAgent().serve(port=0) as server, HttpAgent(server.url, pool=HttpPool()):
+            self.assertEqual(list(Class('java.util.Arrays').asList(*range(1000)).unwrap_iter()), list(range(1000)))
+            with self.assertRaises(AgentError):
+                list(Class('x.Missing').foo().unwrap_iter())
+
+
+class LocalAgentTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.agent = CountingAgent()
+        self.agent.__enter__()
+
+    def tearDown(self) -> None:
+        self.agent.__exit__(None, None, None)
+
+    def test_method_chain(self) -> None:
+        self.assertEqual(Class('java.util.Arrays').asList(1, 2, 3).size().unwrap(), 3)
+        self.assertEqual(Class('java.lang.Integer').valueOf(7).hashCode().unwrap(), 7)
+
+    def test_locals_and_marks(self) -> None:
+        li = Class('java.util.ArrayList').getDeclaredConstructor().newInstance()
+        scope = Scope()
+        scope(li)(li.add(1))(li.size(), mark=True)(li.add(2))(li.size(), mark=True)
+        self.assertEqual(scope.unwrap(), [1, 2])
+        self.assertEqual(len(self.agent.requests), 1)
+        self.assertIn('"local":"$1"', json.dumps(json.loads(self.agent.requests[0]), separators=(',', ':')))
+
+    def test_iter_and_if(self) -> None:
+        it = Iter(Class('java.util.Arrays').asList(1, 2, 3, 4))
+        it.filter(Iter.Each.equals(Class('java.lang.Integer').valueOf(2)).equals(False))
+        li = it.tolist()
+        self.assertEqual(Scope()(li)(it)(li).unwrap(), [1, 3, 4])
+        check = IfElse(Class('java.util.Arrays').asList().isEmpty()).ifTrue(Class('java.lang.Integer').valueOf(1))
+        self.assertEqual(check.unwrap(), 1)
+
+    def test_error(self) -> None:
+        with self.assertRaises(AgentError):
+            Class('x.Missing').foo().unwrap()
+        with self.assertRaises(AgentError):
+            Class('java.util.Arrays').asList().missing().unwrap()
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.agent = CountingAgent()
+        self.agent.__enter__()
+
+    def tearDown(self) -> None:
+        self.agent.__exit__(None, None, None)
+
+    def test_independent(self) -> None:
+        with Batch():
+            a = Class('java.util.Arrays').asList(1, 2).size().unwrap()
+            b = Class('java.lang.Integer').valueOf(7).hashCode().unwrap()
+            self.assertEqual(self.agent.requests, [])
+        self.assertEqual((a.value, b.value), (2, 7))
+        self.assertEqual(len(self.agent.requests), 1)
+
+    def test_dependent(self) -> None:
+        with Batch():
+            li = Class('java.util.Arrays').asList(1, 2, 3).unwrap()
+            size = Class('java.util.Objects').requireNonNull(li).size().unwrap()
+        self.assertEqual((li.value, size.value), ([1, 2, 3], 3))
+        self.assertEqual(len(self.agent.requests), 1)
+        # 已提交的延迟结果作为普通值传递
+        self.assertEqual(Class('java.lang.Integer').valueOf(size).hashCode().unwrap(), 3)
+
+    def test_failure(self) -> None:
+        with self.assertRaises(AgentError):
+            with Batch():
+                ok = Class('java.lang.Integer').valueOf(1).unwrap()
+                failed = Class('x.Missing').foo().unwrap()
+        for deferred in (ok, failed):
+            with self.assertRaises(AgentError):
+                deferred.value
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        CACHE.clear()
+        self.agent = CountingAgent()
+        self.agent.__enter__()
+
+    def tearDown(self) -> None:
+        self.agent.__exit__(None, None, None)
+        CACHE.clear()
+
+    def test_ttl_and_lru(self) -> None:
+        cache = ResponseCache(maxsize=2)
+        a, b, c = (cache.key('s', data) for data in ('a', b'b', 'c'))
+        cache.put(a, [1], 10)
+        cache.put(b, [2], 10)
+        self.assertEqual(cache.get(a), (True, [1]))
+        cache.put(c, [3], 10)
+        # 最久未使用的`b`被淘汰
+        self.assertEqual((cache.get(b), cache.get(a)), ((False, None), (True, [1])))
+        with mock.patch('pyava.agent.time.monotonic', return_value=time.monotonic() + 11):
+            self.assertEqual(cache.get(a), (False, None))
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 2, 'size': 1})
+
+    def test_values_are_copied(self) -> None:
+        key = CACHE.key('s', 'data')
+        CACHE.put(key, value := {'k': [1]}, 10)
+        value['k'].append(2)
+        CACHE.get(key)[1]['k'].append(3)
+        self.assertEqual(CACHE.get(key), (True, {'k': [1]}))
+
+    def test_cached_unwrap(self) -> None:
+        node = lambda: Class('java.util.Arrays').asList(1, 2).size()
+        self.assertEqual([node().cached(60).unwrap() for _ in range(3)], [2, 2, 2])
+        self.assertEqual(len(self.agent.requests), 1)
+        node().unwrap()
+        self.assertEqual(len(self.agent.requests), 2)
+        with Batch():
+            deferred = node().cached(60).unwrap()
+        self.assertEqual((deferred.value, len(self.agent.requests)), (2, 2))
+        # 其他agent不共享缓存
+        with CountingAgent() as other:
+            node().cached(60).unwrap()
+        self.assertEqual(len(other.requests), 1)
+
+    def test_errors_are_not_cached(self) -> None:
+        for _ in range(2):
+            with self.assertRaises(AgentError):
+                Class('x.Missing').foo().cached(60).unwrap()
+        self.assertEqual(len(self.agent.requests), 2)
+
+
+class ChunkedTest(unittest.TestCase):
+
+    def scope(self, n: int = 40) -> Scope:
+        li = Class('java.util.ArrayList').getDeclaredConstructor().newInstance()
+        scope = Scope()
+        scope(li)
+        for i in range(n):
+            scope(li.add(i))
+        return scope(li.size())
+
+    def test_chunks_share_locals(self) -> None:
+        agent = CountingAgent()
+        agent.limit = 400
+        with agent:
+            self.assertEqual(self.scope().unwrap(), 40)
+        self.assertGreater(len(agent.requests), 1)
+        # 限制作用于整个请求，包括每段重复发送的会话信息和符号表
+        for data in agent.requests:
+            self.assertIn('symbols', json.loads(data))
+            self.assertLessEqual(len(data.encode()), 400)
+        # 最后一段关闭分段后不保留会话
+        self.assertEqual(agent.sessions, {})
+
+    def test_stateless_agent_is_not_chunked(self) -> None:
+        agent = StatelessAgent()
+        agent.limit = 200
+        with agent:
+            self.assertEqual(self.scope().unwrap(), 40)
+        self.assertEqual(len(agent.requests), 1)
+
+
+class PinTest(unittest.TestCase):
+
+    def test_pin_release(self) -> None:
+        agent = CountingAgent()
+        with agent:
+            handle = Class('java.util.Arrays').asList(1, 2, 3).pin()
+            self.assertEqual(handle.size().unwrap(), 3)
+            self.assertEqual(len(agent.sessions[agent.session].handles), 1)
+            handle.release()
+            handle.release()
+        self.assertEqual(agent.sessions, {})
+        self.assertEqual(agent.handles, {})
+        self.assertEqual(len(agent.requests), 3)
+
+    def test_stateless_agent(self) -> None:
+        agent = StatelessAgent()
+        with agent, self.assertRaises(AgentError):
+            Class('java.util.Arrays').asList(1, 2, 3).pin()
+        self.assertEqual((agent.requests, agent.handles), ([], {}))
+
+
+class FieldTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.agent = CountingAgent()
+        for name, type in (('x.Base', Base), ('x.Player', Player), ('x.Manager', Manager)):
+            self.agent.register(name, type)
+        Manager.players = [Player(i) for i in range(5)]
+        self.agent.__enter__()
+
+    def tearDown(self) -> None:
+        self.agent.__exit__(None, None, None)
+
+    def test_inherited_field(self) -> None:
+        player = Class('x.Manager')['players'].get(2)
+        self.assertEqual((player['id'].unwrap(), player['base'].unwrap()), (2, 1))
+        self.assertEqual(Class('x.Manager')['tag'].unwrap(), 'T')
+        # 每次读取只需要一次请求，相同的查找生成相同的请求数据
+        self.assertEqual(len(self.agent.requests), 3)
+        self.assertEqual(Jsonify.dumps(player['base']), Jsonify.dumps(player['base']))
+        with self.assertRaises(AgentError):
+            player['missing'].unwrap()
+
+    def players(self) -> Iter:
+        return Iter(Class('x.Manager')['players'])
+
+    def test_select(self) -> None:
+        it = self.players().select('id', 'base', 'missing')
+        li = it.tolist()
+        self.assertEqual(Scope()(li)(it)(li).unwrap(), [{'id': i, 'base': 1} for i in range(5)])
+        self.assertEqual(list(self.players().select('id').pages(size=3)), [[{'id': i} for i in range(3)], [{'id': 3}, {'id': 4}]])
+
+    def test_select_looks_up_once_per_class(self) -> None:
+        def lookups(players: List[Base]) -> int:
+            Manager.players = players
+            it = self.players().select('id', 'base')
+            li = it.tolist()
+            with mock.patch.object(LocalClass, '_getDeclaredFields', autospec=True,
+                                   side_effect=LocalClass._getDeclaredFields) as fields:
+                rows = Scope()(li)(it)(li).unwrap()
+            self.assertEqual(rows, [{'id': p.id, 'base': 1} if isinstance(p, Player) else {'base': 1} for p in players])
+            return fields.call_count
+
+        once = lookups([Player(0)])
+        self.assertEqual(lookups([Player(i) for i in range(5)]), once)
+        # 不同类的元素分别查找
+        self.assertGreater(lookups([Player(0), Base(), Player(1)]), once)
+
+    def test_projection_is_opt_in(self) -> None:
+        with Projection('id'):
+            it = Iter((0, 3))
+            li = it.tolist()
+            self.assertEqual(Scope()(li)(it)(li).unwrap(), [0, 1, 2])
+            it = self.players().project()
+            li = it.tolist()
+            self.assertEqual(Scope()(li)(it)(li).unwrap(), [{'id': i} for i in range(5)])
+
+    def test_batch_writes(self) -> None:
+        player = Class('x.Manager')['players'].get(1)
+        with player.batch() as batch:
+            player.id = 10
+            player['base'] = 5
+        self.assertEqual(batch.results, {'id': True, 'base': True})
+        self.assertEqual((Manager.players[1].id, Manager.players[1].base), (10, 5))
+        self.assertEqual(len(self.agent.requests), 1)
+        # 不存在的字段不影响其他字段的写入
+        with self.assertRaises(AttributeError):
+            with player.batch():
+                player['id'] = 11
+                player['missing'] = 0
+        self.assertEqual(Manager.players[1].id, 11)
+        player['base'] = 6
+        self.assertEqual(Manager.players[1].base, 6)
+
+
+class WriterTest(unittest.TestCase):
+
+    @staticmethod
+    def reference(chains, symbols: bool = False) -> str:
+        '''基于`json.JSONEncoder`的原始序列化'''
+        table = {} if symbols else None
+        text = json.dumps(transmute(chains, markers := {}), cls=Jsonify, separators=(',', ':'),
+                          markers=markers, symbols=table)
+        if table:
+            text = '{"symbols":' + json.dumps(list(table), separators=(',', ':')) + ',' + text[1:]
+        return text
+
+    def chains(self):
+        shared = Class('java.util.Arrays').asList(1, 'x"y', None, 1.5, ['ü', {'k': True}])
+        scope = Scope()
+        scope(shared)
+        scope(Iter(shared).foreach(Class('java.lang.String').valueOf(Iter.Each)))
+        scope(shared.size(), mark=True)
+        scope(Class('java.lang.Integer').valueOf(2 ** 40).hashCode())
+        return scope.chains
+
+    @staticmethod
+    def nested(depth: int, kind: str):
+        node = Class('x.A').leaf()
+        for _ in range(depth):
+            if kind == 'arg':
+                node = Class('x.A').f(node)
+            elif kind == 'list':
+                node = Class('x.A').f([1, {'k': node}])
+            else:
+                node = IfElse(node).ifTrue(Class('x.A').x())
+        return node
+
+    def test_bytes_equal(self) -> None:
+        for symbols in (False, True):
+            self.assertEqual(Jsonify.dumps(self.chains(), symbols), self.reference(self.chains(), symbols))
+        node = Class('java.lang.Math').max(1, 2)
+        self.assertEqual(Jsonify.dumps(node), self.reference(node))
+
+    def test_deep_nesting(self) -> None:
+        for kind in ('arg', 'list', 'if'):
+            with self.subTest(kind=kind):
+                node = self.nested(100, kind)
+                self.assertEqual(Jsonify.dumps(node, True), self.reference(node, True))
+                # 写入器不递归，嵌套深度不受解释器递归深度的限制
+                self.assertEqual(Jsonify.dumps(self.nested(5000, kind)).count('"leaf"'), 1)
+
+
+class MergerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        Registry.map = {'k': 1}
+        self.agent = LocalAgent()
+        self.agent.register('x.Registry', Registry, statics=Registry)
+
+    def test_merge_pure_chains(self) -> None:
+        get = lambda: Class('x.Registry').getMap().get('k')
+        merged = optimize([get(), get().hashCode()])
+        self.assertEqual(Jsonify.dumps(merged).count('getMap'), 1)
+        self.assertEqual(Jsonify.dumps(merged).count('"get"'), 1)
+
+    def test_impure_is_not_merged(self) -> None:
+        get = lambda: Class('x.Registry').getMap().get('k')
+        merged = optimize([get().impure(), get().impure()])
+        self.assertEqual(Jsonify.dumps(merged).count('"get"'), 2)
+        merged = optimize([Class('x.Registry').getMap().clear(), Class('x.Registry').getMap().clear()])
+        self.assertEqual(Jsonify.dumps(merged).count('"clear"'), 2)
+
+    def test_side_effect_invalidates(self) -> None:
+        registry = lambda: Class('x.Registry').getMap()
+        a, b, c = registry().get('k'), registry().get('k'), registry().get('k')
+        fronts = (a._front, b._front, c._front)
+        scope = Scope()
+        scope(a, mark=True)(b, mark=True)(registry().put('k', 2))(c, mark=True)(registry().get('k').hashCode(), mark=True)
+        scope.optimize()
+        with self.agent:
+            self.assertEqual(scope.unwrap(), [1, 1, 2, 2])
+        # 合并在副本上进行
+        self.assertEqual((a._front, b._front, c._front), fronts)
+
+
+class SymbolsTest(unittest.TestCase):
+
+    def chains(self):
+        li = Class('java.util.ArrayList').getDeclaredConstructor().newInstance()
+        scope = Scope()
+        scope(li)
+        for i in range(10):
+            scope(li.add(Class('java.lang.Integer').valueOf(i)))
+        return scope(li.size())
+
+    def test_names_are_interned(self) -> None:
+        payload = json.loads(Jsonify.dumps(self.chains().chains, True))
+        self.assertEqual(payload['symbols'], ['java.util.ArrayList', 'getDeclaredConstructor', 'newInstance',
+                                              'add', 'java.lang.Integer', 'valueOf', 'size'])
+        self.assertNotIn('java.lang.Integer', json.dumps(payload['chains']))
+        self.assertLess(len(Jsonify.dumps(self.chains().chains, True)), len(Jsonify.dumps(self.chains().chains)))
+
+    def test_agent_resolves_symbols(self) -> None:
+        with CountingAgent() as agent:
+            self.assertEqual(self.chains().unwrap(), 10)
+        self.assertIn('"symbols"', agent.requests[0])
+
+
+class FlattenTest(unittest.TestCase):
+
+    def test_long_chain(self) -> None:
+        '''调用链长度不受递归深度限制'''
+        node = Class('java.lang.StringBuilder')
+        for i in range(20000):
+            node = node.append(i)
+        self.assertEqual(len(flatten(node)), 20001)
+        payload = json.loads(Jsonify.dumps(node))
+        self.assertEqual(len(payload['chains']), 20001)
+        self.assertEqual(len(flatten(optimize(node))), 20001)
+
+
+class SlotsTest(unittest.TestCase):
+
+    def nodes(self):
+        node = Class('java.util.Arrays').asList(1, 2)
+        return [node, node._front, Iter(node), IfElse(node.isEmpty()), IfElse(node)._ref, Scope(), Placeholder('p')]
+
+    def test_no_instance_dict(self) -> None:
+        for node in self.nodes():
+            with self.subTest(type=type(node).__name__):
+                with self.assertRaises(AttributeError):
+                    object.__getattribute__(node, '__dict__')
+                # 基类已声明的属性不在子类中重复占用槽位
+                slots = [name for cls in type(node).__mro__ for name in cls.__dict__.get('__slots__', ())]
+                self.assertEqual(len(slots), len(set(slots)))
+
+    def test_attribute_routing(self) -> None:
+        node = Class('java.util.Arrays').asList(1, 2)
+        node._local = 'x'
+        self.assertEqual(node._local, 'x')
+        # 非节点属性仍然视为远程对象的字段
+        self.assertEqual(node.size._name, 'size')
+        clone = copy.deepcopy(node)
+        self.assertEqual((clone._local, clone._name, clone._args), ('x', 'asList', (1, 2)))
+        self.assertIsNot(clone._front, node._front)
+
+
+class PreparedTest(unittest.TestCase):
+
+    @staticmethod
+    def chain(n, items):
+        return Class('java.util.Arrays').asList(n, items, n).size()
+
+    def test_bind_matches_serialization(self) -> None:
+        prepared = self.chain(Placeholder('n'), Placeholder('items')).prepare(items=[])
+        self.assertEqual(prepared.names, {'n', 'items'})
+        for n, items in ((1, []), ('a"b', ['ü', None]), (2 ** 40, {'k': 1.5})):
+            self.assertEqual(prepared.bind(n=n, items=items), Jsonify.dumps(self.chain(n, items)))
+            self.assertEqual(wire.unpackb(prepared.bindb(n=n, items=items)), wire.unpackb(Jsonify.packb(self.chain(n, items))))
+        self.assertEqual(prepared.bind(n=0), Jsonify.dumps(self.chain(0, [])))
+
+    def test_invalid_values(self) -> None:
+        prepared = self.chain(Placeholder('n'), 0).prepare()
+        with self.assertRaises(ValueError):
+            prepared.bind()
+        with self.assertRaises(ValueError):
+            prepared.bind(n=1, other=2)
+        with self.assertRaises(TypeError):
+            prepared.bind(n=Class('java.lang.Integer'))
+        with self.assertRaises(ValueError):
+            self.chain(0, 0).prepare(n=1)
+
+    def test_unwrap(self) -> None:
+        prepared = self.chain(Placeholder('n'), 0).prepare()
+        with LocalAgent():
+            self.assertEqual([prepared.unwrap(n=n) for n in range(3)], [3, 3, 3])
+
+
+class LocalServerTest(unittest.TestCase):
+
+    def test_http(self) -> None:
+        with LocalAgent().serve(port=0) as server, HttpAgent(server.url, pool=HttpPool()):
+            self.assertEqual(Class('java.util.Arrays').asList(1, 2).size().unwrap(), 2)
+
+
+class IterTest(unittest.TestCase):
+
+    values = [5, 3, 8, 1, 8, 2]
+
+    def setUp(self) -> None:
+        self.agent = CountingAgent()
+        self.agent.__enter__()
+
+    def tearDown(self) -> None:
+        self.agent.__exit__(None, None, None)
+
+    def iter(self) -> Iter:
+        return Iter(Class('java.util.Arrays').asList(*self.values))
+
+    def test_aggregations(self) -> None:
+        self.assertEqual(self.iter().count().unwrap(), len(self.values))
+        self.assertEqual(self.iter().sum().unwrap(), sum(self.values))
+        self.assertEqual(self.iter().min().unwrap(), min(self.values))
+        self.assertEqual(self.iter().max().unwrap(), max(self.values))
+        self.assertEqual(self.iter().topN(3).unwrap(), [8, 8, 5])
+        self.assertEqual(self.iter().groupBy(lambda Each: Each.hashCode()).count().unwrap(),
+                         {'5': 1, '3': 1, '8': 2, '1': 1, '2': 1})
+        self.assertIsNone(Iter(Class('java.util.Arrays').asList()).max().unwrap())
+
+    def test_over(self) -> None:
+        self.assertEqual(Iter.over(self.values, lambda Each: Class('java.lang.Integer').valueOf(Each).hashCode()).unwrap(),
+                         self.values)
+        self.assertEqual(len(self.agent.requests), 1)
+
+    def test_pages(self) -> None:
+        pages = list(self.iter().pages(size=4))
+        self.assertEqual(pages, [self.values[:4], self.values[4:]])
+        # 游标请求、两页、释放请求
+        self.assertEqual(len(self.agent.requests), 4)
+        self.assertEqual(self.agent.sessions, {})
+
+    def test_pages_closed_early(self) -> None:
+        pages = self.iter().pages(size=2)
+        self.assertEqual(next(pages), self.values[:2])
+        pages.close()
+        self.assertEqual(self.agent.sessions, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from pyava import Class
+from pyava.agent import ACCEPT_ENCODING, ENCODERS, HttpAgent, HttpPool, zstandard
+from pyava.local import DECODERS, LocalAgent
+
+
+def payload(n: int = 2000):
+    '''足够大、可以触发双向压缩的调用链'''
+    return Class('java.util.Arrays').asList(*range(n))
+
+
+class CompressionTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.server = LocalAgent().serve(port=0).start()
+        self.pool = HttpPool()
+
+    def tearDown(self) -> None:
+        self.server.stop()
+        self.pool.close()
+
+    def roundtrip(self, encoding: str) -> None:
+        with mock.patch.dict(ENCODERS, {name: ENCODERS[name] for name in ENCODERS if name in ('gzip', encoding)}, clear=True), \
+                HttpAgent(self.server.url, pool=self.pool, binary=False, compress=256):
+            payload(1).unwrap()
+            self.assertEqual(self.pool.encoding(self.server.url), encoding)
+            self.assertEqual(payload().unwrap(), list(range(2000)))
+        self.assertEqual(self.server.encodings[f'request:{encoding}'], 1)
+        # 响应体只使用urllib3能够解压的编码
+        self.assertEqual(self.server.encodings[f'response:{encoding if encoding in ACCEPT_ENCODING else "gzip"}'], 1)
+
+    def test_gzip(self) -> None:
+        self.roundtrip('gzip')
+
+    @unittest.skipIf(zstandard is None, 'zstandard is not installed')
+    def test_zstd(self) -> None:
+        self.roundtrip('zstd')
+
+    def test_codecs_are_thread_safe(self) -> None:
+        bodies = [bytes(range(256)) * (i + 1) for i in range(64)]
+        for encoding, encode in ENCODERS.items():
+            decode = DECODERS[encoding]
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                self.assertEqual(list(executor.map(lambda body: decode(encode(body)), bodies)), bodies, encoding)
+
+    def test_small_body_is_not_compressed(self) -> None:
+        with HttpAgent(self.server.url, pool=self.pool, binary=False):
+            payload(1).unwrap()
+            payload(10).unwrap()
+        self.assertEqual(self.server.encodings['request:identity'], 2)
+        self.assertEqual(self.server.encodings['response:identity'], 2)
+
+    def test_unsupported_encoding_falls_back(self) -> None:
+        with HttpAgent(self.server.url, pool=self.pool, binary=False, compress=256):
+            payload(1).unwrap()
+            # 客户端误以为agent支持的编码：agent返回415后重新协商并且不压缩重发
+            self.pool._encodings[self.server.url] = 'unknown'
+            with mock.patch.dict(ENCODERS, {'unknown': lambda body: b'garbage'}):
+                self.assertEqual(payload().unwrap(), list(range(2000)))
+        self.assertEqual(self.server.encodings['request:identity'], 2)
+        self.assertNotEqual(self.pool.encoding(self.server.url), 'unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
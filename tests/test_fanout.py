@@ -0,0 +1,66 @@
+import threading
+import unittest
+
+from pyava import Class
+from pyava.agent import Agent, fanout
+from pyava.local import LocalAgent
+
+
+def size(n: int = 3) -> int:
+    return Class('java.util.Arrays').asList(*range(n)).size().unwrap()
+
+
+class FanoutTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.servers = [LocalAgent().serve(port=0).start() for _ in range(3)]
+
+    def tearDown(self) -> None:
+        for server in self.servers:
+            server.stop()
+
+    def test_results_in_order(self) -> None:
+        urls = [server.url for server in self.servers]
+
+        def code(n: int) -> str:
+            self.assertEqual(size(n), n)
+            return Agent._SHARED.url
+
+        results = fanout(code, urls, kwargs={'n': 4}, workers=2)
+        self.assertEqual([result['data'] for result in results], urls)
+        self.assertTrue(all(result['code'] == 200 and result['elapsed'] >= 0 for result in results))
+
+    def test_failures_are_isolated(self) -> None:
+        urls = [self.servers[0].url, 'http://127.0.0.1:1/unreachable']
+        ok, failed = fanout(size, urls, args=(2,), timeout=1)
+        self.assertEqual((ok['code'], ok['data']), (200, 2))
+        self.assertEqual(failed['code'], 500)
+        self.assertIn('message', failed)
+        self.assertEqual(fanout(size, []), [])
+
+
+class AgentScopeTest(unittest.TestCase):
+
+    def test_nested_agents_restore(self) -> None:
+        outer, inner = LocalAgent(), LocalAgent()
+        with outer:
+            with inner:
+                self.assertIs(Agent._SHARED, inner)
+            self.assertIs(Agent._SHARED, outer)
+        self.assertIsNone(Agent._SHARED)
+
+    def test_threads_are_isolated(self) -> None:
+        seen = []
+        with LocalAgent():
+            thread = threading.Thread(target=lambda: seen.append(Agent._SHARED))
+            thread.start()
+            thread.join()
+        self.assertEqual(seen, [None])
+
+    def test_requires_agent(self) -> None:
+        with self.assertRaises(TypeError):
+            LocalAgent()._SHARED = object()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+from unittest import mock
+
+from pyava import Class
+from pyava.agent import ENCODERS, HttpAgent, HttpPool
+from pyava.local import LocalAgent
+
+try:
+    import django
+except ImportError:
+    django = None
+
+
+class HttpPoolTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.server = LocalAgent().serve(port=0).start()
+        self.pool = HttpPool(idle=60)
+
+    def tearDown(self) -> None:
+        self.server.stop()
+        self.pool.close()
+
+    def test_session_is_shared(self) -> None:
+        url = self.server.url
+        session = self.pool.acquire(url)
+        self.pool.release(url)
+        self.assertIs(self.pool.session(url), session)
+        self.assertEqual(len(self.pool), 1)
+
+    def test_leased_session_is_not_evicted(self) -> None:
+        url = self.server.url
+        session = self.pool.acquire(url)
+        with mock.patch('pyava.agent.time.monotonic', return_value=self.pool._actives[url] + 120):
+            self.pool.evict()
+            self.assertEqual(len(self.pool), 1)
+            self.pool.release(url)
+        # 空闲时间从归还时开始计算
+        with mock.patch('pyava.agent.time.monotonic', return_value=self.pool._actives[url] + 120):
+            self.pool.evict()
+        self.assertEqual(len(self.pool), 0)
+        self.assertIsNot(self.pool.session(url), session)
+
+    def test_requests_reuse_pool(self) -> None:
+        with HttpAgent(self.server.url, pool=self.pool):
+            for i in range(3):
+                self.assertEqual(Class('java.util.Arrays').asList(*range(i)).size().unwrap(), i)
+        self.assertEqual(len(self.pool), 1)
+        self.assertEqual(self.pool._leases, {})
+
+    def test_prewarm_advertises(self) -> None:
+        url = self.server.url
+        self.pool.prewarm(url, 'http://127.0.0.1:1/unreachable', timeout=1)
+        self.assertTrue(self.pool.symbols(url))
+        self.assertTrue(self.pool.stateful(url))
+        self.assertEqual(self.pool.encoding(url), list(ENCODERS)[-1])
+        self.assertFalse(self.pool.symbols('http://127.0.0.1:1/unreachable'))
+
+
+@unittest.skipIf(django is None, 'django is not installed')
+class AppsPrewarmTest(unittest.TestCase):
+
+    def test_prewarm_once_after_first_request(self) -> None:
+        from django.conf import settings
+        if not settings.configured:
+            settings.configure(INSTALLED_APPS=['back'],
+                               DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}})
+            django.setup()
+        from django.apps import apps
+        from django.core.signals import request_started
+        from django.test import override_settings
+
+        config = apps.get_app_config('back')
+        with override_settings(AGENT_POOL={'prewarm': True}), mock.patch('threading.Thread') as thread:
+            config.ready()
+            thread.assert_not_called()
+            request_started.send(sender=None)
+            request_started.send(sender=None)
+        # 只在第一个请求后预热一次，应用初始化期间不访问数据库
+        thread.assert_called_once_with(target=config.prewarm, daemon=True)
+        thread.return_value.start.assert_called_once_with()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+
+from pyava import Class
+from pyava.agent import CACHE, TIMINGS, AgentError, HttpAgent, HttpPool, Histogram, Timing, TimingLabel
+from pyava.local import LocalAgent
+
+
+class RecordingAgent(LocalAgent):
+    '''记录每次请求的数据'''
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.requests = []
+
+    def debug(self, data):
+        self.requests.append(data)
+        return super().debug(data)
+
+
+def echo(text: str):
+    return Class('java.lang.String').valueOf(text)
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_sub_millisecond(self) -> None:
+        histogram = Histogram()
+        for i in range(1, 101):
+            histogram.add(i / 1e6)
+        # 亚毫秒的耗时分布在不同的桶内，分位数不再是最小桶的上界
+        self.assertEqual(len([count for count in histogram.counts if count]), 7)
+        self.assertTrue(2.5e-5 <= histogram.quantile(0.5) <= 1e-4)
+        self.assertLessEqual(histogram.quantile(0.99), 1e-4)
+        self.assertEqual((histogram.min, histogram.max), (1e-6, 1e-4))
+
+    def test_quantile_is_clamped(self) -> None:
+        histogram = Histogram()
+        self.assertEqual(histogram.quantile(0.5), 0.0)
+        for _ in range(10):
+            histogram.add(0.003)
+        self.assertEqual([histogram.quantile(q) for q in (0, 0.5, 1)], [0.003] * 3)
+        histogram.add(20)
+        self.assertEqual(histogram.quantile(1), 20)
+        self.assertEqual(histogram.json()['buckets'], {'0.005': 10, 'inf': 1})
+
+
+class TimingTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        TIMINGS.clear()
+
+    def tearDown(self) -> None:
+        TIMINGS.clear()
+
+    def test_phases(self) -> None:
+        agent, timings = RecordingAgent(), []
+        TIMINGS.hook(timings.append)
+        try:
+            with TimingLabel('echo'), agent:
+                self.assertEqual(echo('中文').unwrap(), '中文')
+                self.assertEqual(echo('ascii').unwrap(), 'ascii')
+        finally:
+            TIMINGS.unhook(timings.append)
+        self.assertEqual(len(timings), 2)
+        for timing, data in zip(timings, agent.requests):
+            self.assertEqual((timing.tool, timing.server, timing.code), ('echo', agent.label, 200))
+            self.assertEqual(set(timing.phases), {'build', 'serialize', 'network'})
+            self.assertAlmostEqual(sum(timing.phases.values()), timing.total)
+            # 请求大小按字节计算
+            self.assertEqual(timing.request, len(data.encode()))
+        self.assertIsNone(Timing.current())
+
+    def test_request_bytes(self) -> None:
+        timing = Timing.dispatch('local', '{"ref":"中文"}')
+        timing.finish({'code': 200})
+        self.assertEqual(timing.request, len('{"ref":"中文"}'.encode()))
+        self.assertEqual(TIMINGS.stats(server='local')[0]['request'], 16)
+
+    def test_stats(self) -> None:
+        with TimingLabel('echo'), LocalAgent() as agent:
+            echo('a').unwrap()
+            echo('b').cached().unwrap()
+            # 命中缓存的调用不发出请求，不计入统计
+            echo('b').cached().unwrap()
+        CACHE.clear()
+        group, = TIMINGS.stats(tool='echo')
+        self.assertEqual((group['server'], group['errors']), (agent.label, 0))
+        self.assertEqual(group['total']['count'], 2)
+        self.assertEqual(set(group['phases']), {'build', 'serialize', 'network'})
+        self.assertEqual(group['phases']['network']['count'], 2)
+        self.assertLessEqual(group['total']['p50'], group['total']['max'])
+        self.assertEqual(TIMINGS.stats(tool='other'), [])
+        self.assertEqual(TIMINGS.stats(server=agent.label), [group])
+
+    def test_http_decode(self) -> None:
+        server, pool = LocalAgent().serve(port=0).start(), HttpPool()
+        try:
+            with HttpAgent(server.url, pool=pool):
+                echo('x').unwrap()
+                with self.assertRaises(AgentError):
+                    Class('x.Missing').foo().unwrap()
+        finally:
+            server.stop()
+            pool.close()
+        group, = TIMINGS.stats(server=server.url)
+        self.assertEqual((group['total']['count'], group['errors']), (2, 1))
+        self.assertIn('decode', group['phases'])
+        self.assertGreater(group['response'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+from unittest import mock
+
+import requests
+
+from pyava import Class, wire
+from pyava.agent import HttpAgent, HttpPool
+from pyava.local import LocalAgent
+
+
+class RecordingAgent(LocalAgent):
+    '''记录每次请求的传输格式'''
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.formats = []
+
+    def debug(self, data):
+        self.formats.append('binary' if isinstance(data, bytes) else 'json')
+        return super().debug(data)
+
+
+class WireTest(unittest.TestCase):
+
+    values = [None, True, False, 0, 127, -32, -33, 255, 65536, 2 ** 40, -2 ** 40, 1.5, '', 'ü中' * 20, 'x' * 70000,
+              [], [1, [2, [3]]], {}, {'k': {'n': [None]}}, list(range(20)), {str(i): i for i in range(20)}]
+
+    def test_roundtrip(self) -> None:
+        for value in self.values:
+            self.assertEqual(wire.unpackb(wire.packb(value)), value)
+            self.assertEqual(wire._unpack(wire._pack(value)), value)
+
+    @unittest.skipIf(wire.msgpack is None, 'msgpack is not installed')
+    def test_fallback_matches_msgpack(self) -> None:
+        for value in self.values:
+            self.assertEqual(wire._pack(value), wire.msgpack.packb(value, use_bin_type=True))
+
+
+class NegotiationTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.agent = RecordingAgent()
+        self.server = self.agent.serve(port=0).start()
+        self.pool = HttpPool()
+
+    def tearDown(self) -> None:
+        self.server.stop()
+        self.pool.close()
+
+    def size(self, n: int = 3) -> int:
+        return Class('java.util.Arrays').asList(*range(n)).size().unwrap()
+
+    def test_negotiate_binary(self) -> None:
+        with mock.patch.object(wire, 'NATIVE', True), HttpAgent(self.server.url, pool=self.pool, binary=True) as agent:
+            self.assertEqual([self.size(), self.size()], [3, 3])
+            self.assertTrue(agent.binary)
+        # 第一次请求通过Accept协商，之后改用二进制格式发送
+        self.assertEqual(self.agent.formats, ['json', 'binary'])
+
+    def test_json_without_native(self) -> None:
+        with mock.patch.object(wire, 'NATIVE', False), HttpAgent(self.server.url, pool=self.pool, binary=True) as agent:
+            self.assertEqual([self.size(), self.size()], [3, 3])
+            self.assertFalse(agent.binary)
+        self.assertEqual(self.agent.formats, ['json', 'json'])
+
+    def test_unsupported_binary_falls_back(self) -> None:
+        post, types = requests.Session.post, []
+
+        def reject_binary(session, url, data=None, headers=None, **kwargs):
+            '''模拟不支持二进制格式的agent：拒绝二进制请求体，只以JSON格式响应'''
+            types.append(headers['Content-Type'])
+            if headers['Content-Type'] == wire.CONTENT_TYPE:
+                r = requests.Response()
+                r.status_code, r._content, r._content_consumed = 415, b'', True
+                return r
+            return post(session, url, data=data, headers={**headers, 'Accept': 'application/json'}, **kwargs)
+
+        with mock.patch.object(wire, 'NATIVE', True), HttpAgent(self.server.url, pool=self.pool, binary=True) as agent:
+            self.size()
+            with mock.patch.object(requests.Session, 'post', reject_binary):
+                # agent返回415后以JSON格式重新发送，之后不再使用二进制格式
+                self.assertEqual([self.size(4), self.size(5)], [4, 5])
+            self.assertFalse(agent.binary)
+        self.assertEqual(types, [wire.CONTENT_TYPE, 'application/json', 'application/json'])
+
+
+if __name__ == '__main__':
+    unittest.main()